@@ -0,0 +1,194 @@
+import logging
+from datetime import date
+from typing import Dict, List
+
+from aiogram import Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, Filter
+from aiogram.types import FSInputFile, Message
+
+from app.broadcast import Broadcaster
+from app.generate import answer_cache, router_cache
+from app.profiling import Profiler, PROFILE_SECONDS, MAX_PROFILE_SECONDS
+from app.streaming import stream_metrics
+from app.database.broadcast_storage import BroadcastStorage
+from app.database.chat_storage import ChatStorage
+from app.database.user_storage import UserStorage
+
+try:
+    from config import ADMIN_IDS
+except ImportError:
+    ADMIN_IDS = []
+
+logger = logging.getLogger(__name__)
+
+# За сколько дней /stats показывает сводку по умолчанию и максимум
+STATS_DAYS = 7
+MAX_STATS_DAYS = 90
+
+
+class IsAdmin(Filter):
+    """Пропускает только пользователей из ADMIN_IDS (config.py)"""
+
+    async def __call__(self, message: Message) -> bool:
+        return message.from_user is not None and message.from_user.id in ADMIN_IDS
+
+
+admin_router = Router()
+admin_router.message.filter(IsAdmin())
+
+
+@admin_router.message(Command('broadcast'))
+async def cmd_broadcast(
+    message: Message,
+    command: CommandObject,
+    broadcaster: Broadcaster,
+    broadcast_storage: BroadcastStorage
+):
+    if not command.args:
+        await message.answer("Использование: /broadcast текст сообщения (HTML)")
+        return
+
+    # Предпросмотр админу: если Telegram не принимает разметку (незакрытый тег),
+    # рассылка упала бы на каждом пользователе и ушла бы в failed без повтора
+    try:
+        await message.answer(command.args, parse_mode='HTML')
+    except TelegramBadRequest as e:
+        await message.answer(f"❌ Telegram не принял текст рассылки, она не запущена:\n{e.message}", parse_mode=None)
+        return
+
+    try:
+        broadcast_id = await broadcast_storage.create(command.args, message.from_user.id)
+        if broadcast_id is None:
+            running = await broadcast_storage.get_unfinished()
+            running_id = running[0]['id'] if running else '?'
+            await message.answer(
+                f"⏳ Уже идет рассылка #{running_id}. Дождитесь ее окончания "
+                f"или остановите: /broadcast_cancel {running_id}"
+            )
+            return
+        broadcaster.start(message.bot, broadcast_id)
+        await message.answer(f"📣 Рассылка #{broadcast_id} запущена. Прогресс: /broadcast_status {broadcast_id}")
+    except Exception as e:
+        logger.error(f'Ошибка при /broadcast: {e}', exc_info=True)
+        await message.answer("❌ Не удалось запустить рассылку.")
+
+
+@admin_router.message(Command('broadcast_status'))
+async def cmd_broadcast_status(message: Message, command: CommandObject, broadcast_storage: BroadcastStorage):
+    if not command.args or not command.args.isdigit():
+        await message.answer("Использование: /broadcast_status ID")
+        return
+
+    broadcast = await broadcast_storage.get(int(command.args))
+    if not broadcast:
+        await message.answer("Рассылка не найдена.")
+        return
+
+    await message.answer(
+        f"📣 Рассылка #{broadcast['id']}: {broadcast['status']}\n"
+        f"├ Отправлено: {broadcast['sent']}\n"
+        f"├ Заблокировали бота: {broadcast['blocked']}\n"
+        f"├ Ошибок: {broadcast['failed']}\n"
+        f"└ Последний пользователь: {broadcast['last_user_id']}"
+    )
+
+
+@admin_router.message(Command('broadcast_cancel'))
+async def cmd_broadcast_cancel(message: Message, command: CommandObject, broadcaster: Broadcaster):
+    if not command.args or not command.args.isdigit():
+        await message.answer("Использование: /broadcast_cancel ID")
+        return
+
+    if await broadcaster.cancel(int(command.args)):
+        await message.answer("Рассылка остановлена.")
+    else:
+        await message.answer("Активная рассылка с таким ID не найдена.")
+
+
+@admin_router.message(Command('profile'))
+async def cmd_profile(message: Message, command: CommandObject, profiler: Profiler):
+    if not profiler.enabled:
+        await message.answer("Профилирование выключено. Запустите бота с PROFILING=1")
+        return
+    if profiler.sampler.running:
+        await message.answer("Профиль уже снимается, подождите.")
+        return
+
+    seconds = int(command.args) if command.args and command.args.isdigit() else PROFILE_SECONDS
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    await message.answer(f"🔬 Снимаю профиль {seconds} с...")
+
+    try:
+        path, samples = await profiler.profile(seconds)
+        await message.answer_document(
+            FSInputFile(path),
+            caption=f"🔬 {samples} сэмплов. Флеймграф: speedscope.app или flamegraph.pl"
+        )
+    except Exception as e:
+        logger.error(f'Ошибка при /profile: {e}', exc_info=True)
+        await message.answer("❌ Не удалось снять профиль.")
+
+
+@admin_router.message(Command('cache_stats'))
+async def cmd_cache_stats(message: Message):
+    answers = answer_cache.stats()
+    router = router_cache.stats()
+    await message.answer(
+        f"🗂 Кэш ответов: {answers['size']} записей\n"
+        f"└ Попаданий: {answers['hits']} из {answers['hits'] + answers['misses']} ({answers['hit_rate']:.0%})\n\n"
+        f"🧭 Кэш решений роутера: {router['size']} записей\n"
+        f"├ Попаданий: {router['hits']} из {router['hits'] + router['misses']} ({router['hit_rate']:.0%})\n"
+        f"└ Сэкономлено запросов к роутеру: {router['saved_seconds']:.1f} с"
+    )
+
+
+@admin_router.message(Command('stream_stats'))
+async def cmd_stream_stats(message: Message):
+    """Метрики склейки стриминга ответов с запуска процесса"""
+    stats = stream_metrics.stats()
+    await message.answer(
+        f"📦 Стримов: {stats['streams']}\n"
+        f"├ Дельт LLM: {stats['deltas']} ({stats['chars']} символов)\n"
+        f"├ Пачек: {stats['batches']}, в среднем {stats['avg_batch']:.1f} дельт\n"
+        f"├ Скорость: {stats['tokens_per_second']:.0f} ток/с\n"
+        f"└ Ожиданий обработчика: {stats['stalls']}"
+    )
+
+
+@admin_router.message(Command('stats'))
+async def cmd_stats(message: Message, command: CommandObject, storage: ChatStorage, user_storage: UserStorage):
+    """Сводка из агрегатов usage_daily и счетчиков тем: стоимость не зависит от числа пользователей"""
+    days = int(command.args) if command.args and command.args.isdigit() else STATS_DAYS
+    days = min(days, MAX_STATS_DAYS)
+
+    # Незаписанный расход этого процесса тоже должен попасть в сводку
+    await user_storage.flush_usage()
+    rows = await user_storage.get_daily_stats(days)
+    total_users = await user_storage.get_total_users()
+    threads = await storage.count_threads()
+
+    by_day: Dict[date, List[Dict]] = {}
+    for row in rows:
+        by_day.setdefault(row['day'], []).append(row)
+
+    lines = [
+        f"📈 Пользователей: {total_users}, диалогов с историей: {threads}\n",
+        "По дням (активные / новые / запросы / токены):",
+    ]
+    for day, day_rows in by_day.items():
+        lines.append(
+            f"<b>{day:%d.%m}</b>: {sum(r['active_users'] for r in day_rows)} / "
+            f"{sum(r['new_users'] for r in day_rows)} / "
+            f"{sum(r['requests'] for r in day_rows)} / {sum(r['tokens'] for r in day_rows)}"
+        )
+        for row in day_rows:
+            if row['active_users'] or row['requests']:
+                lines.append(
+                    f"└ {row['tariff_plan']}: {row['active_users']} / {row['new_users']} / "
+                    f"{row['requests']} / {row['tokens']}"
+                )
+    if not by_day:
+        lines.append("Пока нет данных.")
+
+    await message.answer("\n".join(lines), parse_mode='HTML')
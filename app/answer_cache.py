@@ -0,0 +1,99 @@
+import re
+from datetime import date
+from typing import Optional
+
+from app.cache import TTLCache
+from app.prompts import MAIN_PROMPT_VERSION
+
+# Сколько ответов хранить и сколько они живут (секунды)
+ANSWER_CACHE_SIZE = 1000
+ANSWER_CACHE_TTL = 6 * 3600
+# Слишком длинные сообщения - не "частые вопросы", их не кэшируем
+MAX_QUESTION_LENGTH = 300
+
+# Слова и числа, а из остальных символов - каждый отдельным токеном:
+# "2+2" и "2 + 2" дают одни токены, а "2+2" и "2-2" - разные
+TOKEN_RE = re.compile(r'[^\W_]+|[^\w\s]')
+# Знаки препинания, которые не меняют смысла вопроса (дефис - нет, это еще и минус)
+IGNORED_TOKENS = frozenset('.,!?;:…"\'«»“”„—–')
+# Ответ на такие вопросы зависит от текущих даты и времени (они есть в системном промпте)
+TIME_WORDS = frozenset({
+    'сегодня', 'сейчас', 'завтра', 'вчера', 'послезавтра', 'позавчера',
+    'час', 'часа', 'часов', 'время', 'времени', 'дата', 'дату', 'даты',
+    'число', 'числа', 'день', 'дня', 'дней', 'неделя', 'недели', 'неделе',
+    'месяц', 'месяца', 'год', 'года', 'году',
+    'today', 'now', 'tomorrow', 'yesterday', 'time', 'date', 'day', 'week', 'month', 'year',
+})
+
+
+def tokenize(text: str) -> list:
+    """Токены вопроса без регистра, ё и незначащей пунктуации"""
+    text = text.lower().replace('ё', 'е')
+    return [token for token in TOKEN_RE.findall(text) if token not in IGNORED_TOKENS]
+
+
+def normalize(text: str) -> str:
+    """Приводит вопрос к каноничному виду: регистр, ё, пунктуация, пробелы"""
+    return ' '.join(tokenize(text))
+
+
+class AnswerCache:
+    """
+    Кэш ответов на первые сообщения в теме без веб-поиска
+
+    Такие ответы зависят только от вопроса и системного промпта,
+    поэтому ключ - токены вопроса + версия промпта + дата из промпта:
+    после правки промпта и после полуночи старые ответы перестают находиться.
+    Похожие, но не одинаковые вопросы ("2+2" и "2+3", "кошка" и "кошки")
+    не совпадают, как и те же слова в другом порядке ("python быстрее java" и
+    "java быстрее python"): неверный ответ из кэша хуже лишнего запроса к модели
+    """
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.entries = TTLCache(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, text: str) -> bool:
+        return bool(text) and len(text) <= MAX_QUESTION_LENGTH and not text.startswith('/')
+
+    def key(self, text: str) -> Optional[tuple]:
+        """Ключ вопроса или None, если вопрос не кэшируется"""
+        if not self.is_cacheable(text):
+            return None
+        tokens = tokenize(text)
+        if not tokens or TIME_WORDS.intersection(tokens):
+            return None
+        return MAIN_PROMPT_VERSION, date.today().isoformat(), ' '.join(tokens)
+
+    def get(self, text: str) -> Optional[str]:
+        """
+        Returns:
+            str: закэшированный ответ или None
+        """
+        key = self.key(text)
+        if key is None:
+            return None
+
+        answer = self.entries.get(key)
+        if answer is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return answer
+
+    def set(self, text: str, answer: str):
+        key = self.key(text)
+        if key is None or not answer:
+            return
+        self.entries.set(key, answer)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
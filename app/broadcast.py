@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.database.broadcast_storage import BroadcastStorage
+from app.database.user_storage import UserStorage
+from app.middlewares import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Доля рассылки в общем пределе отправок (SEND_RATE в app/middlewares.py):
+# остаток достается ответам пользователям
+BROADCAST_RATE = 20
+BROADCAST_WORKERS = 10
+# Размер порции получателей; после каждой порции сохраняется чекпоинт,
+# поэтому при падении повторно могут получить сообщение максимум BATCH_SIZE человек
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 3
+
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям из таблицы users"""
+
+    def __init__(
+        self,
+        user_storage: UserStorage,
+        broadcast_storage: BroadcastStorage,
+        rate: float = BROADCAST_RATE,
+        workers: int = BROADCAST_WORKERS
+    ):
+        self.user_storage = user_storage
+        self.broadcast_storage = broadcast_storage
+        self.workers = workers
+        # Один на процесс, а не на запуск рассылки
+        self.limiter = RateLimiter(rate)
+        # broadcast_id -> задача, чтобы одна рассылка не запустилась дважды
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot, broadcast_id: int) -> bool:
+        """
+        Запускает рассылку в фоне
+
+        Returns:
+            bool: False, если рассылка уже идет
+        """
+        if broadcast_id in self.tasks:
+            return False
+
+        task = asyncio.create_task(self.run(bot, broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+        return True
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """
+        Останавливает рассылку и помечает ее отмененной
+
+        Returns:
+            bool: False, если такой рассылки нет
+        """
+        broadcast = await self.broadcast_storage.get(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return False
+
+        task = self.tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+        await self.broadcast_storage.finish(broadcast_id, 'cancelled')
+        return True
+
+    async def resume_unfinished(self, bot: Bot):
+        """Продолжает рассылки, прерванные перезапуском бота"""
+        for broadcast in await self.broadcast_storage.get_unfinished():
+            logger.info(f"📣 Продолжаю рассылку #{broadcast['id']} с пользователя {broadcast['last_user_id']}")
+            self.start(bot, broadcast['id'])
+
+    async def run(self, bot: Bot, broadcast_id: int):
+        """
+        Отправляет рассылку порциями, начиная с сохраненного чекпоинта
+        """
+        broadcast = await self.broadcast_storage.get(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return
+
+        text = broadcast['text']
+        last_user_id = broadcast['last_user_id']
+        counters = {
+            'sent': broadcast['sent'],
+            'failed': broadcast['failed'],
+            'blocked': broadcast['blocked'],
+        }
+
+        recipients = asyncio.Queue(maxsize=BATCH_SIZE)
+
+        async def worker():
+            while True:
+                user_id = await recipients.get()
+                try:
+                    counters[await self.send(bot, user_id, text)] += 1
+                finally:
+                    recipients.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.workers)]
+
+        try:
+            while True:
+                # Отмена могла прийти в другой воркер вебхук-режима - он меняет только статус в БД
+                current = await self.broadcast_storage.get(broadcast_id)
+                if not current or current['status'] != 'running':
+                    logger.info(f"📣 Рассылка #{broadcast_id} остановлена на пользователе {last_user_id}")
+                    return
+
+                user_ids = await self.user_storage.get_user_ids_after(last_user_id, BATCH_SIZE)
+                if not user_ids:
+                    break
+
+                for user_id in user_ids:
+                    await recipients.put(user_id)
+                await recipients.join()
+
+                last_user_id = user_ids[-1]
+                await self.broadcast_storage.save_progress(broadcast_id, last_user_id, **counters)
+
+            await self.broadcast_storage.finish(broadcast_id)
+            logger.info(
+                f"📣 Рассылка #{broadcast_id} завершена: отправлено {counters['sent']}, "
+                f"заблокировали бота {counters['blocked']}, ошибок {counters['failed']}"
+            )
+        except asyncio.CancelledError:
+            logger.info(f"📣 Рассылка #{broadcast_id} остановлена на пользователе {last_user_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки #{broadcast_id}: {e}", exc_info=True)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def send(self, bot: Bot, user_id: int, text: str) -> str:
+        """
+        Отправляет сообщение одному пользователю с повторами после 429
+
+        Returns:
+            str: 'sent', 'blocked' или 'failed'
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            # Темп рассылки; общий предел отправок добавляет middleware сессии бота
+            await self.limiter.wait()
+            try:
+                await bot.send_message(user_id, text, parse_mode='HTML')
+                return 'sent'
+            except TelegramRetryAfter as e:
+                logger.warning(f'Рассылка: rate limit, пауза {e.retry_after} сек')
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота или удалил аккаунт
+                return 'blocked'
+            except TelegramBadRequest as e:
+                logger.debug(f'Рассылка: не удалось отправить {user_id}: {e}')
+                return 'failed'
+            except Exception as e:
+                logger.warning(f'Рассылка: ошибка отправки {user_id} (попытка {attempt + 1}): {e}')
+                await asyncio.sleep(1)
+
+        return 'failed'
@@ -1,13 +1,107 @@
+import logging
+from abc import ABC, abstractmethod
+
+import aiosqlite
 
 DB_PATH = "database.db"
 
-class BaseStorage:
-    def __init__(self, db_path: str = DB_PATH):
+# Сколько секунд соединение ждет, пока другой процесс освободит блокировку записи
+BUSY_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+async def init_schemas(*storages: "BaseStorage"):
+    """
+    Создает таблицы всех хранилищ одной транзакцией
+
+    Вместо отдельного соединения и fsync на каждое хранилище -
+    одно соединение и один коммит (все хранилища в одном файле БД)
+    """
+    async with storages[0].connect() as conn:
+        await conn.execute("BEGIN")
+        for storage in storages:
+            await storage.create_schema(conn)
+        await conn.commit()
+
+
+class BaseStorage(ABC):
+    def __init__(self, db_path: str = DB_PATH, readonly: bool = False):
         """
         Инициализация хранилища пользователей
-        
+
         Args:
             db_path: путь к файлу базы данных
+            readonly: открывать БД только на чтение (выгрузки и аналитика
+                      рядом с работающим ботом)
         """
         self.db_path = db_path
-        
\ No newline at end of file
+        self.readonly = readonly
+
+    def connect(self):
+        """
+        Открывает соединение с БД (использовать через async with)
+
+        busy timeout нужен, когда одну БД делят несколько процессов-воркеров:
+        вместо ошибки "database is locked" писатель ждет своей очереди
+        """
+        if self.readonly:
+            return aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+        return aiosqlite.connect(self.db_path, timeout=BUSY_TIMEOUT)
+
+    @abstractmethod
+    async def create_schema(self, conn):
+        """
+        Создает таблицы хранилища на переданном соединении (без коммита)
+        """
+
+    async def init_db(self):
+        """
+        Создает таблицы хранилища
+        Вызывается один раз при старте бота
+        """
+        async with self.connect() as conn:
+            await self.create_schema(conn)
+            await conn.commit()
+
+    async def enable_wal(self):
+        """
+        Переводит БД в режим WAL и включает incremental auto_vacuum
+
+        В WAL читатели не блокируют писателя и наоборот, поэтому
+        несколько процессов могут работать с одним файлом БД.
+        Оба режима сохраняются в самом файле, достаточно включить один раз
+        (вызывать до создания таблиц)
+        """
+        async with self.connect() as conn:
+            # auto_vacuum можно включить только до создания первой таблицы
+            await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await conn.execute("PRAGMA journal_mode=WAL")
+
+            cursor = await conn.execute("PRAGMA auto_vacuum")
+            if (await cursor.fetchone())[0] != 2:
+                logger.warning(
+                    f"⚠️ В {self.db_path} выключен incremental auto_vacuum, место после очистки "
+                    f"не будет возвращаться. Один раз при остановленном боте выполните: "
+                    f"PRAGMA auto_vacuum=INCREMENTAL; VACUUM;"
+                )
+
+    async def incremental_vacuum(self, pages: int = 1000) -> int:
+        """
+        Возвращает ОС до pages свободных страниц БД
+
+        В отличие от полного VACUUM, работает небольшими шагами
+        и не блокирует бота надолго
+
+        Args:
+            pages: сколько страниц освободить за вызов
+
+        Returns:
+            int: сколько свободных страниц осталось
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            await cursor.fetchall()
+
+            cursor = await conn.execute("PRAGMA freelist_count")
+            return (await cursor.fetchone())[0]
@@ -0,0 +1,132 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+from .base import BaseStorage, DB_PATH
+
+logger = logging.getLogger(__name__)
+
+class BroadcastStorage(BaseStorage):
+    """Рассылки и их прогресс (чекпоинты для продолжения после перезапуска)"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        super().__init__(db_path)
+
+    async def create_schema(self, conn):
+        """
+        Создает таблицу рассылок
+        Вызывается один раз при старте бота
+        """
+        cursor = await conn.cursor()
+
+        # last_user_id - чекпоинт: всем пользователям с меньшим ID рассылка уже отправлена
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                created_by INTEGER,
+                created_at TEXT,
+                finished_at TEXT
+            )
+        """)
+
+    async def create(self, text: str, created_by: int) -> Optional[int]:
+        """
+        Создает новую рассылку, если другая сейчас не идет
+
+        Проверка и вставка - один запрос, так что две рассылки не запустятся,
+        даже если /broadcast пришел в разные воркеры одновременно
+
+        Args:
+            text: текст сообщения (HTML)
+            created_by: ID админа
+
+        Returns:
+            Optional[int]: ID рассылки или None, если уже идет другая
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO broadcasts (text, created_by, created_at)
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM broadcasts WHERE status = 'running')
+                RETURNING id
+            """, (text, created_by, datetime.now().isoformat()))
+            row = await cursor.fetchone()
+            await conn.commit()
+
+        if row is None:
+            return None
+        logger.info(f"📣 Создана рассылка #{row[0]}")
+        return row[0]
+
+    async def get(self, broadcast_id: int) -> Optional[Dict]:
+        """
+        Возвращает рассылку по ID или None
+        """
+        async with self.connect() as conn:
+            conn.row_factory = aiosqlite.Row
+            cursor = await conn.execute("""
+                SELECT * FROM broadcasts WHERE id = ?
+            """, (broadcast_id,))
+            row = await cursor.fetchone()
+
+        return dict(row) if row else None
+
+    async def get_unfinished(self) -> List[Dict]:
+        """
+        Возвращает рассылки, прерванные перезапуском
+        """
+        async with self.connect() as conn:
+            conn.row_factory = aiosqlite.Row
+            cursor = await conn.execute("""
+                SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id
+            """)
+            rows = await cursor.fetchall()
+
+        return [dict(row) for row in rows]
+
+    async def save_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked: int
+    ):
+        """
+        Сохраняет чекпоинт после обработанной порции получателей
+
+        Args:
+            broadcast_id: ID рассылки
+            last_user_id: последний обработанный пользователь
+            sent, failed, blocked: накопленные счетчики
+        """
+        async with self.connect() as conn:
+            await conn.execute("""
+                UPDATE broadcasts
+                SET last_user_id = ?, sent = ?, failed = ?, blocked = ?
+                WHERE id = ?
+            """, (last_user_id, sent, failed, blocked, broadcast_id))
+            await conn.commit()
+
+    async def finish(self, broadcast_id: int, status: str = 'done'):
+        """
+        Помечает рассылку завершенной
+
+        Args:
+            broadcast_id: ID рассылки
+            status: 'done' или 'cancelled'
+        """
+        async with self.connect() as conn:
+            await conn.execute("""
+                UPDATE broadcasts SET status = ?, finished_at = ?
+                WHERE id = ? AND status = 'running'
+            """, (status, datetime.now().isoformat(), broadcast_id))
+            await conn.commit()
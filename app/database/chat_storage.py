@@ -1,47 +1,142 @@
-import aiosqlite
-import json
+import asyncio
 import logging
+import time
+from typing import AsyncGenerator, Iterable, List, Optional, Set, Tuple
 
 from .base import BaseStorage, DB_PATH
+from .history_codec import encode_history, decode_history, estimate_size
+from app.serialization import offload
 
 logger = logging.getLogger(__name__)
 
+
+def recompress_rows(rows: List[tuple]) -> Tuple[List[tuple], int, int]:
+    """
+    Сжимает порцию строк со старым JSON (для recompress_batch, выполняется в потоке)
+
+    Returns:
+        tuple: (параметры UPDATE, байт до, байт после)
+    """
+    updates = []
+    bytes_before = bytes_after = 0
+    for user_id, chat_id, thread_id, messages in rows:
+        blob = encode_history(decode_history(messages))
+        bytes_before += len(messages.encode())
+        bytes_after += len(blob)
+        updates.append((blob, user_id, chat_id, thread_id, messages))
+    return updates, bytes_before, bytes_after
+
+
 class ChatStorage(BaseStorage):
     """Класс для хранения истории чатов в SQLite"""
     
-    def __init__(self, db_path: str = DB_PATH):
-        super().__init__(db_path)
+    def __init__(self, db_path: str = DB_PATH, readonly: bool = False, users_db_path: Optional[str] = None):
+        """
+        Args:
+            db_path: путь к файлу базы данных
+            readonly: открывать БД только на чтение
+            users_db_path: БД с таблицей users, если она в другом файле
+                           (шард истории, см. ShardedChatStorage)
+        """
+        super().__init__(db_path, readonly)
+        self.users_db_path = users_db_path
+        # Записи этого процесса в файл идут по очереди через блокировку,
+        # а не через ожидание busy timeout внутри SQLite
+        self._write_lock = asyncio.Lock()
 
         # При создании объекта нельзя использовать await,
         # поэтому инициализацию БД делаем в отдельном методе
     
-    async def init_db(self):
+    async def create_schema(self, conn):
         """
         Создает таблицу для хранения истории
         Вызывается один раз при старте бота
         """
-        # async with автоматически открывает и закрывает соединение
-        async with aiosqlite.connect(self.db_path) as conn:
-            # Создаем курсор для выполнения SQL команд
-            cursor = await conn.cursor()
-            
-            # Создаем таблицу, если её еще нет (IF NOT EXISTS)
-            await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS database (
-                    user_id INTEGER,
-                    chat_id INTEGER,
-                    thread_id INTEGER,
-                    messages TEXT,
-                    PRIMARY KEY (user_id, chat_id, thread_id)
-                )
-            """)
-            # PRIMARY KEY означает уникальную комбинацию этих трех полей
-            # Для каждого user_id + chat_id + thread_id будет одна запись
-            
-            # Сохраняем изменения в БД
-            await conn.commit()
-            # После async with соединение автоматически закроется
-    
+        # Создаем курсор для выполнения SQL команд
+        cursor = await conn.cursor()
+        
+        # Создаем таблицу, если её еще нет (IF NOT EXISTS)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS database (
+                user_id INTEGER,
+                chat_id INTEGER,
+                thread_id INTEGER,
+                messages TEXT,
+                PRIMARY KEY (user_id, chat_id, thread_id)
+            )
+        """)
+        # PRIMARY KEY означает уникальную комбинацию этих трех полей
+        # Для каждого user_id + chat_id + thread_id будет одна запись
+
+        # Миграция старых БД: время последней активности в теме (unix time).
+        # Старым строкам ставим текущее время, отсчет хранения начнется с него
+        await cursor.execute("PRAGMA table_info(database)")
+        columns = [row[1] for row in await cursor.fetchall()]
+        if 'updated_at' not in columns:
+            await cursor.execute("ALTER TABLE database ADD COLUMN updated_at INTEGER")
+            await cursor.execute("UPDATE database SET updated_at = ?", (int(time.time()),))
+            logger.info("🔧 Добавлена колонка database.updated_at")
+
+        # Индекс для удаления устаревших тем по сроку хранения
+        await cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_database_updated_at ON database (updated_at)
+        """)
+
+        await self._create_thread_counters(cursor)
+
+    async def _create_thread_counters(self, cursor):
+        """
+        Счетчики тем: всего в файле (thread_total) и по пользователям (thread_counts)
+
+        Ведутся триггерами в той же транзакции, что и запись истории, поэтому
+        сходятся с таблицей database без отдельных записей и сканирований.
+        Триггеры удаляются вместе с таблицей database (tools/reshard.py --drop-source),
+        в этом случае счетчики пересчитываются заново
+        """
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS thread_total (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                threads INTEGER NOT NULL
+            )
+        """)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS thread_counts (
+                user_id INTEGER PRIMARY KEY,
+                threads INTEGER NOT NULL
+            )
+        """)
+
+        await cursor.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'database_thread_insert'
+        """)
+        if await cursor.fetchone() is not None:
+            return
+
+        await cursor.execute("DELETE FROM thread_counts")
+        await cursor.execute("""
+            INSERT INTO thread_counts (user_id, threads)
+            SELECT user_id, COUNT(*) FROM database GROUP BY user_id
+        """)
+        await cursor.execute("""
+            INSERT OR REPLACE INTO thread_total (id, threads) SELECT 1, COUNT(*) FROM database
+        """)
+        # Триггер на INSERT не срабатывает при обновлении через ON CONFLICT DO UPDATE,
+        # поэтому история пишется upsert-ом, а не INSERT OR REPLACE
+        await cursor.execute("""
+            CREATE TRIGGER database_thread_insert AFTER INSERT ON database BEGIN
+                UPDATE thread_total SET threads = threads + 1 WHERE id = 1;
+                INSERT INTO thread_counts (user_id, threads) VALUES (new.user_id, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET threads = threads + 1;
+            END
+        """)
+        await cursor.execute("""
+            CREATE TRIGGER database_thread_delete AFTER DELETE ON database BEGIN
+                UPDATE thread_total SET threads = threads - 1 WHERE id = 1;
+                UPDATE thread_counts SET threads = threads - 1 WHERE user_id = old.user_id;
+            END
+        """)
+        logger.info("🔧 Созданы счетчики тем")
+        
     async def save_history(
         self, 
         user_id: int, 
@@ -58,24 +153,29 @@ class ChatStorage(BaseStorage):
             thread_id: ID темы в чате (или None для обычных чатов)
             messages: список сообщений [{"role": "user", "content": "..."}, ...]
         """
+        # Сжимаем историю (см. history_codec), системный промпт хранится ссылкой.
+        # Большие истории кодируются в потоке, чтобы не задерживать другие корутины
+        messages_blob = await offload(estimate_size(messages), encode_history, messages)
+
         # Открываем соединение с БД
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self._write_lock, self.connect() as conn:
             cursor = await conn.cursor()
             
-            # Преобразуем список сообщений в JSON строку
-            # ensure_ascii=False чтобы русские буквы не превращались в \u0430
-            messages_json = json.dumps(messages, ensure_ascii=False)
-            
-            # INSERT OR REPLACE = если запись существует - обновляем, если нет - создаем
+            # Upsert: если запись существует - обновляем, если нет - создаем
+            # (новая тема увеличивает счетчики тем, см. _create_thread_counters)
             await cursor.execute("""
-                INSERT OR REPLACE INTO database 
-                (user_id, chat_id, thread_id, messages)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO database 
+                (user_id, chat_id, thread_id, messages, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, chat_id, thread_id) DO UPDATE SET
+                    messages = excluded.messages,
+                    updated_at = excluded.updated_at
             """, (
                 user_id, 
                 chat_id, 
                 thread_id or 0,  # если thread_id None, ставим 0
-                messages_json
+                messages_blob,
+                int(time.time())
             ))
             # Знаки ? - это плейсхолдеры, которые заменяются на значения из tuple
             # Это защита от SQL injection
@@ -102,7 +202,7 @@ class ChatStorage(BaseStorage):
         Returns:
             list: список сообщений или пустой список, если истории нет
         """
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self.connect() as conn:
             cursor = await conn.cursor()
             
             # SELECT выбирает только колонку messages
@@ -116,9 +216,8 @@ class ChatStorage(BaseStorage):
             
             # Если запись найдена
             if result:
-                # result это tuple, берем первый элемент (JSON строка)
-                # Парсим JSON обратно в список Python
-                history = json.loads(result[0])
+                # result это tuple, берем первый элемент (сжатая история или старый JSON)
+                history = await offload(estimate_size(result[0]), decode_history, result[0])
                 # logger.info(f"📖 Загружено {len(history)} сообщений для юзера {user_id}")
                 return history
             
@@ -140,7 +239,7 @@ class ChatStorage(BaseStorage):
             chat_id: ID чата
             thread_id: ID темы
         """
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self._write_lock, self.connect() as conn:
             cursor = await conn.cursor()
             
             # DELETE удаляет строку из таблицы
@@ -153,15 +252,84 @@ class ChatStorage(BaseStorage):
             
             # logger.info(f"🗑️ История очищена для юзера {user_id}")
     
+    async def purge_expired(self, tariff: str, cutoff: int, batch_size: int = 500) -> List[Tuple[int, int, int]]:
+        """
+        Удаляет порцию тем без активности с момента cutoff для пользователей тарифа
+
+        Args:
+            tariff: тариф ('free', 'pro', 'ultra'); темы без записи в users считаются 'free'
+            cutoff: unix time, темы с более ранней активностью удаляются
+            batch_size: максимум строк за вызов (короткая транзакция)
+
+        Returns:
+            list: удаленные темы [(user_id, chat_id, thread_id), ...]
+        """
+        users_table = 'users'
+
+        async with self._write_lock, self.connect() as conn:
+            if self.users_db_path:
+                # Шард: тарифы берем из основной БД
+                await conn.execute("ATTACH DATABASE ? AS main_db", (self.users_db_path,))
+                users_table = 'main_db.users'
+
+            cursor = await conn.execute(f"""
+                DELETE FROM database WHERE rowid IN (
+                    SELECT d.rowid FROM database d
+                    LEFT JOIN {users_table} u ON u.user_id = d.user_id
+                    WHERE d.updated_at < ? AND COALESCE(u.tariff_plan, 'free') = ?
+                    LIMIT ?
+                )
+                RETURNING user_id, chat_id, thread_id
+            """, (cutoff, tariff, batch_size))
+            deleted = [tuple(row) for row in await cursor.fetchall()]
+            await conn.commit()
+
+            return deleted
+
+    async def existing_threads(self, keys: Iterable[Tuple[int, int, int]]) -> Set[Tuple[int, int, int]]:
+        """
+        Какие из тем есть в истории
+
+        Args:
+            keys: темы [(user_id, chat_id, thread_id), ...], не больше нескольких тысяч
+
+        Returns:
+            set: темы из keys, для которых есть история
+        """
+        keys = [(user_id, chat_id, thread_id or 0) for user_id, chat_id, thread_id in keys]
+        if not keys:
+            return set()
+
+        async with self.connect() as conn:
+            cursor = await conn.execute(f"""
+                SELECT user_id, chat_id, thread_id FROM database
+                WHERE (user_id, chat_id, thread_id) IN (VALUES {', '.join(['(?, ?, ?)'] * len(keys))})
+            """, [value for key in keys for value in key])
+            return {tuple(row) for row in await cursor.fetchall()}
+    
+    async def count_threads(self, user_id: Optional[int] = None) -> int:
+        """
+        Сколько тем с историей: у пользователя или всего (из счетчиков, без сканирования)
+        """
+        async with self.connect() as conn:
+            if user_id is None:
+                cursor = await conn.execute("SELECT threads FROM thread_total WHERE id = 1")
+            else:
+                cursor = await conn.execute("SELECT threads FROM thread_counts WHERE user_id = ?", (user_id,))
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+
     async def get_all_users(self) -> list:
         """
         Дополнительный метод: получает список всех пользователей в БД
         Полезно для статистики
+
+        Загружает все строки в память, для больших БД используйте iter_threads
         
         Returns:
             list: список кортежей [(user_id, chat_id, thread_id), ...]
         """
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self.connect() as conn:
             cursor = await conn.cursor()
             
             # Выбираем все записи
@@ -172,3 +340,108 @@ class ChatStorage(BaseStorage):
             # fetchall() возвращает список всех строк
             results = await cursor.fetchall()
             return results
+
+    async def iter_threads(self, batch_size: int = 1000) -> AsyncGenerator[Tuple[int, int, int], None]:
+        """
+        Потоково перебирает все темы порциями (keyset-пагинация по первичному ключу)
+
+        Память не растет с размером БД: в каждый момент загружена одна порция,
+        а каждая порция читается отдельным коротким запросом и не держит
+        снимок БД, мешающий работающему боту
+
+        Args:
+            batch_size: сколько строк читать за один запрос
+
+        Yields:
+            tuple: (user_id, chat_id, thread_id)
+        """
+        last_key = (-2**63, -2**63, -2**63)
+
+        async with self.connect() as conn:
+            while True:
+                cursor = await conn.execute("""
+                    SELECT user_id, chat_id, thread_id FROM database
+                    WHERE (user_id, chat_id, thread_id) > (?, ?, ?)
+                    ORDER BY user_id, chat_id, thread_id
+                    LIMIT ?
+                """, (*last_key, batch_size))
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield tuple(row)
+                last_key = tuple(rows[-1])
+
+    async def iter_histories(self, batch_size: int = 100) -> AsyncGenerator[Tuple[int, int, int, list], None]:
+        """
+        Потоково перебирает истории всех тем порциями
+
+        Args:
+            batch_size: сколько историй читать за один запрос
+
+        Yields:
+            tuple: (user_id, chat_id, thread_id, messages)
+        """
+        last_key = (-2**63, -2**63, -2**63)
+
+        async with self.connect() as conn:
+            while True:
+                cursor = await conn.execute("""
+                    SELECT user_id, chat_id, thread_id, messages FROM database
+                    WHERE (user_id, chat_id, thread_id) > (?, ?, ?)
+                    ORDER BY user_id, chat_id, thread_id
+                    LIMIT ?
+                """, (*last_key, batch_size))
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+
+                for user_id, chat_id, thread_id, messages in rows:
+                    yield user_id, chat_id, thread_id, decode_history(messages)
+                last_key = tuple(rows[-1][:3])
+
+    async def recompress_batch(
+        self,
+        after_key: Tuple[int, int, int],
+        batch_size: int = 200
+    ) -> Tuple[Tuple[int, int, int], int, int, int]:
+        """
+        Переписывает порцию старых JSON-строк в сжатый формат
+
+        Строка обновляется, только если ее не успели перезаписать
+        между чтением и записью (сравнение со старым значением)
+
+        Args:
+            after_key: (user_id, chat_id, thread_id), с которого продолжать
+            batch_size: сколько строк просмотреть за раз
+
+        Returns:
+            tuple: (ключ для следующей порции или None в конце,
+                    сколько строк сжато, байт до, байт после)
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                SELECT user_id, chat_id, thread_id, messages FROM database
+                WHERE (user_id, chat_id, thread_id) > (?, ?, ?)
+                  AND typeof(messages) = 'text'
+                ORDER BY user_id, chat_id, thread_id
+                LIMIT ?
+            """, (*after_key, batch_size))
+            rows = await cursor.fetchall()
+        if not rows:
+            return None, 0, 0, 0
+
+        # Вся порция кодируется в потоке и без блокировки записи:
+        # save_history бота не ждет, пока сжимаются чужие истории
+        updates, bytes_before, bytes_after = await asyncio.to_thread(recompress_rows, rows)
+
+        # Под блокировкой - только запись со сравнением старого значения
+        async with self._write_lock, self.connect() as conn:
+            await conn.executemany("""
+                UPDATE database SET messages = ?
+                WHERE user_id = ? AND chat_id = ? AND thread_id = ? AND messages = ?
+            """, updates)
+            await conn.commit()
+
+        return tuple(rows[-1][:3]), len(updates), bytes_before, bytes_after
@@ -0,0 +1,295 @@
+import logging
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .base import BaseStorage, DB_PATH
+from .retrieval_storage import build_match_query, estimate_tokens, thread_key
+
+logger = logging.getLogger(__name__)
+
+# Документ без истории темы считается брошенным не раньше, чем через сутки:
+# история появляется только после первого вопроса
+ORPHAN_GRACE = 86400
+# Вопросы о самом файле ("о чем этот файл?", "перескажи документ"): по ним
+# в тексте документа ничего не найдется, поэтому берется его начало
+ABOUT_DOCUMENT_RE = re.compile(r'файл|документ|\bpdf\b|\bfile|\bdocument', re.IGNORECASE)
+
+
+class DocumentStorage(BaseStorage):
+    """
+    Документы, загруженные в тему (txt, md, pdf), и полнотекстовый индекс их фрагментов
+
+    Сам файл после индексации удаляется, в БД остаются только фрагменты текста.
+    В историю темы документ не попадает: к промпту добавляются лишь
+    самые релевантные фрагменты (см. search)
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        super().__init__(db_path)
+        # Темы, где есть документы (после load_threads): в остальных search
+        # не ходит в БД. None - не загружено, проверяет БД
+        self._threads: Optional[Set[Tuple[int, int, int]]] = None
+
+    async def create_schema(self, conn):
+        """
+        Создает таблицу документов и индекс фрагментов
+        Вызывается один раз при старте бота
+        """
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                thread_id INTEGER NOT NULL DEFAULT 0,
+                file_name TEXT,
+                file_size INTEGER,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                created_at INTEGER NOT NULL
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_documents_thread ON documents (user_id, chat_id, thread_id)
+        """)
+        # Как и в history_fts, фильтр по теме идет через индексируемый thread_key
+        await conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5(
+                content,
+                thread_key,
+                document_id UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+
+    async def load_threads(self):
+        """
+        Загружает в память темы, где есть документы
+        Вызывается при старте процесса
+
+        Темы одного чата обрабатывает один процесс (см. webhook.py), поэтому
+        загрузки документов после старта множество видит. Очистка политикой
+        хранения в другом процессе оставит тему в множестве - это лишь
+        один пустой поиск
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                SELECT DISTINCT user_id, chat_id, thread_id FROM documents
+            """)
+            self._threads = {tuple(row) for row in await cursor.fetchall()}
+
+    def has_documents(self, user_id: int, chat_id: int, thread_id: int) -> bool:
+        """Есть ли в теме документы (True, пока множество не загружено)"""
+        if self._threads is None:
+            return True
+        return (user_id, chat_id, thread_id or 0) in self._threads
+
+    async def add_document(
+        self,
+        user_id: int,
+        chat_id: int,
+        thread_id: int,
+        file_name: str,
+        file_size: int
+    ) -> int:
+        """
+        Регистрирует документ темы (фрагменты добавляются через add_chunks)
+
+        Returns:
+            int: ID документа
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO documents (user_id, chat_id, thread_id, file_name, file_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, chat_id, thread_id or 0, file_name, file_size, int(time.time())))
+            await conn.commit()
+
+        if self._threads is not None:
+            self._threads.add((user_id, chat_id, thread_id or 0))
+        return cursor.lastrowid
+
+    async def add_chunks(
+        self,
+        document_id: int,
+        user_id: int,
+        chat_id: int,
+        thread_id: int,
+        chunks: List[str]
+    ):
+        """
+        Добавляет порцию фрагментов документа в индекс
+
+        Args:
+            document_id: ID документа из add_document
+            user_id: ID пользователя
+            chat_id: ID чата
+            thread_id: ID темы
+            chunks: тексты фрагментов по порядку
+        """
+        key = thread_key(user_id, chat_id, thread_id)
+
+        async with self.connect() as conn:
+            await conn.executemany("""
+                INSERT INTO document_fts (content, thread_key, document_id) VALUES (?, ?, ?)
+            """, [(chunk, key, document_id) for chunk in chunks])
+            await conn.execute("""
+                UPDATE documents SET chunks = chunks + ? WHERE id = ?
+            """, (len(chunks), document_id))
+            await conn.commit()
+
+    async def delete_document(self, user_id: int, chat_id: int, thread_id: int, document_id: int):
+        """
+        Удаляет документ и его фрагменты (например, если индексация не удалась)
+        """
+        async with self.connect() as conn:
+            await conn.execute("""
+                DELETE FROM document_fts WHERE rowid IN (
+                    SELECT rowid FROM document_fts
+                    WHERE document_fts MATCH ? AND document_id = ?
+                )
+            """, (f'thread_key:{thread_key(user_id, chat_id, thread_id)}', document_id))
+            await conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            await conn.commit()
+
+    async def search(
+        self,
+        user_id: int,
+        chat_id: int,
+        thread_id: int,
+        text: str,
+        limit: int = 4,
+        token_budget: int = 1600
+    ) -> List[Dict]:
+        """
+        Ищет фрагменты документов темы, релевантные тексту
+
+        Вопросы без совпадений получают пустой список, кроме вопросов
+        о самом файле (ABOUT_DOCUMENT_RE): им - начало последнего документа
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата
+            thread_id: ID темы
+            text: текст запроса пользователя
+            limit: максимум фрагментов
+            token_budget: максимум токенов на все фрагменты
+
+        Returns:
+            list: [{"file_name": "...", "content": "..."}, ...] по убыванию релевантности
+        """
+        # Тем с документами мало, а поиск идет на каждое сообщение
+        if not self.has_documents(user_id, chat_id, thread_id):
+            return []
+
+        key = f'thread_key:{thread_key(user_id, chat_id, thread_id)}'
+        match = build_match_query(text)
+
+        async with self.connect() as conn:
+            rows = []
+            if match:
+                # bm25: вес 1 для текста и 0 для служебного ключа темы
+                cursor = await conn.execute("""
+                    SELECT d.file_name, f.content
+                    FROM (
+                        SELECT content, document_id, bm25(document_fts, 1.0, 0.0) AS rank
+                        FROM document_fts
+                        WHERE document_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    ) f
+                    JOIN documents d ON d.id = f.document_id
+                    ORDER BY f.rank
+                """, (f'{key} AND ({match})', limit))
+                rows = await cursor.fetchall()
+
+            if not rows and ABOUT_DOCUMENT_RE.search(text):
+                cursor = await conn.execute("""
+                    SELECT d.file_name, f.content
+                    FROM document_fts f
+                    JOIN documents d ON d.id = f.document_id
+                    WHERE document_fts MATCH ? AND f.document_id = (
+                        SELECT MAX(id) FROM documents
+                        WHERE user_id = ? AND chat_id = ? AND thread_id = ?
+                    )
+                    ORDER BY f.rowid
+                    LIMIT ?
+                """, (key, user_id, chat_id, thread_id or 0, limit))
+                rows = await cursor.fetchall()
+
+        found = []
+        for file_name, content in rows:
+            tokens = estimate_tokens(content)
+            if tokens > token_budget:
+                continue
+            token_budget -= tokens
+            found.append({"file_name": file_name, "content": content})
+        return found
+
+    async def clear(self, user_id: int, chat_id: int, thread_id: int):
+        """
+        Удаляет документы темы (при /clear)
+        """
+        await self.clear_threads([(user_id, chat_id, thread_id)])
+
+    async def clear_threads(self, keys: Iterable[Tuple[int, int, int]]):
+        """
+        Удаляет документы нескольких тем одной транзакцией
+        (темы, удаленные политикой хранения)
+
+        Args:
+            keys: темы [(user_id, chat_id, thread_id), ...]
+        """
+        keys = [(user_id, chat_id, thread_id or 0) for user_id, chat_id, thread_id in keys]
+        if self._threads is not None:
+            self._threads.difference_update(keys)
+
+        async with self.connect() as conn:
+            await conn.executemany("""
+                DELETE FROM document_fts WHERE rowid IN (
+                    SELECT rowid FROM document_fts WHERE document_fts MATCH ?
+                )
+            """, [(f'thread_key:{thread_key(*key)}',) for key in keys])
+            await conn.executemany("""
+                DELETE FROM documents WHERE user_id = ? AND chat_id = ? AND thread_id = ?
+            """, keys)
+            await conn.commit()
+
+    async def purge_orphans(self, storage, batch_size: int = 500) -> int:
+        """
+        Удаляет документы тем, у которых так и не появилось истории
+
+        Темы, удаленные политикой хранения, очищаются сразу (clear_threads),
+        сюда попадают только темы, где документ загрузили, но ни о чем не спросили.
+        Историю проверяем через хранилище истории: она может лежать в шардах
+
+        Args:
+            storage: ChatStorage или ShardedChatStorage
+            batch_size: сколько документов проверять за раз
+
+        Returns:
+            int: сколько тем очищено
+        """
+        cutoff = int(time.time()) - ORPHAN_GRACE
+        last_id = 0
+        purged = 0
+
+        while True:
+            async with self.connect() as conn:
+                cursor = await conn.execute("""
+                    SELECT id, user_id, chat_id, thread_id FROM documents
+                    WHERE id > ? AND created_at < ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, cutoff, batch_size))
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+
+            threads = {tuple(row[1:]) for row in rows}
+            orphans = threads - await storage.existing_threads(threads)
+            if orphans:
+                await self.clear_threads(orphans)
+                purged += len(orphans)
+            last_id = rows[-1][0]
+
+        return purged
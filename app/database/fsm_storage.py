@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage as BaseFSMStorage
+from aiogram.fsm.storage.base import DefaultKeyBuilder, StateType, StorageKey
+
+from .base import BaseStorage, DB_PATH
+from app.serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Время жизни блокировки по умолчанию (секунды)
+LOCK_TTL = 300
+# Как часто удалять просроченные состояния и блокировки (секунды)
+CLEANUP_INTERVAL = 60
+
+class SQLiteFSMStorage(BaseStorage, BaseFSMStorage):
+    """
+    FSM-хранилище aiogram: рабочее состояние в памяти, долгоживущее - в SQLite
+
+    Состояния с TTL (Gen.wait) и блокировки живут только в памяти процесса:
+    после перезапуска прерванная генерация их все равно не снимет, а проверка
+    состояния на каждом апдейте и захват блокировки обходятся без БД.
+    В SQLite пишутся только состояния без TTL и данные FSM - то, что должно
+    пережить перезапуск; при старте процесса они читаются в память (load).
+    Сейчас у бота одно состояние (Gen.wait), и оно с TTL, а данные FSM
+    не используются, так что таблица fsm пуста: она для будущих сценариев
+    (настройки в несколько шагов и т.п.)
+
+    Апдейты одного чата/темы всегда обрабатывает один процесс (см. webhook.py),
+    поэтому память процесса для его ключей авторитетна. В памяти только ключи
+    с состоянием, данными или блокировкой: пустые и просроченные удаляются,
+    размер ограничен активными пользователями
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        state_ttl: Optional[Dict[str, int]] = None
+    ):
+        """
+        Args:
+            db_path: путь к файлу базы данных
+            state_ttl: время жизни состояний в секундах {"Gen:wait": 300, ...},
+                       состояния без TTL живут бессрочно и сохраняются в БД
+        """
+        super().__init__(db_path)
+        self.state_ttl = state_ttl or {}
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True)
+
+        # ключ -> (состояние, когда истекает; None - бессрочное, лежит в БД)
+        self._states: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._data: Dict[str, Dict[str, Any]] = {}
+        # ключ -> когда блокировка считается брошенной
+        self._locks: Dict[str, float] = {}
+
+    async def create_schema(self, conn):
+        """
+        Создает таблицу сохраняемых состояний
+        Вызывается один раз при старте бота
+        """
+        cursor = await conn.cursor()
+
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            )
+        """)
+
+    async def load(self):
+        """
+        Читает сохраненные состояния и данные в память
+        Вызывается при старте процесса, до обработки апдейтов
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("SELECT key, state, data FROM fsm")
+            rows = await cursor.fetchall()
+
+        for key, state, data in rows:
+            if state is not None:
+                self._states[key] = (state, None)
+            if data != '{}':
+                self._data[key] = loads(data)
+
+        if rows:
+            logger.info(f"📥 Загружено сохраненных состояний FSM: {len(rows)}")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        previous = self._states.pop(storage_key, None)
+        persisted = previous is not None and previous[1] is None
+
+        if state is None:
+            if persisted:
+                await self._persist_state(storage_key, None)
+            return
+
+        ttl = self.state_ttl.get(state)
+        if ttl:
+            self._states[storage_key] = (state, time.time() + ttl)
+            # Временное состояние заменило сохраненное - в БД его больше нет
+            if persisted:
+                await self._persist_state(storage_key, None)
+        else:
+            self._states[storage_key] = (state, None)
+            await self._persist_state(storage_key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self.key_builder.build(key)
+        entry = self._states.get(storage_key)
+        if entry is None:
+            return None
+
+        state, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._states[storage_key]
+            return None
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        data = dict(data)
+
+        if not data:
+            if self._data.pop(storage_key, None) is None:
+                return
+            async with self.connect() as conn:
+                await conn.execute("""
+                    UPDATE fsm SET data = '{}' WHERE key = ?
+                """, (storage_key,))
+                await conn.execute("""
+                    DELETE FROM fsm WHERE key = ? AND state IS NULL
+                """, (storage_key,))
+                await conn.commit()
+            return
+
+        self._data[storage_key] = data
+        async with self.connect() as conn:
+            await conn.execute("""
+                INSERT INTO fsm (key, data) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET data = excluded.data
+            """, (storage_key, dumps(data).decode()))
+            await conn.commit()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._data.get(self.key_builder.build(key), {}))
+
+    async def _persist_state(self, storage_key: str, state: Optional[str]):
+        """Записывает бессрочное состояние в БД (None - удаляет)"""
+        async with self.connect() as conn:
+            if state is None:
+                await conn.execute("""
+                    UPDATE fsm SET state = NULL WHERE key = ?
+                """, (storage_key,))
+                # Запись без состояния и данных больше не нужна
+                await conn.execute("""
+                    DELETE FROM fsm WHERE key = ? AND data = '{}'
+                """, (storage_key,))
+            else:
+                await conn.execute("""
+                    INSERT INTO fsm (key, state) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET state = excluded.state
+                """, (storage_key, state))
+            await conn.commit()
+
+    async def acquire_lock(self, key: StorageKey, ttl: int = LOCK_TTL) -> bool:
+        """
+        Захватывает блокировку пользователя
+
+        Между проверкой и захватом нет await, поэтому в цикле событий захват атомарен.
+        Блокировка, которую не сняли (зависший обработчик), перехватывается после TTL
+
+        Args:
+            key: ключ FSM (пользователь в чате/теме)
+            ttl: через сколько секунд блокировка считается брошенной
+
+        Returns:
+            bool: True, если блокировка захвачена
+        """
+        storage_key = self.key_builder.build(key, 'lock')
+        now = time.time()
+
+        expires_at = self._locks.get(storage_key)
+        if expires_at is not None and expires_at >= now:
+            return False
+        self._locks[storage_key] = now + ttl
+        return True
+
+    async def release_lock(self, key: StorageKey):
+        """
+        Освобождает блокировку пользователя
+
+        Args:
+            key: ключ FSM (пользователь в чате/теме)
+        """
+        self._locks.pop(self.key_builder.build(key, 'lock'), None)
+
+    def cleanup_expired(self):
+        """Удаляет просроченные состояния и брошенные блокировки"""
+        now = time.time()
+
+        expired = [
+            key for key, (_, expires_at) in self._states.items()
+            if expires_at is not None and expires_at < now
+        ]
+        for key in expired:
+            del self._states[key]
+
+        abandoned = [key for key, expires_at in self._locks.items() if expires_at < now]
+        for key in abandoned:
+            del self._locks[key]
+
+        if abandoned:
+            logger.info(f"🧹 Снято {len(abandoned)} брошенных блокировок")
+
+    async def run_cleanup(self, interval: int = CLEANUP_INTERVAL):
+        """Фоновая задача: периодически вызывает cleanup_expired"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.cleanup_expired()
+            except Exception as e:
+                logger.error(f"Ошибка очистки FSM: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,140 @@
+# Компактное хранение историй в колонке database.messages
+#
+# Формат записи - BLOB: первый байт версия формата, дальше сжатый JSON.
+# Старые строки (TEXT с обычным JSON) читаются как раньше.
+#
+# Системный промпт не хранится в каждой теме целиком: вместо него пишется
+# ссылка {"role": "system", "prompt": "main", "date": "..."}, а при чтении
+# промпт собирается из шаблона app.prompts заново.
+#
+# zstd используется, если установлен пакет zstandard (pip install zstandard),
+# иначе zlib. Оба варианта сжимают с общим словарем частых фрагментов.
+# JSON кодируется быстрым бэкендом из app.serialization.
+
+import threading
+import zlib
+from typing import List, Union
+
+from app.prompts import MAIN_PROMPT_TEMPLATE
+from app.serialization import dumps, loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Во сколько раз в среднем сжимается история (оценка размера без распаковки)
+COMPRESSION_RATIO = 8
+
+# Общий словарь сжатия (версия 1). Его НЕЛЬЗЯ менять: по нему распаковываются
+# уже записанные строки. Новый словарь = новая версия формата
+ZDICT_V1 = (
+    ' что это как для если или уже еще чтобы можно нужно есть быть может '
+    'Привет! Спасибо Конечно Например Вот Если хочешь, могу '
+    'Миньончик GPT a4dev @ysutimetablebot ysukampus @a4securebot '
+    '{"role":"system","prompt":"main","date":"'
+    '"},{"role":"user","content":"'
+    '"},{"role":"assistant","content":"'
+).encode()
+
+_PROMPT_PREFIX, _PROMPT_SUFFIX = MAIN_PROMPT_TEMPLATE.split('{current_date}')
+
+# Компрессоры zstd не потокобезопасны - держим свои в каждом потоке
+_local = threading.local()
+
+
+def _zstd_dict():
+    if not hasattr(_local, 'zdict'):
+        _local.zdict = zstandard.ZstdCompressionDict(ZDICT_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    return _local.zdict
+
+
+def _pack_prompt(message: dict) -> dict:
+    """Заменяет системный промпт на ссылку, если он собран из MAIN_PROMPT_TEMPLATE"""
+    content = message.get('content')
+    if (
+        message.get('role') == 'system'
+        and isinstance(content, str)
+        and content.startswith(_PROMPT_PREFIX)
+        and content.endswith(_PROMPT_SUFFIX)
+    ):
+        date = content[len(_PROMPT_PREFIX):len(content) - len(_PROMPT_SUFFIX)]
+        if len(date) <= 32 and '\n' not in date:
+            return {"role": "system", "prompt": "main", "date": date}
+    return message
+
+
+def _unpack_prompt(message: dict) -> dict:
+    if message.get('prompt') == 'main':
+        return {"role": "system", "content": MAIN_PROMPT_TEMPLATE.format(current_date=message['date'])}
+    return message
+
+
+def encode_history(messages: List[dict]) -> bytes:
+    """
+    Кодирует историю для записи в БД
+
+    Args:
+        messages: список сообщений [{"role": "user", "content": "..."}, ...]
+
+    Returns:
+        bytes: версия формата + сжатый JSON
+    """
+    packed = [_pack_prompt(msg) for msg in messages]
+    raw = dumps(packed)
+
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_zstd_dict())
+        return bytes([FORMAT_ZSTD]) + compressor.compress(raw)
+
+    compressor = zlib.compressobj(ZLIB_LEVEL, zdict=ZDICT_V1)
+    return bytes([FORMAT_ZLIB]) + compressor.compress(raw) + compressor.flush()
+
+
+def decode_history(value: Union[str, bytes]) -> List[dict]:
+    """
+    Декодирует историю из БД (и новый формат, и старый JSON-текст)
+
+    Args:
+        value: значение колонки messages
+
+    Returns:
+        list: список сообщений
+    """
+    if isinstance(value, str):
+        return loads(value)
+
+    version, payload = value[0], value[1:]
+
+    if version == FORMAT_ZLIB:
+        decompressor = zlib.decompressobj(zdict=ZDICT_V1)
+        raw = decompressor.decompress(payload) + decompressor.flush()
+    elif version == FORMAT_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("История сжата zstd, установите пакет zstandard")
+        raw = zstandard.ZstdDecompressor(dict_data=_zstd_dict()).decompress(payload)
+    else:
+        raise ValueError(f"Неизвестная версия формата истории: {version}")
+
+    return [_unpack_prompt(msg) for msg in loads(raw)]
+
+
+def estimate_size(value: Union[str, bytes, List[dict]]) -> int:
+    """
+    Примерный размер истории в JSON (байт), чтобы решить, кодировать ли ее в потоке
+
+    Args:
+        value: значение колонки messages или список сообщений
+    """
+    if isinstance(value, bytes):
+        return len(value) * COMPRESSION_RATIO
+    if isinstance(value, str):
+        return len(value) * 2
+    # Кириллица в UTF-8 занимает 2 байта на символ
+    return sum(len(msg.get('content') or '') for msg in value) * 2
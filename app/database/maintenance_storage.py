@@ -0,0 +1,76 @@
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from .base import BaseStorage, DB_PATH
+
+logger = logging.getLogger(__name__)
+
+class MaintenanceStorage(BaseStorage):
+    """Журнал фоновых задач обслуживания (сколько длились и сколько строк затронули)"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        super().__init__(db_path)
+
+    async def create_schema(self, conn):
+        """
+        Создает таблицу журнала
+        Вызывается один раз при старте бота
+        """
+        cursor = await conn.cursor()
+
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                duration_ms REAL NOT NULL,
+                rows_affected INTEGER NOT NULL
+            )
+        """)
+        await cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_maintenance_runs_job
+            ON maintenance_runs (job, id)
+        """)
+
+    async def log_run(self, job: str, started_at: datetime, duration_ms: float, rows_affected: int):
+        """
+        Записывает результат запуска задачи
+
+        Args:
+            job: название задачи
+            started_at: время начала
+            duration_ms: длительность в миллисекундах
+            rows_affected: сколько строк затронуто
+        """
+        async with self.connect() as conn:
+            await conn.execute("""
+                INSERT INTO maintenance_runs (job, started_at, duration_ms, rows_affected)
+                VALUES (?, ?, ?, ?)
+            """, (job, started_at.isoformat(), duration_ms, rows_affected))
+            await conn.commit()
+
+    async def get_last_runs(self, job: str, limit: int = 10) -> List[Dict]:
+        """
+        Возвращает последние запуски задачи
+
+        Args:
+            job: название задачи
+            limit: сколько запусков вернуть
+
+        Returns:
+            list: [{"started_at": ..., "duration_ms": ..., "rows_affected": ...}, ...]
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                SELECT started_at, duration_ms, rows_affected FROM maintenance_runs
+                WHERE job = ?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (job, limit))
+            rows = await cursor.fetchall()
+
+        return [
+            {"started_at": row[0], "duration_ms": row[1], "rows_affected": row[2]}
+            for row in rows
+        ]
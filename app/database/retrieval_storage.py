@@ -0,0 +1,175 @@
+import logging
+import re
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .base import BaseStorage, DB_PATH
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w{3,}')
+# Максимум слов запроса, которые идут в MATCH
+MAX_QUERY_TERMS = 16
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для кириллицы ~3 символа на токен)"""
+    return len(text) // 3 + 1
+
+
+def build_match_query(text: str) -> str:
+    """
+    Превращает текст пользователя в запрос FTS5
+
+    Вместо морфологии - префиксный поиск по основе слова:
+    "погоде" -> "пого"*, чтобы находить "погода", "погоду" и т.д.
+    """
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        stem = word if len(word) <= 4 else word[:max(4, len(word) - 2)]
+        term = f'"{stem}"*'
+        if term not in terms:
+            terms.append(term)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return ' OR '.join(terms)
+
+
+def thread_key(user_id: int, chat_id: int, thread_id: int) -> str:
+    """Ключ темы одним токеном FTS (минус у ID групп заменяем на n)"""
+    return f"k{user_id}x{chat_id}x{thread_id or 0}".replace('-', 'n')
+
+
+class RetrievalStorage(BaseStorage):
+    """
+    Локальный поисковый индекс по старым сообщениям темы (SQLite FTS5 + BM25)
+
+    Сюда попадают сообщения, вытесненные из окна MAX_HISTORY_MESSAGES,
+    а при генерации к промпту добавляются самые релевантные из них
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        super().__init__(db_path)
+
+    async def create_schema(self, conn):
+        """
+        Создает полнотекстовый индекс
+        Вызывается один раз при старте бота
+        """
+        # thread_key индексируется, чтобы фильтр по теме шел через индекс,
+        # а не перебором всех совпадений по всем пользователям
+        await conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                content,
+                thread_key,
+                user_id UNINDEXED,
+                chat_id UNINDEXED,
+                thread_id UNINDEXED,
+                created_at UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+
+    async def add_messages(self, user_id: int, chat_id: int, thread_id: int, messages: List[Dict]):
+        """
+        Добавляет в индекс сообщения, вытесненные из истории
+
+        Вопрос пользователя и ответ на него индексируются одним документом
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата
+            thread_id: ID темы
+            messages: сообщения [{"role": "user", "content": "..."}, ...]
+        """
+        turns = []
+        for msg in messages:
+            if msg.get('role') not in ('user', 'assistant') or not msg.get('content'):
+                continue
+            prefix = 'Пользователь' if msg['role'] == 'user' else 'Ассистент'
+            line = f"{prefix}: {msg['content']}"
+            if msg['role'] == 'user' or not turns:
+                turns.append(line)
+            else:
+                turns[-1] += '\n' + line
+
+        if not turns:
+            return
+
+        key = thread_key(user_id, chat_id, thread_id)
+        now = int(time.time())
+
+        async with self.connect() as conn:
+            await conn.executemany("""
+                INSERT INTO history_fts (content, thread_key, user_id, chat_id, thread_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(turn, key, user_id, chat_id, thread_id or 0, now) for turn in turns])
+            await conn.commit()
+
+    async def search(
+        self,
+        user_id: int,
+        chat_id: int,
+        thread_id: int,
+        text: str,
+        limit: int = 3,
+        token_budget: int = 800
+    ) -> List[str]:
+        """
+        Ищет старые реплики темы, релевантные тексту
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата
+            thread_id: ID темы
+            text: текст запроса пользователя
+            limit: максимум реплик
+            token_budget: максимум токенов на все найденные реплики
+
+        Returns:
+            list: тексты реплик по убыванию релевантности
+        """
+        match = build_match_query(text)
+        if not match:
+            return []
+
+        async with self.connect() as conn:
+            # bm25: вес 1 для текста и 0 для служебного ключа темы
+            cursor = await conn.execute("""
+                SELECT content FROM history_fts
+                WHERE history_fts MATCH ?
+                ORDER BY bm25(history_fts, 1.0, 0.0)
+                LIMIT ?
+            """, (f'thread_key:{thread_key(user_id, chat_id, thread_id)} AND ({match})', limit))
+            rows = await cursor.fetchall()
+
+        found = []
+        for (content,) in rows:
+            tokens = estimate_tokens(content)
+            if tokens > token_budget:
+                continue
+            token_budget -= tokens
+            found.append(content)
+        return found
+
+    async def clear(self, user_id: int, chat_id: int, thread_id: int):
+        """
+        Удаляет индекс темы (при /clear)
+        """
+        await self.clear_threads([(user_id, chat_id, thread_id)])
+
+    async def clear_threads(self, keys: Iterable[Tuple[int, int, int]]):
+        """
+        Удаляет индекс нескольких тем одной транзакцией
+        (темы, удаленные политикой хранения)
+
+        Args:
+            keys: темы [(user_id, chat_id, thread_id), ...]
+        """
+        async with self.connect() as conn:
+            await conn.executemany("""
+                DELETE FROM history_fts WHERE rowid IN (
+                    SELECT rowid FROM history_fts WHERE history_fts MATCH ?
+                )
+            """, [(f'thread_key:{thread_key(*key)}',) for key in keys])
+            await conn.commit()
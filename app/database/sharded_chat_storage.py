@@ -0,0 +1,176 @@
+import os
+import zlib
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from .base import DB_PATH
+from .chat_storage import ChatStorage
+
+# На сколько файлов раскладывать историю чатов (1 - вся история в DB_PATH).
+# Сменить число шардов на живой БД нельзя: сначала tools/reshard.py
+CHAT_SHARDS = int(os.getenv('CHAT_SHARDS', '1'))
+
+
+def shard_path(db_path: str, shard: int, shards: int) -> str:
+    """
+    Путь к файлу шарда: database.db -> database.shard-0-of-4.db
+
+    Число шардов входит в имя, поэтому перераскладка в другое число
+    шардов пишет в новые файлы и не трогает текущие
+    """
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard-{shard}-of-{shards}{ext or '.db'}"
+
+
+def shard_index(user_id: int, shards: int) -> int:
+    """
+    Номер шарда пользователя
+
+    crc32 вместо hash(), чтобы раскладка не зависела от процесса
+    """
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class ShardedChatStorage:
+    """
+    История чатов, разложенная по нескольким файлам БД по хэшу user_id
+
+    В SQLite в файл одновременно пишет только один писатель. С шардами
+    сохранение историй разных пользователей идет в разные файлы параллельно
+    и не стоит в очереди за записями расхода и FSM в основной БД.
+    У каждого шарда свой файл, свои соединения и своя очередь записи.
+
+    Интерфейс тот же, что у ChatStorage. Таблицы users, FSM и индексы
+    остаются в основной БД (db_path)
+    """
+
+    def __init__(self, db_path: str = DB_PATH, shards: int = CHAT_SHARDS, readonly: bool = False):
+        self.db_path = db_path
+        self.shards = [
+            ChatStorage(shard_path(db_path, shard, shards), readonly, users_db_path=db_path)
+            for shard in range(shards)
+        ]
+
+    def shard(self, user_id: int) -> ChatStorage:
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    async def enable_wal(self):
+        for shard in self.shards:
+            await shard.enable_wal()
+
+    async def init_db(self):
+        """
+        Включает WAL и создает таблицы в каждом шарде
+        Вызывается один раз при старте бота
+        """
+        for shard in self.shards:
+            await shard.enable_wal()
+            await shard.init_db()
+
+    async def save_history(self, user_id: int, chat_id: int, thread_id: int, messages: list):
+        await self.shard(user_id).save_history(user_id, chat_id, thread_id, messages)
+
+    async def load_history(self, user_id: int, chat_id: int, thread_id: int) -> list:
+        return await self.shard(user_id).load_history(user_id, chat_id, thread_id)
+
+    async def clear_history(self, user_id: int, chat_id: int, thread_id: int):
+        await self.shard(user_id).clear_history(user_id, chat_id, thread_id)
+
+    async def purge_expired(self, tariff: str, cutoff: int, batch_size: int = 500) -> List[Tuple[int, int, int]]:
+        """
+        Удаляет до batch_size устаревших тем, обходя шарды по очереди
+
+        Returns:
+            list: удаленные темы [(user_id, chat_id, thread_id), ...]
+        """
+        deleted = []
+        for shard in self.shards:
+            deleted += await shard.purge_expired(tariff, cutoff, batch_size - len(deleted))
+            if len(deleted) >= batch_size:
+                break
+        return deleted
+
+    async def existing_threads(self, keys: Iterable[Tuple[int, int, int]]) -> Set[Tuple[int, int, int]]:
+        by_shard: Dict[int, List[Tuple[int, int, int]]] = {}
+        for key in keys:
+            by_shard.setdefault(shard_index(key[0], len(self.shards)), []).append(key)
+
+        existing = set()
+        for shard, shard_keys in by_shard.items():
+            existing |= await self.shards[shard].existing_threads(shard_keys)
+        return existing
+
+    async def count_threads(self, user_id: Optional[int] = None) -> int:
+        """Темы пользователя (лежат в одном шарде) или всего - сумма счетчиков шардов"""
+        if user_id is not None:
+            return await self.shard(user_id).count_threads(user_id)
+        return sum([await shard.count_threads() for shard in self.shards])
+
+    async def get_all_users(self) -> list:
+        """
+        Все темы всех шардов [(user_id, chat_id, thread_id), ...]
+
+        Загружает все строки в память, для больших БД используйте iter_threads
+        """
+        results = []
+        for shard in self.shards:
+            results += await shard.get_all_users()
+        return results
+
+    async def iter_threads(self, batch_size: int = 1000) -> AsyncGenerator[Tuple[int, int, int], None]:
+        """Потоково перебирает темы шард за шардом (порядок - по ключу внутри шарда)"""
+        for shard in self.shards:
+            async for key in shard.iter_threads(batch_size):
+                yield key
+
+    async def iter_histories(self, batch_size: int = 100) -> AsyncGenerator[Tuple[int, int, int, list], None]:
+        """Потоково перебирает истории шард за шардом"""
+        for shard in self.shards:
+            async for row in shard.iter_histories(batch_size):
+                yield row
+
+    async def recompress_batch(
+        self,
+        after_key: Tuple[int, int, int],
+        batch_size: int = 200
+    ) -> Tuple[Tuple[int, int, int], int, int, int]:
+        """
+        Пересжимает порцию старых JSON-строк в каждом шарде
+
+        Следующий ключ - наименьший из ключей шардов. Уже сжатые строки
+        отбираются условием на тип, поэтому повторный просмотр диапазона
+        в шардах, которые ушли дальше, ничего не переписывает
+        """
+        next_keys = []
+        rows = bytes_before = bytes_after = 0
+        for shard in self.shards:
+            key, shard_rows, shard_before, shard_after = await shard.recompress_batch(after_key, batch_size)
+            if key is not None:
+                next_keys.append(key)
+            rows += shard_rows
+            bytes_before += shard_before
+            bytes_after += shard_after
+
+        return (min(next_keys) if next_keys else None), rows, bytes_before, bytes_after
+
+    async def incremental_vacuum(self, pages: int = 1000) -> int:
+        """
+        Возвращает ОС до pages свободных страниц в каждом шарде
+
+        Returns:
+            int: сколько свободных страниц осталось во всех шардах
+        """
+        free_pages = 0
+        for shard in self.shards:
+            free_pages += await shard.incremental_vacuum(pages)
+        return free_pages
+
+
+def create_chat_storage(
+    db_path: str = DB_PATH,
+    shards: int = CHAT_SHARDS,
+    readonly: bool = False
+) -> Union[ChatStorage, ShardedChatStorage]:
+    """Хранилище истории: один файл или шарды, в зависимости от CHAT_SHARDS"""
+    if shards > 1:
+        return ShardedChatStorage(db_path, shards, readonly)
+    return ChatStorage(db_path, readonly)
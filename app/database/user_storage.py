@@ -1,58 +1,161 @@
 import aiosqlite
+import asyncio
 import logging
-from datetime import datetime, timedelta, time
-from typing import Optional, Dict
+from datetime import date, datetime, timedelta, time
+from typing import AsyncGenerator, Optional, Dict, List
 
 from .base import BaseStorage, DB_PATH
+from app.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Накопленный расход пишется в БД не реже чем раз в USAGE_FLUSH_INTERVAL секунд
+# или сразу, когда накопилось USAGE_FLUSH_UPDATES обновлений
+USAGE_FLUSH_INTERVAL = 0.5
+USAGE_FLUSH_UPDATES = 200
+
+# Короткий кэш записей пользователей: изменения из других процессов
+# (тариф, сброс лимитов) видны не позже чем через USER_CACHE_TTL секунд
+USER_CACHE_TTL = 5
+USER_CACHE_SIZE = 10000
+# Сколько пользователей читать одним запросом при записи расхода (лимит параметров SQLite)
+USAGE_FLUSH_CHUNK = 500
+
+def today() -> int:
+    """Номер текущего дня (date.toordinal), по нему сбрасываются дневные лимиты"""
+    return date.today().toordinal()
+
 class UserStorage(BaseStorage):
     """Класс для управления данными пользователей в SQLite"""
         
-    def __init__(self, db_path: str = DB_PATH):
-        super().__init__(db_path)
+    def __init__(self, db_path: str = DB_PATH, readonly: bool = False):
+        super().__init__(db_path, readonly)
+
+        # Write-behind счетчики расхода: {user_id: [запросы, токены]}.
+        # _flushing - порция, которая прямо сейчас пишется в БД
+        self._pending: Dict[int, List[int]] = {}
+        self._flushing: Dict[int, List[int]] = {}
+        self._pending_updates = 0
+        self._flush_lock = asyncio.Lock()
+
+        # Кэш строк users (без незаписанного расхода, он добавляется при чтении).
+        # _flush_generation меняется после каждой записи расхода: строку,
+        # прочитанную во время записи, в кэш не кладем
+        self._cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self._flush_generation = 0
 
         # Конфигурация лимитов для тарифных планов
         self.TARIFF_LIMITS = {
             'free': {
                 'requests_per_day': 17,
-                'tokens_per_day': 10000
+                'tokens_per_day': 10000,
+                'history_retention_days': 30
             },
             'pro': {
                 'requests_per_day': 200,
-                'tokens_per_day': 200000
+                'tokens_per_day': 200000,
+                'history_retention_days': 180
             },
             'ultra': {
                 'requests_per_day': -1,
-                'tokens_per_day': -1
+                'tokens_per_day': -1,
+                'history_retention_days': 365
             }
         }
     
-    async def init_db(self):
+    async def create_schema(self, conn):
         """
         Создает таблицу для хранения данных пользователей
         Вызывается один раз при старте бота
         """
-        async with aiosqlite.connect(self.db_path) as conn:
-            cursor = await conn.cursor()
-            
+        cursor = await conn.cursor()
+        
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                tariff_plan TEXT DEFAULT 'free',
+                requests_today INTEGER DEFAULT 0,
+                total_requests INTEGER DEFAULT 0,
+                tokens_today INTEGER DEFAULT 0,
+                limits_updated_at TEXT,
+                subscription_expires_at TEXT,
+                created_at TEXT,
+                limits_day INTEGER DEFAULT 0
+            )
+        """)
+
+        # Миграция старых БД: номер дня последнего сброса лимитов
+        await cursor.execute("PRAGMA table_info(users)")
+        columns = [row[1] for row in await cursor.fetchall()]
+        if 'limits_day' not in columns:
+            await cursor.execute("ALTER TABLE users ADD COLUMN limits_day INTEGER DEFAULT 0")
+            # julianday('0001-01-01') = 1721425.5, а date.toordinal() для этой даты = 1
             await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    tariff_plan TEXT DEFAULT 'free',
-                    requests_today INTEGER DEFAULT 0,
-                    total_requests INTEGER DEFAULT 0,
-                    tokens_today INTEGER DEFAULT 0,
-                    limits_updated_at TEXT,
-                    subscription_expires_at TEXT,
-                    created_at TEXT
-                )
+                UPDATE users
+                SET limits_day = CAST(julianday(date(limits_updated_at)) - 1721424.5 AS INTEGER)
+                WHERE limits_updated_at IS NOT NULL
             """)
-            
-            await conn.commit()
-    
+            logger.info("🔧 Добавлена колонка users.limits_day")
+
+        # Индекс для массового сброса лимитов (WHERE limits_day < ?)
+        await cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_limits_day ON users (limits_day)
+        """)
+
+        # Дневные агрегаты по тарифам: обновляются вместе с записью расхода
+        # и регистрацией, поэтому статистика читается без сканирования users
+        await cursor.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_daily'
+        """)
+        has_usage_daily = await cursor.fetchone() is not None
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_daily (
+                day INTEGER NOT NULL,
+                tariff_plan TEXT NOT NULL,
+                active_users INTEGER NOT NULL DEFAULT 0,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                requests INTEGER NOT NULL DEFAULT 0,
+                tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, tariff_plan)
+            ) WITHOUT ROWID
+        """)
+        # День, в который пользователь последний раз учтен в active_users
+        if 'active_day' not in columns:
+            await cursor.execute("ALTER TABLE users ADD COLUMN active_day INTEGER DEFAULT 0")
+
+        if not has_usage_daily:
+            await self._backfill_usage_daily(cursor)
+
+    async def _backfill_usage_daily(self, cursor):
+        """
+        Заполняет usage_daily по существующим пользователям (один раз при миграции):
+        регистрации - по дням created_at, активность и расход - только за сегодня,
+        более ранний дневной расход уже сброшен
+        """
+        await cursor.execute("""
+            INSERT INTO usage_daily (day, tariff_plan, new_users)
+            SELECT CAST(julianday(date(created_at)) - 1721424.5 AS INTEGER), COALESCE(tariff_plan, 'free'), COUNT(*)
+            FROM users
+            WHERE created_at IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        await cursor.execute("""
+            INSERT INTO usage_daily (day, tariff_plan, active_users, requests, tokens)
+            SELECT ?, COALESCE(tariff_plan, 'free'), COUNT(*), SUM(requests_today), SUM(tokens_today)
+            FROM users
+            WHERE limits_day = ? AND requests_today > 0
+            GROUP BY 2
+            ON CONFLICT (day, tariff_plan) DO UPDATE SET
+                active_users = excluded.active_users,
+                requests = excluded.requests,
+                tokens = excluded.tokens
+        """, (today(), today()))
+        await cursor.execute("""
+            UPDATE users SET active_day = ? WHERE limits_day = ? AND requests_today > 0
+        """, (today(), today()))
+        logger.info("🔧 Создана таблица usage_daily")
+        
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """
         Получает данные пользователя из БД
@@ -63,21 +166,53 @@ class UserStorage(BaseStorage):
         Returns:
             Dict с данными пользователя или None, если пользователь не найден
         """
-        async with aiosqlite.connect(self.db_path) as conn:
-            conn.row_factory = aiosqlite.Row
-            cursor = await conn.cursor()
-            
-            await cursor.execute("""
-                SELECT * FROM users WHERE user_id = ?
-            """, (user_id,))
-            
-            row = await cursor.fetchone()
+        # Берем до чтения БД: если запись расхода завершится во время запроса,
+        # он посчитается дважды (лимит строже), но не потеряется
+        requests_delta, tokens_delta = self._pending_usage(user_id)
+
+        row = self._cache.get(user_id)
+        if row is None:
+            generation = self._flush_generation
+
+            async with self.connect() as conn:
+                conn.row_factory = aiosqlite.Row
+                cursor = await conn.cursor()
+                
+                await cursor.execute("""
+                    SELECT * FROM users WHERE user_id = ?
+                """, (user_id,))
+                
+                row = await cursor.fetchone()
 
             logger.debug(f"DB Query: SELECT ... for user {user_id}")
-            
-            if row:
-                return dict(row)
-            return None
+
+            if not row:
+                return None
+            row = dict(row)
+            if generation == self._flush_generation:
+                self._cache.set(user_id, row)
+
+        user = dict(row)
+        user['requests_today'] += requests_delta
+        user['total_requests'] += requests_delta
+        user['tokens_today'] += tokens_delta
+        return user
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Удаляет пользователя из кэша (без user_id - всех)"""
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id)
+
+    def _pending_usage(self, user_id: int) -> tuple[int, int]:
+        """Еще не записанный в БД расход пользователя: (запросы, токены)"""
+        requests_delta = tokens_delta = 0
+        for deltas in (self._flushing, self._pending):
+            if user_id in deltas:
+                requests_delta += deltas[user_id][0]
+                tokens_delta += deltas[user_id][1]
+        return requests_delta, tokens_delta
 
     
     async def create_user(self, user_id: int, username: Optional[str] = None):
@@ -90,44 +225,250 @@ class UserStorage(BaseStorage):
         """
         now = datetime.now().isoformat()
         
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self.connect() as conn:
             cursor = await conn.cursor()
             
             await cursor.execute("""
                 INSERT OR IGNORE INTO users 
                 (user_id, username, tariff_plan, requests_today, total_requests, 
-                 tokens_today, limits_updated_at, created_at)
-                VALUES (?, ?, 'free', 0, 0, 0, ?, ?)
-            """, (user_id, username, now, now))
+                 tokens_today, limits_updated_at, created_at, limits_day)
+                VALUES (?, ?, 'free', 0, 0, 0, ?, ?, ?)
+            """, (user_id, username, now, now, today()))
+            created = cursor.rowcount > 0
+
+            if created:
+                await cursor.execute("""
+                    INSERT INTO usage_daily (day, tariff_plan, new_users) VALUES (?, 'free', 1)
+                    ON CONFLICT (day, tariff_plan) DO UPDATE SET new_users = new_users + 1
+                """, (today(),))
             
             await conn.commit()
             
-            if cursor.rowcount > 0:
+            if created:
                 logger.info(f"✅ Создан новый пользователь: {user_id} (@{username})")
     
+    async def get_user_ids_after(self, after_user_id: int = 0, limit: int = 500) -> List[int]:
+        """
+        Возвращает следующую порцию ID пользователей (keyset-пагинация)
+
+        В отличие от OFFSET, запрос идет по первичному ключу и не
+        перечитывает уже пройденные строки
+
+        Args:
+            after_user_id: последний ID из предыдущей порции (0 - с начала)
+            limit: размер порции
+
+        Returns:
+            list: ID пользователей по возрастанию
+        """
+        async with self.connect() as conn:
+            cursor = await conn.execute("""
+                SELECT user_id FROM users
+                WHERE user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            """, (after_user_id, limit))
+            rows = await cursor.fetchall()
+
+        return [row[0] for row in rows]
+    
+    async def iter_users(self, batch_size: int = 1000) -> AsyncGenerator[Dict, None]:
+        """
+        Потоково перебирает всех пользователей порциями (keyset-пагинация по user_id)
+
+        Args:
+            batch_size: сколько строк читать за один запрос
+
+        Yields:
+            Dict с данными пользователя
+        """
+        last_user_id = -2**63
+
+        async with self.connect() as conn:
+            conn.row_factory = aiosqlite.Row
+            while True:
+                cursor = await conn.execute("""
+                    SELECT * FROM users
+                    WHERE user_id > ?
+                    ORDER BY user_id
+                    LIMIT ?
+                """, (last_user_id, batch_size))
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield dict(row)
+                last_user_id = rows[-1]['user_id']
+
+    async def get_usage_by_tariff(self) -> List[Dict]:
+        """
+        Сводная статистика использования по тарифам
+
+        Returns:
+            list: [{"tariff_plan": "free", "users": ..., "requests_today": ...,
+                    "tokens_today": ..., "total_requests": ...}, ...]
+        """
+        async with self.connect() as conn:
+            conn.row_factory = aiosqlite.Row
+            cursor = await conn.execute("""
+                SELECT tariff_plan,
+                       COUNT(*) AS users,
+                       SUM(requests_today) AS requests_today,
+                       SUM(tokens_today) AS tokens_today,
+                       SUM(total_requests) AS total_requests
+                FROM users
+                GROUP BY tariff_plan
+                ORDER BY tariff_plan
+            """)
+            rows = await cursor.fetchall()
+
+        return [dict(row) for row in rows]
+    
     async def update_usage(self, user_id: int, requests_delta: int = 1, tokens_delta: int = 0):
         """
         Обновляет статистику использования (запросы и токены)
+
+        Расход копится в памяти и пишется в БД пачкой (см. flush_usage),
+        get_user и check_limits учитывают еще не записанное
         
         Args:
             user_id: Telegram user ID
             requests_delta: Количество добавляемых запросов (по умолчанию 1)
             tokens_delta: Количество добавляемых токенов
         """
-        async with aiosqlite.connect(self.db_path) as conn:
-            cursor = await conn.cursor()
-            
-            await cursor.execute("""
-                UPDATE users 
-                SET requests_today = requests_today + ?,
-                    total_requests = total_requests + ?,
-                    tokens_today = tokens_today + ?
-                WHERE user_id = ?
-            """, (requests_delta, requests_delta, tokens_delta, user_id))
-            
-            await conn.commit()
+        deltas = self._pending.setdefault(user_id, [0, 0])
+        deltas[0] += requests_delta
+        deltas[1] += tokens_delta
+        self._pending_updates += 1
+
+        if self._pending_updates >= USAGE_FLUSH_UPDATES:
+            await self.flush_usage()
+
+    async def flush_usage(self) -> int:
+        """
+        Записывает накопленный расход всех пользователей одной транзакцией
+
+        Returns:
+            int: сколько пользователей обновлено
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            self._flushing, self._pending = self._pending, {}
+            self._pending_updates = 0
+            try:
+                async with self.connect() as conn:
+                    # IMMEDIATE: тариф и active_day читаются под блокировкой записи,
+                    # иначе два воркера могут учесть одного пользователя активным дважды
+                    await conn.execute("BEGIN IMMEDIATE")
+                    daily = await self._daily_deltas(conn, self._flushing)
+                    await conn.executemany("""
+                        UPDATE users 
+                        SET requests_today = requests_today + ?,
+                            total_requests = total_requests + ?,
+                            tokens_today = tokens_today + ?,
+                            active_day = ?
+                        WHERE user_id = ?
+                    """, [
+                        (requests_delta, requests_delta, tokens_delta, today(), user_id)
+                        for user_id, (requests_delta, tokens_delta) in self._flushing.items()
+                    ])
+                    await conn.executemany("""
+                        INSERT INTO usage_daily (day, tariff_plan, active_users, requests, tokens)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (day, tariff_plan) DO UPDATE SET
+                            active_users = active_users + excluded.active_users,
+                            requests = requests + excluded.requests,
+                            tokens = tokens + excluded.tokens
+                    """, [(today(), tariff, *deltas) for tariff, deltas in daily.items()])
+                    await conn.commit()
+
+                    # Записанный расход переносим в закэшированные строки
+                    self._flush_generation += 1
+                    for user_id, (requests_delta, tokens_delta) in self._flushing.items():
+                        row = self._cache.get(user_id)
+                        if row is not None:
+                            row['requests_today'] += requests_delta
+                            row['total_requests'] += requests_delta
+                            row['tokens_today'] += tokens_delta
+            except Exception:
+                # Не теряем расход: вернем его в очередь до следующей попытки
+                for user_id, (requests_delta, tokens_delta) in self._flushing.items():
+                    deltas = self._pending.setdefault(user_id, [0, 0])
+                    deltas[0] += requests_delta
+                    deltas[1] += tokens_delta
+                raise
+            finally:
+                flushed = len(self._flushing)
+                self._flushing = {}
+
+        logger.debug(f"DB Query: UPDATE usage for {flushed} users")
+        return flushed
+
+    async def _daily_deltas(self, conn, usage: Dict[int, List[int]]) -> Dict[str, List[int]]:
+        """
+        Сворачивает расход пользователей в дневные агрегаты по тарифам
+
+        Returns:
+            dict: {тариф: [новые активные за сегодня, запросы, токены]}
+        """
+        user_ids = list(usage)
+        daily: Dict[str, List[int]] = {}
+
+        for start in range(0, len(user_ids), USAGE_FLUSH_CHUNK):
+            chunk = user_ids[start:start + USAGE_FLUSH_CHUNK]
+            cursor = await conn.execute(f"""
+                SELECT user_id, tariff_plan, active_day FROM users
+                WHERE user_id IN ({', '.join('?' * len(chunk))})
+            """, chunk)
+            for user_id, tariff, active_day in await cursor.fetchall():
+                requests_delta, tokens_delta = usage[user_id]
+                deltas = daily.setdefault(tariff or 'free', [0, 0, 0])
+                deltas[0] += (active_day or 0) < today()
+                deltas[1] += requests_delta
+                deltas[2] += tokens_delta
+
+        return daily
+
+    async def get_daily_stats(self, days: int = 7) -> List[Dict]:
+        """
+        Агрегаты за последние days дней (читает не больше days * число тарифов строк)
+
+        Returns:
+            list: [{"day": date, "tariff_plan": ..., "active_users": ..., "new_users": ...,
+                    "requests": ..., "tokens": ...}, ...] от новых дней к старым
+        """
+        async with self.connect() as conn:
+            conn.row_factory = aiosqlite.Row
+            cursor = await conn.execute("""
+                SELECT * FROM usage_daily WHERE day > ? ORDER BY day DESC, tariff_plan
+            """, (today() - days,))
+            rows = await cursor.fetchall()
+
+        return [{**dict(row), "day": date.fromordinal(row['day'])} for row in rows]
+
+    async def get_total_users(self) -> int:
+        """Всего пользователей - сумма дневных регистраций, без COUNT(*) по users"""
+        async with self.connect() as conn:
+            cursor = await conn.execute("SELECT COALESCE(SUM(new_users), 0) FROM usage_daily")
+            return (await cursor.fetchone())[0]
 
-        logger.debug(f"DB Query: UPDATE ... for user {user_id}")
+    async def run_usage_flusher(self, interval: float = USAGE_FLUSH_INTERVAL):
+        """
+        Фоновая задача: периодически вызывает flush_usage
+
+        Каждый процесс копит свой расход, поэтому в вебхук-режиме лимит
+        пользователя, пишущего в чаты разных воркеров, может быть превышен
+        не больше чем на расход за interval
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_usage()
+            except Exception as e:
+                logger.error(f"Ошибка записи расхода: {e}", exc_info=True)
     
     async def reset_daily_limits(self, user_id: int):
         """
@@ -137,48 +478,75 @@ class UserStorage(BaseStorage):
             user_id: Telegram user ID
         """
         now = datetime.now().isoformat()
+        # Накопленный расход должен попасть в total_requests до обнуления
+        await self.flush_usage()
         
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self.connect() as conn:
             cursor = await conn.cursor()
             
             await cursor.execute("""
                 UPDATE users 
                 SET requests_today = 0,
                     tokens_today = 0,
-                    limits_updated_at = ?
+                    limits_updated_at = ?,
+                    limits_day = ?
                 WHERE user_id = ?
-            """, (now, user_id))
+            """, (now, today(), user_id))
             
             await conn.commit()
+            self.invalidate(user_id)
             logger.info(f"🔄 Сброшены дневные лимиты для пользователя {user_id}")
+
+    async def reset_all_daily_limits(self) -> int:
+        """
+        Сбрасывает дневные лимиты всем пользователям одним UPDATE
+        Вызывается фоновой задачей на границе суток
+
+        Returns:
+            int: количество сброшенных пользователей
+        """
+        now = datetime.now().isoformat()
+        await self.flush_usage()
+
+        async with self.connect() as conn:
+            cursor = await conn.cursor()
+
+            # Условие по индексу limits_day: затрагиваются только еще не сброшенные строки
+            await cursor.execute("""
+                UPDATE users
+                SET requests_today = 0,
+                    tokens_today = 0,
+                    limits_updated_at = ?,
+                    limits_day = ?
+                WHERE limits_day < ?
+            """, (now, today(), today()))
+
+            await conn.commit()
+            self.invalidate()
+            return cursor.rowcount
     
-    async def check_and_reset_limits(self, user_id: int):
+    async def check_and_reset_limits(self, user_id: int, user: Optional[Dict] = None) -> bool:
         """
         Проверяет, нужно ли сбросить дневные лимиты
-        Сбрасывает, если прошло больше суток с последнего обновления
+        Основной сброс делает фоновая задача в полночь, здесь только
+        подстраховка для пользователей, до которых она еще не дошла
         
         Args:
             user_id: Telegram user ID
+            user: уже загруженные данные пользователя (чтобы не читать БД повторно)
+
+        Returns:
+            bool: True, если лимиты были сброшены
         """
-        user = await self.get_user(user_id)
+        if user is None:
+            user = await self.get_user(user_id)
         if not user:
-            return
+            return False
         
-        # Если limits_updated_at не установлен, сбрасываем лимиты
-        if not user['limits_updated_at']:
-            await self.reset_daily_limits(user_id)
-            return
-        
-        # Парсим дату последнего обновления
-        last_update = datetime.fromisoformat(user['limits_updated_at'])
-        now = datetime.now()
-        
-        # Проверяем, прошло ли больше суток
-        if (now - last_update) > timedelta(days=1):
-            await self.reset_daily_limits(user_id)
-        # Или если это новый день (сброс в полночь)
-        elif last_update.date() < now.date():
+        if (user['limits_day'] or 0) < today():
             await self.reset_daily_limits(user_id)
+            return True
+        return False
     
     async def update_subscription(
         self, 
@@ -194,7 +562,7 @@ class UserStorage(BaseStorage):
             tariff: Тарифный план ('free', 'pro', 'ultra')
             expires_at: Дата окончания подписки в ISO формате (опционально)
         """
-        async with aiosqlite.connect(self.db_path) as conn:
+        async with self.connect() as conn:
             cursor = await conn.cursor()
             
             await cursor.execute("""
@@ -205,6 +573,7 @@ class UserStorage(BaseStorage):
             """, (tariff, expires_at, user_id))
             
             await conn.commit()
+            self.invalidate(user_id)
             logger.info(f"💳 Обновлена подписка для пользователя {user_id}: {tariff}")
     
     def get_limits(self, tariff_plan: str) -> Dict:
@@ -219,17 +588,19 @@ class UserStorage(BaseStorage):
         """
         return self.TARIFF_LIMITS.get(tariff_plan, self.TARIFF_LIMITS['free'])
     
-    async def check_limits(self, user_id: int) -> tuple[bool, str]:
+    async def check_limits(self, user_id: int, user: Optional[Dict] = None) -> tuple[bool, str]:
         """
         Проверяет, не превышены ли лимиты пользователя
         
         Args:
             user_id: Telegram user ID
+            user: уже загруженные данные пользователя (чтобы не читать БД повторно)
             
         Returns:
             tuple: (можно_использовать: bool, сообщение_об_ошибке: str)
         """
-        user = await self.get_user(user_id)
+        if user is None:
+            user = await self.get_user(user_id)
         if not user:
             return False, "Пользователь не найден"
         
@@ -243,14 +614,11 @@ class UserStorage(BaseStorage):
             wait_time = timedelta(hours=hours)
             return int(wait_time.total_seconds() // 3600)
         
-        # Парсим дату последнего обновления
-        last_update = datetime.fromisoformat(user['limits_updated_at'])
+        # Лимиты сбрасываются в полночь
         now = datetime.now()
+        until_midnight = datetime.combine((now + timedelta(days=1)).date(), time()) - now
 
-        t1 = timedelta(days=1) - (now - last_update)
-        t2 = datetime.combine((now + timedelta(days=1)).date(), time()) - now
-
-        wait_time = round_timedelta_to_hour(min(t1, t2))
+        wait_time = round_timedelta_to_hour(until_midnight)
         
         
         # Проверяем лимит запросов (если не безлимит)
@@ -0,0 +1,190 @@
+# Загрузка документов (txt, md, pdf) в тему
+#
+# Файл скачивается потоком во временный файл на диске, текст читается
+# блоками и режется на фрагменты в потоке (не в event loop), фрагменты
+# пишутся в индекс DocumentStorage порциями. Ни файл, ни весь текст целиком
+# в памяти не держатся, в историю темы документ не попадает.
+#
+# PDF поддерживается, если установлен pypdf (pip install pypdf)
+
+import asyncio
+import codecs
+import importlib.util
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import Document
+
+from app.database.document_storage import DocumentStorage
+
+logger = logging.getLogger(__name__)
+
+# Больше 20 МБ Bot API скачать не дает
+MAX_DOCUMENT_SIZE = 20 * 1024 * 1024
+DOCUMENT_DIR = os.getenv('DOCUMENT_DIR', tempfile.gettempdir())
+
+# Размер фрагмента (символов, ~500 токенов) и сколько фрагментов писать за транзакцию
+CHUNK_CHARS = 1500
+CHUNK_BATCH = 200
+# Каким блоком читать текстовый файл
+READ_BLOCK = 64 * 1024
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.markdown')
+
+PDF_SUPPORTED = importlib.util.find_spec('pypdf') is not None
+
+
+class DocumentError(Exception):
+    """Документ нельзя проиндексировать (текст ошибки показывается пользователю)"""
+
+
+def document_kind(document: Document) -> Optional[str]:
+    """
+    Returns:
+        str: 'text', 'pdf' или None, если формат не поддерживается
+    """
+    name = (document.file_name or '').lower()
+    mime = document.mime_type or ''
+
+    if mime == 'application/pdf' or name.endswith('.pdf'):
+        return 'pdf'
+    if mime.startswith('text/') or name.endswith(TEXT_EXTENSIONS):
+        return 'text'
+    return None
+
+
+def detect_encoding(path: str) -> str:
+    """UTF-8, если начало файла в нем читается, иначе cp1251"""
+    with open(path, 'rb') as f:
+        head = f.read(READ_BLOCK)
+
+    try:
+        # Неполный многобайтовый символ в конце блока - не ошибка
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def read_text_blocks(path: str) -> Iterator[str]:
+    with open(path, encoding=detect_encoding(path), errors='replace') as f:
+        while block := f.read(READ_BLOCK):
+            yield block
+
+
+def read_pdf_blocks(path: str) -> Iterator[str]:
+    # pypdf разбирает страницы по мере обращения к ним, а не весь файл сразу
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            raise DocumentError("PDF защищен паролем.")
+        for page in reader.pages:
+            yield (page.extract_text() or '') + '\n\n'
+    except PdfReadError as e:
+        raise DocumentError("Не удалось прочитать PDF.") from e
+
+
+def split_chunks(blocks: Iterable[str], size: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+    Режет поток текста на фрагменты до size символов
+
+    Граница ищется во второй половине окна: сначала абзац, потом строка,
+    потом пробел, чтобы не рвать предложения и слова
+    """
+    buffer = ''
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= size:
+            window = buffer[:size]
+            cut = -1
+            for separator in ('\n\n', '\n', ' '):
+                cut = window.rfind(separator, size // 2)
+                if cut != -1:
+                    break
+            if cut == -1:
+                cut = size
+
+            chunk = buffer[:cut].strip()
+            buffer = buffer[cut:]
+            if chunk:
+                yield chunk
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def next_batch(chunks: Iterator[str], size: int = CHUNK_BATCH) -> List[str]:
+    """Следующие size фрагментов (пустой список, когда фрагменты кончились)"""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def index_document(
+    bot: Bot,
+    document: Document,
+    user_id: int,
+    chat_id: int,
+    thread_id: int,
+    documents: DocumentStorage
+) -> Tuple[int, int]:
+    """
+    Скачивает документ и индексирует его фрагменты в теме
+
+    Raises:
+        DocumentError: формат не поддерживается, файл слишком большой или в нем нет текста
+
+    Returns:
+        tuple: (ID документа, количество фрагментов)
+    """
+    kind = document_kind(document)
+    if kind is None:
+        raise DocumentError("Поддерживаются документы .txt, .md и .pdf.")
+    if kind == 'pdf' and not PDF_SUPPORTED:
+        raise DocumentError("PDF пока не поддерживается, пришлите текст в .txt или .md.")
+    if (document.file_size or 0) > MAX_DOCUMENT_SIZE:
+        raise DocumentError(f"Файл больше {MAX_DOCUMENT_SIZE // (1024 * 1024)} МБ.")
+
+    os.makedirs(DOCUMENT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='upload-', dir=DOCUMENT_DIR)
+    os.close(fd)
+
+    try:
+        # aiogram пишет файл на диск кусками по 64 КБ
+        await bot.download(document, destination=path)
+
+        document_id = await documents.add_document(
+            user_id, chat_id, thread_id, document.file_name, document.file_size
+        )
+        blocks = read_pdf_blocks(path) if kind == 'pdf' else read_text_blocks(path)
+        chunks = split_chunks(blocks)
+        total = 0
+
+        try:
+            while batch := await asyncio.to_thread(next_batch, chunks):
+                await documents.add_chunks(document_id, user_id, chat_id, thread_id, batch)
+                total += len(batch)
+        except BaseException:
+            await documents.delete_document(user_id, chat_id, thread_id, document_id)
+            raise
+        finally:
+            chunks.close()
+            blocks.close()
+
+        if not total:
+            await documents.delete_document(user_id, chat_id, thread_id, document_id)
+            raise DocumentError("В документе не найден текст.")
+
+        logger.info(f"📄 Документ {document.file_name} ({document.file_size} байт) проиндексирован: {total} фрагментов")
+        return document_id, total
+    finally:
+        os.remove(path)
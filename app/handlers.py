@@ -1,8 +1,9 @@
 import html
 import asyncio
 import logging
+from typing import Dict, Optional
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, ErrorEvent, LinkPreviewOptions
+from aiogram.types import Message, CallbackQuery, User, ReplyKeyboardRemove, ErrorEvent, LinkPreviewOptions
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -12,10 +13,15 @@ from aiogram.utils.markdown import hbold
 from aiogram.exceptions import TelegramRetryAfter
 
 from app.generate import ai_generate, GENERATOR_MODEL
+from app.documents import DocumentError, index_document
+from app.inflight import CONTINUE_PREFIX, CONTINUE_PROMPT, InFlight
+from app.streaming import CoalescingStream
 from app.utils import smart_split
 
 from app.database.chat_storage import ChatStorage
 from app.database.user_storage import UserStorage 
+from app.database.retrieval_storage import RetrievalStorage
+from app.database.document_storage import DocumentStorage
 
 router = Router()
 
@@ -46,20 +52,20 @@ async def cmd_start(message: Message, user_storage: UserStorage):
 
 
 @router.message(Command('settings'))
-async def cmd_settings(message: Message, user_storage: UserStorage):
+async def cmd_settings(message: Message, storage: ChatStorage, user_storage: UserStorage, user_data: Optional[Dict]):
     logger.info(f'Пользователь @{message.from_user.username} - {message.from_user.id} нажал /settings')
 
     try:
         user = message.from_user
-    
-        # Проверяем и сбрасываем лимиты, если нужно
-        await user_storage.check_and_reset_limits(user.id)
         
-        # Получаем реальные данные из БД
-        user_data = await user_storage.get_user(user.id)
+        # Данные пользователя загружает UserContextMiddleware
         if not user_data:
             await message.answer("❌ Пользователь не найден. Попробуйте /start")
             return
+
+        # Проверяем и сбрасываем лимиты, если нужно
+        if await user_storage.check_and_reset_limits(user.id, user_data):
+            user_data = await user_storage.get_user(user.id)
         
         # Получаем лимиты для тарифа
         limits = user_storage.get_limits(user_data['tariff_plan'])
@@ -72,7 +78,9 @@ async def cmd_settings(message: Message, user_storage: UserStorage):
             "requests_limit": limits['requests_per_day'],
             "tokens_left": limits['tokens_per_day'] - user_data['tokens_today'] if limits['tokens_per_day'] != -1 else -1,
             "status": user_data['tariff_plan'].capitalize(),
-            "total_requests": user_data['total_requests']
+            "total_requests": user_data['total_requests'],
+            # Счетчик тем ведется при записи истории, без подсчета строк
+            "threads": await storage.count_threads(user.id)
         }
         
         # Формируем имя с защитой от HTML-тегов в нике
@@ -108,7 +116,8 @@ async def cmd_settings(message: Message, user_storage: UserStorage):
             f"└ [{progress_bar}]\n\n"
             
             f"📊 <b>Статистика:</b>\n"
-            f"└ Всего запросов: <b>{stats['total_requests']}</b>\n\n"
+            f"├ Всего запросов: <b>{stats['total_requests']}</b>\n"
+            f"└ Диалогов с историей: <b>{stats['threads']}</b>\n\n"
             
             f"<i>Powered by a4dev</i>"
         )
@@ -120,12 +129,16 @@ async def cmd_settings(message: Message, user_storage: UserStorage):
 
 
 @router.message(Command('clear'))
-async def cmd_clear(message: Message, storage: ChatStorage, user_storage: UserStorage):
+async def cmd_clear(
+    message: Message,
+    storage: ChatStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage,
+    user_data: Optional[Dict]
+):
     logger.info(f'Пользователь @{message.from_user.username} - {message.from_user.id} нажал /clear')
     
     try:
-        user = message.from_user
-        user_data = await user_storage.get_user(user.id)
         if not user_data:
             await message.answer("❌ Пользователь не найден. Попробуйте /start")
             return
@@ -135,6 +148,16 @@ async def cmd_clear(message: Message, storage: ChatStorage, user_storage: UserSt
             message.chat.id,
             message.message_thread_id
         )
+        await retrieval.clear(
+            message.from_user.id,
+            message.chat.id,
+            message.message_thread_id
+        )
+        await documents.clear(
+            message.from_user.id,
+            message.chat.id,
+            message.message_thread_id
+        )
         await message.answer("История очищена 🗑️")
     except Exception as e:
         logger.error(f'Ошибка при /clear: {e}', exc_info=True)
@@ -142,10 +165,9 @@ async def cmd_clear(message: Message, storage: ChatStorage, user_storage: UserSt
 
 
 @router.message(Command('set_lim'))
-async def cmd_clear(message: Message, storage: ChatStorage, user_storage: UserStorage):    
+async def cmd_clear(message: Message, user_storage: UserStorage, user_data: Optional[Dict]):    
     try:
         user = message.from_user
-        user_data = await user_storage.get_user(user.id)
         if not user_data:
             await message.answer("❌ Пользователь не найден. Попробуйте /start")
             return
@@ -162,31 +184,166 @@ async def wait(message: Message):
     await message.reply('Нужно подождать..')
 
 
+@router.message(F.document)
+async def upload_document(
+    message: Message,
+    state: FSMContext,
+    user_storage: UserStorage,
+    documents: DocumentStorage,
+    user_data: Optional[Dict]
+):
+    logger.info(f'Пользователь @{message.from_user.username} - {message.from_user.id} загрузил документ')
+    locked = False
+
+    try:
+        user = message.from_user
+        if not user_data:
+            await message.answer("❌ Пользователь не найден. Попробуйте /start")
+            return
+
+        if await user_storage.check_and_reset_limits(user.id, user_data):
+            user_data = await user_storage.get_user(user.id)
+
+        can_use, error_msg = await user_storage.check_limits(user.id, user_data)
+        if not can_use:
+            await message.answer(error_msg)
+            return
+
+        # Пока документ индексируется, вопросы в теме ждут, как во время генерации
+        if not await state.storage.acquire_lock(state.key):
+            await message.reply('Нужно подождать..')
+            return
+        locked = True
+
+        await state.set_state(Gen.wait)
+        await message.bot.send_chat_action(
+            chat_id=message.chat.id,
+            action='upload_document',
+            message_thread_id=message.message_thread_id
+        )
+
+        _, chunks = await index_document(
+            message.bot,
+            message.document,
+            user.id,
+            message.chat.id,
+            message.message_thread_id,
+            documents
+        )
+        await message.answer(
+            f"📄 Документ {hbold(message.document.file_name or 'без имени')} добавлен "
+            f"({chunks} фрагм.). Задавайте вопросы по нему.",
+            parse_mode='HTML'
+        )
+    except DocumentError as e:
+        await message.answer(f"❌ {e}")
+    except Exception as e:
+        logger.error(f'Ошибка при загрузке документа: {e}', exc_info=True)
+        await message.answer("❌ Не удалось обработать документ. Попробуйте еще раз позже.")
+    finally:
+        if locked:
+            await state.clear()
+            await state.storage.release_lock(state.key)
+
+
 @router.message()
-async def answer(message: Message, state: FSMContext, storage: ChatStorage, user_storage: UserStorage):
+async def answer(
+    message: Message,
+    state: FSMContext,
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage,
+    inflight: InFlight,
+    user_data: Optional[Dict]
+):
     if not message.text and message.content_type in ['forum_topic_created', 'new_chat_members', 'pinned_message']:
         return
     
     if not message.text:
-        await message.answer("Отправьте текстовое сообщение.")
+        await message.answer("Отправьте текстовое сообщение или документ (.txt, .md, .pdf).")
         return
-    
+
+    await generate_reply(
+        message, message.from_user, message.text,
+        state, storage, user_storage, retrieval, documents, inflight, user_data
+    )
+
+
+@router.callback_query(F.data.startswith(CONTINUE_PREFIX))
+async def continue_answer(
+    callback: CallbackQuery,
+    state: FSMContext,
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage,
+    inflight: InFlight,
+    user_data: Optional[Dict]
+):
+    """Кнопка "Продолжить" под ответом, прерванным перезапуском бота"""
+    # В группе кнопку видят все, а история у каждого своя
+    if callback.data != f'{CONTINUE_PREFIX}{callback.from_user.id}':
+        await callback.answer("Это продолжение чужого ответа.")
+        return
+
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await generate_reply(
+        callback.message, callback.from_user, CONTINUE_PROMPT,
+        state, storage, user_storage, retrieval, documents, inflight, user_data
+    )
+
+
+async def generate_reply(
+    message: Message,
+    user: User,
+    text: str,
+    state: FSMContext,
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage,
+    inflight: InFlight,
+    user_data: Optional[Dict]
+):
+    """
+    Генерирует ответ на text и отправляет его в чат message
+
+    Args:
+        message: сообщение, в чат (и тему) которого отвечать
+        user: пользователь, чья история и лимиты используются
+        text: вопрос пользователя
+    """
+    locked = False
+
+    if inflight.draining:
+        # Апдейт принят уже во время остановки: ответ не успеет сгенерироваться
+        await message.answer("⏸ Бот перезапускается, повторите вопрос через минуту.")
+        return
+
     try:
-        user = message.from_user
-        user_data = await user_storage.get_user(user.id)
         if not user_data:
             await message.answer("❌ Пользователь не найден. Попробуйте /start")
             return
 
         # Проверяем и сбрасываем лимиты, если нужно
-        await user_storage.check_and_reset_limits(message.from_user.id)
+        if await user_storage.check_and_reset_limits(user.id, user_data):
+            user_data = await user_storage.get_user(user.id)
         
         # Проверяем, не превышены ли лимиты
-        can_use, error_msg = await user_storage.check_limits(message.from_user.id)
+        can_use, error_msg = await user_storage.check_limits(user.id, user_data)
         if not can_use:
             await message.answer(error_msg)
             return
 
+        # Атомарная блокировка закрывает гонку двух сообщений,
+        # пришедших раньше, чем установилось состояние Gen.wait
+        if not await state.storage.acquire_lock(state.key):
+            await message.reply('Нужно подождать..')
+            return
+        locked = True
+
         await state.set_state(Gen.wait)
         
         # Отправляем draft с "Думаю.."
@@ -205,101 +362,114 @@ async def answer(message: Message, state: FSMContext, storage: ChatStorage, user
         rate_limit_until = 0
         found_links = []
 
-        async for chunk, resources in ai_generate(
-            text=message.text,
-            storage=storage,
-            user_id=message.from_user.id,
-            chat_id=message.chat.id,
-            thread_id=message.message_thread_id
-        ):
-            full_text += chunk
-            current_time = asyncio.get_event_loop().time()
-            if resources and not found_links:
-                found_links = resources
-
-            # Проверяем, прошло ли достаточно времени с последнего обновления
-            # И не находимся ли мы в rate limit
-            if current_time - last_update_time < update_interval:
-                continue
+        with inflight.track(user.id, message.chat.id, message.message_thread_id, text) as generation:
+            # Дельты модели приходят склеенными в пачки (см. app/streaming.py)
+            stream = CoalescingStream(ai_generate(
+                text=text,
+                storage=storage,
+                user_id=user.id,
+                chat_id=message.chat.id,
+                thread_id=message.message_thread_id,
+                retrieval=retrieval,
+                documents=documents
+            ))
+            async with stream:
+                async for chunk, resources in stream:
+                    full_text += chunk
+                    generation.partial = full_text
+                    current_time = asyncio.get_event_loop().time()
+                    if resources and not found_links:
+                        found_links = resources
+
+                    # Проверяем, прошло ли достаточно времени с последнего обновления
+                    # И не находимся ли мы в rate limit
+                    if current_time - last_update_time < update_interval:
+                        continue
             
-            # Накапливаем чанки во время rate limit
-            if is_rate_limited and current_time < rate_limit_until:
-                continue
-
-            try:
-                # Ограничиваем draft до 4000 символов
-                draft_text = full_text[:4000] + ('...' if len(full_text) > 4000 else '')
-
-                await message.bot.send_message_draft(
-                    chat_id=message.chat.id,
-                    draft_id=message.message_id,
-                    text=draft_text,
-                    message_thread_id=message.message_thread_id,
-                    parse_mode=None
-                )
-                last_update_time = current_time
-                is_rate_limited = False
-                await asyncio.sleep(0.01)
-
-            except TelegramRetryAfter as e:
-                logger.warning(f'Rate limit: ждем {e.retry_after} сек, накапливаем чанки')
-                is_rate_limited = True
-                rate_limit_until = current_time + e.retry_after
+                    # Накапливаем чанки во время rate limit
+                    if is_rate_limited and current_time < rate_limit_until:
+                        continue
+
+                    try:
+                        # Ограничиваем draft до 4000 символов
+                        draft_text = full_text[:4000] + ('...' if len(full_text) > 4000 else '')
+
+                        await message.bot.send_message_draft(
+                            chat_id=message.chat.id,
+                            draft_id=message.message_id,
+                            text=draft_text,
+                            message_thread_id=message.message_thread_id,
+                            parse_mode=None
+                        )
+                        last_update_time = current_time
+                        is_rate_limited = False
+                        await asyncio.sleep(0.01)
+
+                    except TelegramRetryAfter as e:
+                        logger.warning(f'Rate limit: ждем {e.retry_after} сек, накапливаем чанки')
+                        is_rate_limited = True
+                        rate_limit_until = current_time + e.retry_after
                 
-                # Ждем указанное время
-                await asyncio.sleep(e.retry_after)
+                        # Ждем указанное время
+                        await asyncio.sleep(e.retry_after)
 
-                # После ожидания отправляем накопленный текст
-                draft_text = full_text[:4000] + ('...' if len(full_text) > 4000 else '')
+                        # После ожидания отправляем накопленный текст
+                        draft_text = full_text[:4000] + ('...' if len(full_text) > 4000 else '')
                 
+                        try:
+                            await message.bot.send_message_draft(
+                                chat_id=message.chat.id,
+                                draft_id=message.message_id,
+                                text=draft_text,
+                                message_thread_id=message.message_thread_id,
+                                parse_mode=None
+                            )
+                            last_update_time = asyncio.get_event_loop().time()
+                            is_rate_limited = False
+
+                        except Exception as e:
+                            logger.error(f'Ошибка после retry: {e}', exc_info=True)
+
+                    except Exception as e:
+                        logger.error(f'Ошибка при генерации: {e}', exc_info=True)
+
+            full_text = html.escape(full_text)
+
+            # История сохранена в ai_generate, расход - здесь. Флаг ставится до await:
+            # update_usage копит расход в памяти до первой паузы, так что отмена
+            # при остановке не учтет его второй раз (см. save_interrupted)
+            generation.completed = True
+            # Обновляем статистику использования
+            # добавить подсчет реальных токенов из AI
+            await user_storage.update_usage(
+                user_id=user.id,
+                requests_delta=1,
+                tokens_delta=len(full_text)  # Временно считаем токены как длину текста
+            )
+
+            # ЗДЕСЬ используем smart_split для финальной отправки
+            parts = smart_split(full_text)
+
+            for i, part in enumerate(parts):
                 try:
-                    await message.bot.send_message_draft(
-                        chat_id=message.chat.id,
-                        draft_id=message.message_id,
-                        text=draft_text,
-                        message_thread_id=message.message_thread_id,
-                        parse_mode=None
-                    )
-                    last_update_time = asyncio.get_event_loop().time()
-                    is_rate_limited = False
-
+                    if found_links and i == len(parts) - 1:
+                        links_formatted = [
+                            f'<a href="{link["url"]}">[{i+1}]</a>' 
+                            for i, link in enumerate(found_links)
+                        ]
+                        part += f"\n\n🌐 <i>Источники:</i> {', '.join(links_formatted)}"
+                    await message.answer(part, parse_mode='HTML', link_preview_options=LinkPreviewOptions(is_disabled=True))
+                    if i < len(parts) - 1:  # Пауза между частями
+                        await asyncio.sleep(0.3)
                 except Exception as e:
-                    logger.error(f'Ошибка после retry: {e}', exc_info=True)
-
-            except Exception as e:
-                logger.error(f'Ошибка при генерации: {e}', exc_info=True)
-
-        full_text = html.escape(full_text)
-
-        # ЗДЕСЬ используем smart_split для финальной отправки
-        parts = smart_split(full_text)
-
-        for i, part in enumerate(parts):
-            try:
-                if found_links and i == len(parts) - 1:
-                    links_formatted = [
-                        f'<a href="{link["url"]}">[{i+1}]</a>' 
-                        for i, link in enumerate(found_links)
-                    ]
-                    part += f"\n\n🌐 <i>Источники:</i> {', '.join(links_formatted)}"
-                await message.answer(part, parse_mode='HTML', link_preview_options=LinkPreviewOptions(is_disabled=True))
-                if i < len(parts) - 1:  # Пауза между частями
-                    await asyncio.sleep(0.3)
-            except Exception as e:
-                logger.error(f'Ошибка отправки части {i+1}: {e}', exc_info=True)
-        
-        # Обновляем статистику использования
-        # добавить подсчет реальных токенов из AI
-        await user_storage.update_usage(
-            user_id=message.from_user.id,
-            requests_delta=1,
-            tokens_delta=len(full_text)  # Временно считаем токены как длину текста
-        )
+                    logger.error(f'Ошибка отправки части {i+1}: {e}', exc_info=True)
     except Exception as e:
         logger.error(f'Ошибка при генерации: {e}', exc_info=True)
         await message.answer("❌ Произошла ошибка. Попробуйте еще раз позже.")
     finally:
-        await state.clear()
+        if locked:
+            await state.clear()
+            await state.storage.release_lock(state.key)
 
 
 @router.error()
@@ -0,0 +1,163 @@
+# Плавная остановка: генерации, которые идут в момент остановки бота
+#
+# Обработчик answer регистрирует каждую генерацию в InFlight. При остановке
+# (on_shutdown) новые апдейты уже не принимаются, а начатые генерации
+# дорабатывают до SHUTDOWN_GRACE секунд. Те, что не успели, отменяются:
+# начало ответа отправляется пользователю и сохраняется в историю вместе
+# с расходом, а кнопка "Продолжить" после перезапуска досылает остаток.
+#
+# Таймаут остановки у systemd/docker должен быть больше SHUTDOWN_GRACE
+
+import asyncio
+import html
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.generate import current_generation, save_partial_answer
+from app.utils import smart_split
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд начатые генерации могут дорабатывать при остановке
+SHUTDOWN_GRACE = float(os.getenv('SHUTDOWN_GRACE', '20'))
+
+# callback_data кнопки "Продолжить": continue:<user_id>
+CONTINUE_PREFIX = 'continue:'
+# Запрос к модели, которым досылается прерванный ответ
+CONTINUE_PROMPT = "Продолжи свой предыдущий ответ с того места, где он оборвался, не повторяя уже написанное."
+
+
+class Generation:
+    """Генерация ответа, идущая прямо сейчас"""
+
+    def __init__(self, user_id: int, chat_id: int, thread_id: Optional[int], text: str):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.text = text
+        self.task = asyncio.current_task()
+        # Сколько ответа уже получено от модели
+        self.partial = ''
+        # Вопрос и ответ записаны в историю (отмечает save_turn)
+        self.saved = False
+        # Расход учтен, осталось только отправить ответ
+        self.completed = False
+
+
+class InFlight:
+    """Реестр идущих генераций одного процесса"""
+
+    def __init__(self):
+        self.generations: Dict[int, Generation] = {}
+        self.draining = False
+
+    @contextmanager
+    def track(self, user_id: int, chat_id: int, thread_id: Optional[int], text: str):
+        """Регистрирует генерацию на время блока with (вызывать из задачи обработчика)"""
+        generation = Generation(user_id, chat_id, thread_id, text)
+        self.generations[id(generation)] = generation
+        # Задачи, созданные внутри блока (CoalescingStream), видят генерацию через контекст
+        token = current_generation.set(generation)
+        try:
+            yield generation
+        finally:
+            current_generation.reset(token)
+            self.generations.pop(id(generation), None)
+
+    async def drain(self, grace: float = SHUTDOWN_GRACE) -> List[Generation]:
+        """
+        Ждет завершения идущих генераций не дольше grace секунд,
+        оставшиеся отменяет
+
+        Returns:
+            list: генерации, отмененные по истечении grace
+        """
+        self.draining = True
+        deadline = time.monotonic() + grace
+
+        if self.generations:
+            logger.info(f"⏳ Ждем завершения генераций: {len(self.generations)}, не дольше {grace:.0f} с")
+
+        # Пока ждем, могут начаться генерации из уже принятых апдейтов
+        while self.generations:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            await asyncio.wait([g.task for g in self.generations.values()], timeout=left)
+
+        interrupted = list(self.generations.values())
+        for generation in interrupted:
+            generation.task.cancel()
+        if interrupted:
+            await asyncio.gather(*(g.task for g in interrupted), return_exceptions=True)
+            logger.warning(f"⏹️ Прервано генераций: {len(interrupted)}")
+        return interrupted
+
+
+def continue_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text='▶️ Продолжить', callback_data=f'{CONTINUE_PREFIX}{user_id}')
+    ]])
+
+
+async def save_interrupted(bot: Bot, generation: Generation, storage, user_storage, retrieval=None):
+    """
+    Сохраняет прерванную генерацию: начало ответа - в историю и пользователю,
+    потраченное - в расход, плюс кнопка "Продолжить"
+    """
+    if generation.completed:
+        # История и расход уже сохранены, не успела только отправка
+        return
+
+    if generation.saved:
+        # ai_generate записал ход в историю, но до учета расхода генерацию отменили
+        await user_storage.update_usage(
+            user_id=generation.user_id,
+            requests_delta=1,
+            tokens_delta=len(html.escape(generation.partial))
+        )
+        return
+
+    if not generation.partial:
+        # Продолжать нечего: пользователь просто спросит еще раз
+        await bot.send_message(
+            generation.chat_id,
+            "⏸ <i>Бот перезапускается, ответ прерван. Повторите вопрос через минуту.</i>",
+            message_thread_id=generation.thread_id,
+            parse_mode='HTML'
+        )
+        return
+
+    await save_partial_answer(
+        storage, generation.user_id, generation.chat_id, generation.thread_id,
+        generation.text, generation.partial, retrieval
+    )
+    # Как в answer: пока токены считаются длиной текста
+    await user_storage.update_usage(
+        user_id=generation.user_id,
+        requests_delta=1,
+        tokens_delta=len(generation.partial)
+    )
+
+    notice = "⏸ <i>Бот перезапускается, ответ прерван. Нажмите «Продолжить», когда он вернется.</i>"
+    parts = smart_split(html.escape(generation.partial))
+    if len(parts[-1]) + len(notice) < 3500:
+        parts[-1] = f"{parts[-1]}…\n\n{notice}"
+    else:
+        parts.append(notice)
+
+    markup = continue_keyboard(generation.user_id)
+    for i, part in enumerate(parts):
+        await bot.send_message(
+            generation.chat_id,
+            part,
+            message_thread_id=generation.thread_id,
+            parse_mode='HTML',
+            reply_markup=markup if i == len(parts) - 1 else None
+        )
@@ -0,0 +1,125 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+
+# ID текущего апдейта Telegram, проставляется middleware и попадает в каждую строку лога
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+# Доля сохраняемых INFO/DEBUG записей по логгерам (предупреждения и ошибки пишутся всегда)
+LOG_SAMPLE_RATES: Dict[str, float] = {
+    'app.generate.payload': 0.1,
+}
+# Максимальная длина сообщения по логгерам (символы)
+LOG_SIZE_CAPS: Dict[str, int] = {
+    'app.generate.payload': 2000,
+}
+DEFAULT_SIZE_CAP = 4000
+
+
+class ContextFilter(logging.Filter):
+    """
+    Выполняется в потоке, который пишет лог (event loop), до постановки в очередь:
+    прикрепляет request_id, прореживает шумные логгеры и обрезает большие сообщения
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = LOG_SAMPLE_RATES.get(record.name)
+            if rate is not None and random.random() >= rate:
+                return False
+
+        record.request_id = request_id_var.get()
+
+        cap = LOG_SIZE_CAPS.get(record.name, DEFAULT_SIZE_CAP)
+        message = record.getMessage()
+        if len(message) > cap:
+            record.msg = f"{message[:cap]}... [+{len(message) - cap} символов]"
+            record.args = None
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, 'request_id', '-'),
+            "msg": record.getMessage(),
+        }
+        # Запись из очереди приходит с готовым exc_text (см. StructuredQueueHandler)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не вклеивает traceback в текст сообщения
+
+    Стандартный prepare() форматирует запись целиком (вместе с traceback)
+    в msg и обнуляет exc_info. Здесь traceback сохраняется отдельно в exc_text:
+    JsonFormatter пишет его в поле exc, а обычный Formatter сам
+    допишет его после сообщения
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # exc_info с объектом traceback не нужен фоновому потоку и держит кадры стека
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def setup_logging(log_file: str = 'bot.log') -> QueueListener:
+    """
+    Настраивает неблокирующее логирование
+
+    Обработчики логгеров только кладут запись в очередь, а запись в файл
+    и консоль делает фоновый поток, поэтому event loop не ждет диск
+
+    Args:
+        log_file: файл для JSON-логов (с ротацией)
+
+    Returns:
+        QueueListener: фоновый писатель (останавливается автоматически при выходе)
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=5000000, backupCount=3, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+    ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time as timer
+from datetime import datetime, timedelta, time
+
+from app.database.chat_storage import ChatStorage
+from app.database.sharded_chat_storage import ShardedChatStorage
+from app.database.maintenance_storage import MaintenanceStorage
+from app.database.retrieval_storage import RetrievalStorage
+from app.database.document_storage import DocumentStorage
+from app.database.user_storage import UserStorage
+
+logger = logging.getLogger(__name__)
+
+
+def seconds_until_midnight() -> float:
+    """Сколько секунд осталось до начала следующих суток (по локальному времени)"""
+    now = datetime.now()
+    midnight = datetime.combine((now + timedelta(days=1)).date(), time())
+    return (midnight - now).total_seconds()
+
+
+async def run_daily_reset(user_storage: UserStorage, maintenance: MaintenanceStorage) -> int:
+    """
+    Массово сбрасывает дневные лимиты и записывает длительность в журнал
+
+    Returns:
+        int: количество сброшенных пользователей
+    """
+    started_at = datetime.now()
+    start = timer.perf_counter()
+
+    rows = await user_storage.reset_all_daily_limits()
+
+    duration_ms = (timer.perf_counter() - start) * 1000
+    await maintenance.log_run('daily_reset', started_at, duration_ms, rows)
+    logger.info(f"🔄 Дневные лимиты сброшены: {rows} пользователей за {duration_ms:.1f} мс")
+    return rows
+
+
+async def daily_reset_loop(user_storage: UserStorage, maintenance: MaintenanceStorage):
+    """
+    Фоновая задача: сбрасывает дневные лимиты на границе суток
+
+    При старте сразу догоняет пропущенный сброс (если бот был выключен в полночь)
+    """
+    while True:
+        try:
+            await run_daily_reset(user_storage, maintenance)
+        except Exception as e:
+            logger.error(f"Ошибка массового сброса лимитов: {e}", exc_info=True)
+
+        # +1 секунда, чтобы гарантированно проснуться уже в новых сутках
+        await asyncio.sleep(seconds_until_midnight() + 1)
+
+
+async def recompress_histories(storage: ChatStorage, maintenance: MaintenanceStorage, pause: float = 0.05):
+    """
+    Фоновая задача: переводит старые JSON-истории в сжатый формат
+
+    Идет порциями с паузами, чтобы не мешать боту писать в БД.
+    После полного прохода больше не запускается: новые строки
+    сразу пишутся сжатыми
+    """
+    if await maintenance.get_last_runs('recompress_histories', limit=1):
+        return
+
+    started_at = datetime.now()
+    start = timer.perf_counter()
+    key = (-2**63, -2**63, -2**63)
+    total_rows = total_before = total_after = 0
+
+    try:
+        while key is not None:
+            key, rows, bytes_before, bytes_after = await storage.recompress_batch(key)
+            total_rows += rows
+            total_before += bytes_before
+            total_after += bytes_after
+            await asyncio.sleep(pause)
+    except Exception as e:
+        logger.error(f"Ошибка пересжатия историй: {e}", exc_info=True)
+        return
+
+    duration_ms = (timer.perf_counter() - start) * 1000
+    await maintenance.log_run('recompress_histories', started_at, duration_ms, total_rows)
+
+    if total_rows:
+        ratio = total_before / max(total_after, 1)
+        logger.info(
+            f"🗜️ Пересжато {total_rows} историй: {total_before / 1e6:.1f} МБ -> "
+            f"{total_after / 1e6:.1f} МБ (в {ratio:.1f} раза) за {duration_ms / 1000:.1f} с"
+        )
+
+
+# Как часто проверять сроки хранения историй (секунды)
+RETENTION_INTERVAL = 3600
+# Сколько тем удалять за одну транзакцию и пауза между порциями
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE = 0.1
+# Сколько страниц возвращать ОС за один шаг incremental_vacuum
+VACUUM_PAGES = 1000
+
+
+async def vacuum(storage):
+    """Возвращает ОС свободные страницы БД маленькими шагами вместо полного VACUUM"""
+    free_pages = await storage.incremental_vacuum(VACUUM_PAGES)
+    while free_pages > 0:
+        await asyncio.sleep(PURGE_PAUSE)
+        remaining = await storage.incremental_vacuum(VACUUM_PAGES)
+        if remaining >= free_pages:
+            # auto_vacuum выключен, страницы не освобождаются
+            break
+        free_pages = remaining
+
+
+async def run_retention(
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    maintenance: MaintenanceStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage
+) -> int:
+    """
+    Удаляет темы, в которых давно не было активности, и возвращает место ОС
+
+    Срок хранения берется из тарифа пользователя (history_retention_days)
+
+    Returns:
+        int: сколько тем удалено
+    """
+    started_at = datetime.now()
+    start = timer.perf_counter()
+    now = int(timer.time())
+    purged = 0
+
+    for tariff, limits in user_storage.TARIFF_LIMITS.items():
+        retention_days = limits.get('history_retention_days', -1)
+        if retention_days == -1:
+            continue
+
+        cutoff = now - retention_days * 86400
+        while True:
+            deleted = await storage.purge_expired(tariff, cutoff, PURGE_BATCH_SIZE)
+            purged += len(deleted)
+            # Поисковый индекс и документы удаленных тем больше не нужны
+            # (история может лежать в шардах, поэтому не JOIN, а по списку)
+            if deleted:
+                await retrieval.clear_threads(deleted)
+                await documents.clear_threads(deleted)
+            if len(deleted) < PURGE_BATCH_SIZE:
+                break
+            await asyncio.sleep(PURGE_PAUSE)
+
+    await documents.purge_orphans(storage, PURGE_BATCH_SIZE)
+
+    # Освобождаем страницы маленькими шагами вместо полного VACUUM.
+    # С шардами история в отдельных файлах, основную БД чистим отдельно
+    await vacuum(storage)
+    if isinstance(storage, ShardedChatStorage):
+        await vacuum(maintenance)
+
+    duration_ms = (timer.perf_counter() - start) * 1000
+    await maintenance.log_run('retention', started_at, duration_ms, purged)
+    if purged:
+        logger.info(f"🧹 Удалено {purged} устаревших тем за {duration_ms:.1f} мс")
+    return purged
+
+
+async def retention_loop(
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    maintenance: MaintenanceStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage
+):
+    """Фоновая задача: периодически применяет политику хранения историй"""
+    while True:
+        try:
+            await run_retention(storage, user_storage, maintenance, retrieval, documents)
+        except Exception as e:
+            logger.error(f"Ошибка очистки устаревших тем: {e}", exc_info=True)
+
+        await asyncio.sleep(RETENTION_INTERVAL)
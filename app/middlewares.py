@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, TelegramObject, Update
+
+from app.database.user_storage import UserStorage
+from app.logging_setup import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений в секунду пользователь может присылать в среднем
+# и сколько подряд (пачкой), прежде чем лишние начнут отбрасываться
+FLOOD_RATE = 1.0
+FLOOD_BURST = 5
+# Типы апдейтов, которые проходят через ограничитель флуда
+THROTTLED_EVENTS = ('message', 'callback_query')
+
+# Telegram допускает ~30 сообщений в секунду на бота - общий предел всех отправок процесса
+SEND_RATE = 28
+# Методы send*, которые не считаются отправкой сообщения
+UNLIMITED_METHODS = {'sendChatAction', 'sendMessageDraft'}
+
+
+class RequestIdMiddleware(BaseMiddleware):
+    """
+    Проставляет ID апдейта в контекст логирования
+
+    Все записи лога, сделанные при обработке апдейта (включая генерацию
+    и поиск), получают один request_id и легко связываются друг с другом
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = request_id_var.set(str(event.update_id))
+        try:
+            return await handler(event, data)
+        finally:
+            request_id_var.reset(token)
+
+
+class RateLimiter:
+    """
+    Ограничитель скорости: не больше rate разрешений в секунду на всех,
+    кто его ждет, а после 429 от Telegram - пауза для всех сразу
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_slot = max(self.next_slot, loop.time()) + self.interval
+
+    def pause(self, seconds: float):
+        """Откладывает все следующие разрешения на seconds секунд"""
+        loop = asyncio.get_running_loop()
+        self.next_slot = max(self.next_slot, loop.time() + seconds)
+
+
+class SendRateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Общий ограничитель отправок бота (middleware сессии Bot API, см. create_bot)
+
+    Через него проходят и ответы пользователям, и рассылка: вместе они
+    не превышают SEND_RATE сообщений в секунду, а 429 на любой отправке
+    ставит на паузу все остальные
+    """
+
+    def __init__(self, rate: float = SEND_RATE):
+        self.limiter = RateLimiter(rate)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        if not name.startswith(('send', 'copy', 'forward')) or name in UNLIMITED_METHODS:
+            return await make_request(bot, method)
+
+        await self.limiter.wait()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+            raise
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты по ключу (алгоритм token bucket), только в памяти
+
+    Каждому ключу доступно burst токенов, они восполняются со скоростью rate в секунду
+    """
+
+    def __init__(self, rate: float = FLOOD_RATE, burst: int = FLOOD_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+        self._pruned_at = time.monotonic()
+
+    def allow(self, key: int) -> bool:
+        """Списывает токен; False - токенов нет, событие нужно отбросить"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        self._prune(now)
+        return allowed
+
+    def _prune(self, now: float):
+        """Удаляет давно полные ведра, чтобы словарь не рос без ограничений"""
+        refill_time = self.burst / self.rate
+        if now - self._pruned_at < refill_time:
+            return
+        self._pruned_at = now
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < refill_time
+        }
+
+
+class FloodMiddleware(BaseMiddleware):
+    """
+    Отбрасывает флуд (внешний middleware на dp.update, см. setup_middlewares)
+
+    Стоит раньше FSM-middleware aiogram: лишнее сообщение не читает состояние
+    FSM, не загружает пользователя и не доходит ни до БД, ни до LLM
+    """
+
+    def __init__(self, throttle: Optional[TokenBucket] = None):
+        self.throttle = throttle or TokenBucket()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Пользователя апдейта уже определил UserContextMiddleware aiogram
+        user = data.get('event_from_user')
+        if user is not None and event.event_type in THROTTLED_EVENTS and not self.throttle.allow(user.id):
+            logger.debug(f"🚫 Флуд от пользователя {user.id}, апдейт отброшен")
+            return None
+        return await handler(event, data)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает пользователя один раз на сообщение
+
+    Запись пользователя (из короткого кэша UserStorage) передается
+    в обработчики аргументом user_data (None, если пользователя еще нет)
+    """
+
+    def __init__(self, user_storage: UserStorage):
+        self.user_storage = user_storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = event.from_user
+        data['user_data'] = await self.user_storage.get_user(user.id) if user is not None else None
+        return await handler(event, data)
+
+
+def setup_middlewares(
+    dp: Dispatcher,
+    user_storage: UserStorage,
+    throttle: Optional[TokenBucket] = None,
+    traffic: Optional[BaseMiddleware] = None
+):
+    """
+    Регистрирует middleware бота
+
+    Внешние middleware апдейта выполняются в порядке регистрации, а aiogram
+    регистрирует FSM-middleware еще в конструкторе Dispatcher - он читал бы
+    состояние и для флуда. Поэтому FSM снимается и ставится последним:
+    ошибки и пользователь (aiogram) -> request_id -> запись трафика -> флуд -> FSM
+
+    Args:
+        throttle: ограничитель флуда (по умолчанию FLOOD_RATE/FLOOD_BURST)
+        traffic: рекордер трафика (app/traffic.py) или None
+    """
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(RequestIdMiddleware())
+    if traffic is not None:
+        dp.update.outer_middleware(traffic)
+    dp.update.outer_middleware(FloodMiddleware(throttle))
+    dp.update.outer_middleware(dp.fsm)
+
+    user_context = UserContextMiddleware(user_storage)
+    dp.message.outer_middleware(user_context)
+    dp.callback_query.outer_middleware(user_context)
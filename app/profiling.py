@@ -0,0 +1,245 @@
+# Профилирование работающего бота (включается переменной окружения PROFILING=1)
+#
+# - Монитор блокировок: если event loop не отвечает дольше LOOP_LAG_THRESHOLD,
+#   в лог пишется стек кода, который его держит, и задача, в которой он выполняется.
+# - Сэмплирующий профилировщик по запросу: /profile [секунды] от админа или
+#   kill -USR1 <pid> снимает стеки всех потоков PROFILE_INTERVAL раз в секунду
+#   и пишет их в формате collapsed stacks (profiles/*.folded).
+#   Флеймграф: flamegraph.pl profile.folded > profile.svg или https://www.speedscope.app
+#
+# Пока профиль не снимается, профилировщик ничего не делает; монитор блокировок
+# стоит одной корутины-пульса и одного спящего потока.
+
+import asyncio
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILING = os.getenv('PROFILING') == '1'
+# Блокировка event loop дольше порога (секунды) попадает в лог со стеком
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+# Как часто пульс отмечается в event loop (секунды)
+LOOP_LAG_INTERVAL = 0.05
+
+# Пауза между сэмплами стеков (секунды)
+PROFILE_INTERVAL = 0.005
+PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    # ; - разделитель кадров в формате collapsed stacks
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(';', ':')
+
+
+def collapse_stack(frame) -> str:
+    """Стек кадра одной строкой "внешняя;...;внутренняя" (формат collapsed stacks)"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class LoopLagMonitor:
+    """
+    Следит, чтобы event loop не блокировался синхронным кодом
+
+    Корутина-пульс отмечает время каждые interval секунд, а отдельный поток
+    проверяет, не пропал ли пульс. Если event loop занят дольше threshold,
+    поток снимает стек event loop прямо во время блокировки
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._last_beat = time.monotonic()
+        self._reported = False
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает мониторинг текущего event loop (вызывать из него)"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._last_beat = started
+            await asyncio.sleep(self.interval)
+
+            lag = time.monotonic() - started - self.interval
+            if lag > self.threshold:
+                logger.warning(f"🐢 Event loop был заблокирован {lag * 1000:.0f} мс")
+            self._reported = False
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            blocked = time.monotonic() - self._last_beat - self.interval
+            if blocked <= self.threshold or self._reported:
+                continue
+
+            self._reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_name() if task else 'вне задачи'
+            stack = ''.join(traceback.format_stack(frame))
+            logger.warning(
+                f"🐢 Event loop заблокирован уже {blocked * 1000:.0f} мс, задача {task_name}:\n{stack}"
+            )
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик: снимает стеки всех потоков через sys._current_frames"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, out_dir: str = PROFILE_DIR):
+        self.interval = interval
+        self.out_dir = out_dir
+        self._lock = asyncio.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float) -> Tuple[str, int]:
+        """
+        Снимает профиль в течение seconds секунд
+
+        Сэмплы снимает отдельный daemon-поток (не пул потоков), чтобы
+        остановка бота не ждала конца профиля
+
+        Returns:
+            tuple: (путь к файлу .folded, количество сэмплов)
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+
+            def run():
+                try:
+                    result = self._sample(seconds)
+                except Exception as e:
+                    loop.call_soon_threadsafe(lambda: done.done() or done.set_exception(e))
+                else:
+                    loop.call_soon_threadsafe(lambda: done.done() or done.set_result(result))
+
+            self._stop.clear()
+            threading.Thread(target=run, name='sampling-profiler', daemon=True).start()
+            try:
+                return await done
+            finally:
+                self._stop.set()
+
+    def stop(self):
+        """Прерывает снятие профиля (то, что успели собрать, сохраняется)"""
+        self._stop.set()
+
+    def _sample(self, seconds: float) -> Tuple[str, int]:
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline and not self._stop.is_set():
+            # Номера в именах потоков (Thread-12) склеиваем, чтобы потоки aiosqlite
+            # и пула не дробили флеймграф
+            names = {thread.ident: re.sub(r'-\d+', '', thread.name) for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != me:
+                    stacks[f"{names.get(thread_id, 'thread')};{collapse_stack(frame)}"] += 1
+            samples += 1
+            self._stop.wait(self.interval)
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(
+            self.out_dir, f"profile-{os.getpid()}-{datetime.now():%Y%m%d-%H%M%S}.folded"
+        )
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path, samples
+
+
+class Profiler:
+    """
+    Монитор блокировок и профилировщик по запросу одного процесса
+
+    В вебхук-режиме у каждого воркера свой: /profile профилирует воркер,
+    обрабатывающий чат админа, а сигнал - процесс, которому он отправлен
+    """
+
+    def __init__(self, enabled: bool = PROFILING):
+        self.enabled = enabled
+        self.lag_monitor = LoopLagMonitor()
+        self.sampler = SamplingProfiler()
+        self._tasks = set()
+
+    def start(self):
+        """Вызывается при старте диспетчера (из event loop)"""
+        if not self.enabled:
+            return
+
+        self.lag_monitor.start()
+        if hasattr(signal, 'SIGUSR1'):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self._on_signal)
+        logger.info(
+            f"🔬 Профилирование включено: порог блокировки {LOOP_LAG_THRESHOLD * 1000:.0f} мс, "
+            f"профиль - /profile или kill -USR1 {os.getpid()}"
+        )
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.lag_monitor.stop()
+        self.sampler.stop()
+        if hasattr(signal, 'SIGUSR1'):
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+    async def profile(self, seconds: float = PROFILE_SECONDS) -> Tuple[str, int]:
+        """
+        Снимает профиль (не дольше MAX_PROFILE_SECONDS)
+
+        Returns:
+            tuple: (путь к файлу .folded, количество сэмплов)
+        """
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        logger.info(f"🔬 Снимаю профиль {seconds} с")
+        path, samples = await self.sampler.profile(seconds)
+        logger.info(f"🔬 Профиль сохранен: {path} ({samples} сэмплов)")
+        return path, samples
+
+    def _on_signal(self):
+        if self.sampler.running:
+            logger.warning("🔬 Профиль уже снимается")
+            return
+        task = asyncio.create_task(self.profile())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
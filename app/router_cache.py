@@ -0,0 +1,83 @@
+import hashlib
+from typing import Dict, List, Optional
+
+from app.answer_cache import normalize
+from app.cache import TTLCache
+
+# Сколько решений роутера хранить
+ROUTER_CACHE_SIZE = 2000
+# Время жизни решения без поиска и решения с поиском (секунды):
+# запросы для поиска привязаны ко времени ("latest", "last 7 days"), поэтому живут меньше
+ROUTER_CACHE_TTL = 30 * 60
+ROUTER_CACHE_SEARCH_TTL = 5 * 60
+
+
+def _digest(*parts: str) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(part.encode())
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def history_key(history: List[Dict]) -> str:
+    """
+    Ключ состояния диалога для роутера
+
+    Последний вопрос (нормализованный) + отпечаток предыдущего хода (вопрос и ответ).
+    Повтор или перефразирование того же вопроса и уточнения вроде "а подробнее?"
+    после того же ответа дают один ключ, а то же "а подробнее?" в другом
+    контексте - другой
+    """
+    question = normalize(history[-1].get('content') or '')
+
+    previous = [
+        msg.get('content') or '' for msg in history[-3:-1]
+        if msg.get('role') in ('user', 'assistant')
+    ]
+    return _digest(question, _digest(*previous))
+
+
+class RouterCache:
+    """Кэш решений роутера (нужен ли поиск и с какими запросами)"""
+
+    def __init__(self, maxsize: int = ROUTER_CACHE_SIZE):
+        self.entries = TTLCache(maxsize, ROUTER_CACHE_TTL)
+        self.hits = 0
+        self.misses = 0
+        # Сколько секунд запросов к роутеру сэкономил кэш
+        self.saved_seconds = 0.0
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Returns:
+            dict: копия закэшированного решения или None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_seconds += entry['latency']
+        return dict(entry['decision'])
+
+    def set(self, key: str, decision: Dict, latency: float):
+        """
+        Args:
+            key: ключ из history_key
+            decision: решение роутера
+            latency: сколько секунд занял запрос к роутеру
+        """
+        ttl = ROUTER_CACHE_SEARCH_TTL if decision.get('search_needed') else ROUTER_CACHE_TTL
+        self.entries.set(key, {"decision": dict(decision), "latency": latency}, ttl=ttl)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
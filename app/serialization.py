@@ -0,0 +1,73 @@
+# Сериализация JSON с быстрым бэкендом
+#
+# Если установлен orjson (pip install orjson) или msgspec, используется он,
+# иначе стандартный json. Формат вывода у всех один: компактный UTF-8 JSON
+# без экранирования кириллицы, так что данные, записанные одним бэкендом,
+# читаются любым другим.
+#
+# Бэкенд можно выбрать явно переменной окружения JSON_BACKEND=json|orjson|msgspec.
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Tuple, TypeVar, Union
+
+logger = logging.getLogger(__name__)
+
+# Полезная нагрузка больше порога (байт) обрабатывается в пуле потоков,
+# чтобы большие истории не останавливали остальные корутины
+OFFLOAD_THRESHOLD = 64 * 1024
+
+T = TypeVar('T')
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+# Исключения разбора JSON у всех бэкендов (orjson наследует json.JSONDecodeError)
+DECODE_ERRORS: Tuple[type, ...] = (ValueError,)
+
+# {имя: (dumps, loads)} для всех установленных бэкендов, в порядке предпочтения
+BACKENDS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]] = {}
+
+try:
+    import orjson
+    BACKENDS['orjson'] = (orjson.dumps, orjson.loads)
+except ImportError:
+    pass
+
+try:
+    import msgspec
+    BACKENDS['msgspec'] = (msgspec.json.encode, msgspec.json.decode)
+    DECODE_ERRORS += (msgspec.DecodeError,)
+except ImportError:
+    pass
+
+BACKENDS['json'] = (_json_dumps, json.loads)
+
+BACKEND = os.getenv('JSON_BACKEND') or next(iter(BACKENDS))
+if BACKEND not in BACKENDS:
+    logger.warning(f"⚠️ JSON_BACKEND={BACKEND} не установлен, используется стандартный json")
+    BACKEND = 'json'
+
+# dumps(obj) -> bytes, loads(str | bytes) -> объект
+dumps, loads = BACKENDS[BACKEND]
+
+
+async def offload(size: int, func: Callable[..., T], *args) -> T:
+    """
+    Вызывает func(*args) в пуле потоков, если size больше OFFLOAD_THRESHOLD
+
+    Небольшие данные обрабатываются сразу: переключение в поток стоит
+    дороже, чем само кодирование. Сжатие (zlib, zstd) в потоке отпускает
+    GIL, поэтому event loop в это время продолжает работать
+
+    Args:
+        size: размер полезной нагрузки в байтах (можно оценочно)
+        func: функция кодирования/декодирования
+    """
+    if size > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
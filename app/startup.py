@@ -0,0 +1,39 @@
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """
+    Замеры этапов запуска: импорт, создание таблиц, прогрев соединений
+
+    Модуль импортируется первым, поэтому отсчет идет с начала импорта приложения.
+    Подробная разбивка импорта по модулям: python3 -X importtime bot.py
+    """
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def mark(self, stage: str):
+        """Завершает этап: время с предыдущей отметки записывается под именем stage"""
+        now = time.perf_counter()
+        self.stages[stage] = (now - self.last) * 1000
+        self.last = now
+
+    def report(self) -> Dict[str, float]:
+        """
+        Пишет профиль старта в лог
+
+        Returns:
+            dict: длительность этапов в миллисекундах {"imports": 812.4, ...}
+        """
+        total = (self.last - self.started) * 1000
+        stages = ', '.join(f"{name} {ms:.0f} мс" for name, ms in self.stages.items())
+        logger.info(f"⏱️ Старт за {total:.0f} мс: {stages}")
+        return self.stages
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,213 @@
+# Склейка стриминга ответа LLM в пачки между ai_generate и обработчиком
+#
+# Модель присылает ответ дельтами в несколько символов. Вместо того чтобы
+# обработчик на каждую дельту склеивал строку, читал часы и решал, пора ли
+# обновить черновик, CoalescingStream читает ai_generate в отдельной задаче
+# и отдает текст пачками: когда набралось STREAM_BATCH_CHARS символов или
+# первой дельте пачки уже STREAM_BATCH_DELAY секунд. Пока обработчик занят
+# (ждет Telegram, в том числе после RetryAfter), дельты копятся, и следующая
+# пачка получается больше.
+#
+# Накопленное ограничено STREAM_BUFFER дельтами: если обработчик отстал
+# настолько, чтение из LLM приостанавливается (backpressure).
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, List, Optional
+
+from app.traffic import note
+
+logger = logging.getLogger(__name__)
+
+# Пачка отдается, как только набрала столько символов...
+STREAM_BATCH_CHARS = 400
+# ...или когда ее первой дельте столько секунд
+STREAM_BATCH_DELAY = 0.1
+# Максимум накопленных дельт, которые обработчик еще не забрал. Обычный ответ
+# целиком помещается в буфер, так что стрим LLM останавливается, только если
+# обработчик надолго завис
+STREAM_BUFFER = 1024
+
+
+class StreamStats:
+    """Метрики одного стрима (дельта LLM примерно соответствует одному токену)"""
+
+    def __init__(self):
+        self.first_delta: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.deltas = 0
+        self.chars = 0
+        self.batches = 0
+        self.max_batch = 0
+        # Сколько раз чтение из LLM ждало, пока обработчик заберет накопленное
+        self.stalls = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.first_delta is None:
+            return 0.0
+        elapsed = (self.finished or time.perf_counter()) - self.first_delta
+        return self.deltas / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def avg_batch(self) -> float:
+        return self.deltas / self.batches if self.batches else 0.0
+
+
+class StreamMetrics:
+    """Суммарные метрики всех стримов процесса (для /stream_stats)"""
+
+    def __init__(self):
+        self.streams = 0
+        self.deltas = 0
+        self.chars = 0
+        self.batches = 0
+        self.stalls = 0
+        self.streaming_seconds = 0.0
+
+    def add(self, stats: StreamStats):
+        self.streams += 1
+        self.deltas += stats.deltas
+        self.chars += stats.chars
+        self.batches += stats.batches
+        self.stalls += stats.stalls
+        if stats.first_delta is not None and stats.finished is not None:
+            self.streaming_seconds += stats.finished - stats.first_delta
+
+    def stats(self) -> dict:
+        return {
+            "streams": self.streams,
+            "deltas": self.deltas,
+            "chars": self.chars,
+            "batches": self.batches,
+            "avg_batch": self.deltas / self.batches if self.batches else 0.0,
+            "tokens_per_second": self.deltas / self.streaming_seconds if self.streaming_seconds else 0.0,
+            "stalls": self.stalls,
+        }
+
+
+stream_metrics = StreamMetrics()
+
+
+class CoalescingStream:
+    """
+    Пачки (текст, ресурсы) из потока дельт (текст, ресурсы) ai_generate
+
+    Дельты складываются в список в задаче-производителе, а обработчик
+    просыпается только на готовую пачку, а не на каждую дельту.
+    Использовать через async with: при выходе из блока (в том числе при отмене
+    обработчика) задача чтения стрима отменяется
+
+        async with CoalescingStream(ai_generate(...)) as stream:
+            async for text, resources in stream:
+                ...
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[tuple],
+        batch_chars: int = STREAM_BATCH_CHARS,
+        batch_delay: float = STREAM_BATCH_DELAY,
+        buffer: int = STREAM_BUFFER
+    ):
+        self.source = source
+        self.batch_chars = batch_chars
+        self.batch_delay = batch_delay
+        self.buffer = buffer
+        self.stats = StreamStats()
+
+        self._parts: List[str] = []
+        self._size = 0
+        self._resources = None
+        # Пачка готова (или стрим закончился)
+        self._ready = asyncio.Event()
+        # Обработчик забрал пачку - можно читать дальше
+        self._drained = asyncio.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._finished = False
+        self._error: Optional[Exception] = None
+
+    async def __aenter__(self) -> "CoalescingStream":
+        self._task = asyncio.create_task(self._read())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._cancel_timer()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        stats = self.stats
+        stats.finished = time.perf_counter()
+        stream_metrics.add(stats)
+        note(stream_batches=stats.batches, stream_stalls=stats.stalls)
+        logger.debug(
+            f"📦 [Стрим] {stats.deltas} дельт в {stats.batches} пачках "
+            f"(в среднем {stats.avg_batch:.1f}, максимум {stats.max_batch}), "
+            f"{stats.tokens_per_second:.0f} ток/с, ожиданий обработчика: {stats.stalls}"
+        )
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _read(self):
+        """Задача-производитель: читает источник и копит дельты до готовности пачки"""
+        loop = asyncio.get_running_loop()
+        try:
+            async for content, links in self.source:
+                if self.stats.first_delta is None:
+                    self.stats.first_delta = time.perf_counter()
+                self._parts.append(content)
+                self._size += len(content)
+                if links and not self._resources:
+                    self._resources = links
+
+                if self._size >= self.batch_chars:
+                    self._ready.set()
+                elif self._timer is None:
+                    # Первая дельта пачки: пачка будет готова не позже чем через batch_delay
+                    self._timer = loop.call_later(self.batch_delay, self._ready.set)
+
+                if len(self._parts) >= self.buffer:
+                    # Обработчик отстал: не читаем LLM, пока он не заберет накопленное
+                    self.stats.stalls += 1
+                    self._drained.clear()
+                    await self._drained.wait()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._finished = True
+            self._ready.set()
+
+    def __aiter__(self) -> "CoalescingStream":
+        return self
+
+    async def __anext__(self) -> tuple:
+        while True:
+            if not self._finished:
+                await self._ready.wait()
+            self._ready.clear()
+            self._cancel_timer()
+
+            if self._parts:
+                parts, self._parts = self._parts, []
+                size, self._size = self._size, 0
+                self._drained.set()
+
+                stats = self.stats
+                stats.deltas += len(parts)
+                stats.chars += size
+                stats.batches += 1
+                stats.max_batch = max(stats.max_batch, len(parts))
+                return ''.join(parts), self._resources
+
+            if self._finished:
+                # Ошибка стрима - после того, как отдан весь полученный текст
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                raise StopAsyncIteration
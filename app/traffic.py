@@ -0,0 +1,141 @@
+# Запись реального трафика для воспроизведения (включается TRAFFIC_TRACE=<файл>)
+#
+# Каждый апдейт - одна JSON-строка, дописываемая в конец файла трассы:
+#   {"t":1718000000.123,"u":"9f2c41d0","k":"text","g":0,"len":42,"ms":2310,
+#    "search":1,"queries":2,"router_ms":410,"search_ms":930,"llm_first_ms":350,"llm_ms":1800,"answer_len":1200}
+#
+# Ни тексты, ни имена, ни ID в трассу не попадают: пользователь записан усеченным
+# хэшем ID с солью (TRAFFIC_SALT, по умолчанию случайная на процесс), от текста
+# остается только длина. Латентности роутера, поиска и LLM отмечает пайплайн
+# генерации через note() - без включенной записи это одно чтение ContextVar.
+#
+# Воспроизведение с фейковыми бэкендами: python3 -m tools.replay trace.jsonl --speed 10
+
+import hashlib
+import logging
+import os
+import secrets
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_TRACE = os.getenv('TRAFFIC_TRACE')
+# Один TRAFFIC_SALT на все воркеры сохраняет пользователей в вебхук-режиме сквозными
+TRAFFIC_SALT = os.getenv('TRAFFIC_SALT') or secrets.token_hex(16)
+# Записи копятся в памяти и дописываются в файл пачками
+TRAFFIC_FLUSH_RECORDS = 100
+TRAFFIC_FLUSH_INTERVAL = 5
+
+# Запись трассы текущего апдейта (None - запись выключена)
+trace_var: ContextVar[Optional[Dict[str, Any]]] = ContextVar('traffic_trace', default=None)
+
+
+def note(**fields):
+    """Добавляет поля к записи трассы текущего апдейта, если запись включена"""
+    record = trace_var.get()
+    if record is not None:
+        record.update(fields)
+
+
+def since(started: float) -> int:
+    """Миллисекунды с момента started (time.perf_counter)"""
+    return round((time.perf_counter() - started) * 1000)
+
+
+def anonymize(user_id: int) -> str:
+    return hashlib.blake2b(f'{TRAFFIC_SALT}:{user_id}'.encode(), digest_size=4).hexdigest()
+
+
+def describe(update: Update) -> Dict[str, Any]:
+    """Обезличенное описание апдейта: тип, длина текста, группа или личка"""
+    record: Dict[str, Any] = {"k": update.event_type}
+
+    message = update.message
+    if message is not None:
+        if message.document is not None:
+            record["k"] = 'document'
+            record["size"] = message.document.file_size or 0
+        elif message.text is not None:
+            record["k"] = 'command' if message.text.startswith('/') else 'text'
+            record["len"] = len(message.text)
+            if record["k"] == 'command':
+                # Команды бота не личные данные, а для воспроизведения нужны
+                record["cmd"] = message.text.split(maxsplit=1)[0].split('@')[0]
+        else:
+            record["k"] = message.content_type
+        record["g"] = int(message.chat.type != 'private')
+    elif update.callback_query is not None:
+        record["k"] = 'callback'
+        record["data"] = (update.callback_query.data or '').split(':', 1)[0]
+
+    user = getattr(update.event, 'from_user', None)
+    if user is not None:
+        record["u"] = anonymize(user.id)
+    return record
+
+
+class TrafficRecorder(BaseMiddleware):
+    """
+    Пишет трассу апдейтов (внешний middleware на dp.update)
+
+    Файл открывается на дозапись, и каждая пачка пишется одним os.write:
+    строки нескольких воркеров вебхук-режима не перемешиваются
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer: List[bytes] = []
+        self._flushed_at = time.monotonic()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        logger.info(f"📼 Запись трафика в {path}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        record = describe(event)
+        record["t"] = round(time.time(), 3)
+        started = time.perf_counter()
+        token = trace_var.set(record)
+        try:
+            return await handler(event, data)
+        finally:
+            trace_var.reset(token)
+            record["ms"] = since(started)
+            self.write(record)
+
+    def write(self, record: Dict[str, Any]):
+        self._buffer.append(dumps(record) + b'\n')
+        now = time.monotonic()
+        if len(self._buffer) >= TRAFFIC_FLUSH_RECORDS or now - self._flushed_at >= TRAFFIC_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        chunk, self._buffer = b''.join(self._buffer), []
+        try:
+            os.write(self._fd, chunk)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось дописать трассу трафика: {e}")
+
+    def close(self):
+        self.flush()
+        os.close(self._fd)
+
+
+def create_recorder() -> Optional[TrafficRecorder]:
+    """Рекордер по TRAFFIC_TRACE или None, если запись не включена"""
+    if not TRAFFIC_TRACE:
+        return None
+    return TrafficRecorder(TRAFFIC_TRACE)
@@ -0,0 +1,202 @@
+# Бенчмарки методов ChatStorage и UserStorage на заполненной БД
+#
+# Замеры идут на рабочей копии БД из фикстур (см. Fixtures.db_path),
+# поэтому методы, которые меняют данные, не портят кэшированную БД
+
+import itertools
+import random
+import time
+
+from app.database.chat_storage import ChatStorage
+from app.database.user_storage import UserStorage
+from benchmarks.fixtures import make_history
+from benchmarks.registry import benchmark
+
+
+def random_users(fx):
+    """Бесконечный поток случайных ID существующих пользователей"""
+    rng = random.Random(7)
+    return iter(lambda: rng.randint(1, fx.users), None)
+
+
+# ----------------------------------------------------------------------------
+# ChatStorage
+# ----------------------------------------------------------------------------
+
+@benchmark('chat.load_history', number=300)
+def load_history(fx):
+    storage = ChatStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        user_id = next(users)
+        await storage.load_history(user_id, user_id, 0)
+    return call
+
+
+@benchmark('chat.save_history', number=200)
+def save_history(fx):
+    storage = ChatStorage(fx.db_path)
+    users = random_users(fx)
+    history = make_history(random.Random(1))
+
+    async def call():
+        user_id = next(users)
+        await storage.save_history(user_id, user_id, 0, history)
+    return call
+
+
+@benchmark('chat.clear_history', number=200)
+def clear_history(fx):
+    storage = ChatStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        user_id = next(users)
+        await storage.clear_history(user_id, user_id, 1)
+    return call
+
+
+@benchmark('chat.purge_expired', number=20)
+def purge_expired(fx):
+    # Одна порция удаления политикой хранения (до 500 тем)
+    storage = ChatStorage(fx.db_path)
+    cutoff = int(time.time()) - 30 * 86400
+
+    async def call():
+        await storage.purge_expired('free', cutoff)
+    return call
+
+
+@benchmark('chat.iter_threads', number=1)
+def iter_threads(fx):
+    storage = ChatStorage(fx.db_path)
+
+    async def call():
+        async for _ in storage.iter_threads():
+            pass
+    return call
+
+
+@benchmark('chat.get_all_users', number=1)
+def get_all_users(fx):
+    storage = ChatStorage(fx.db_path)
+
+    async def call():
+        await storage.get_all_users()
+    return call
+
+
+# ----------------------------------------------------------------------------
+# UserStorage
+# ----------------------------------------------------------------------------
+
+@benchmark('users.get_user', number=500)
+def get_user(fx):
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.get_user(next(users))
+    return call
+
+
+@benchmark('users.create_user.existing', number=200)
+def create_user(fx):
+    # На каждое сообщение /start и answer вызывают create_user для уже известного пользователя
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.create_user(next(users), 'bench')
+    return call
+
+
+@benchmark('users.check_limits', number=500)
+def check_limits(fx):
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.check_limits(next(users))
+    return call
+
+
+@benchmark('users.check_and_reset_limits', number=500)
+def check_and_reset_limits(fx):
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.check_and_reset_limits(next(users))
+    return call
+
+
+@benchmark('users.update_usage', number=2000)
+def update_usage(fx):
+    # Вместе с периодической записью накопленного: flush_usage раз в 200 вызовов
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.update_usage(next(users), 1, 500)
+    return call
+
+
+@benchmark('users.update_subscription', number=200)
+def update_subscription(fx):
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.update_subscription(next(users), 'pro', '2027-01-01T00:00:00')
+    return call
+
+
+@benchmark('users.reset_daily_limits', number=200)
+def reset_daily_limits(fx):
+    storage = UserStorage(fx.db_path)
+    users = random_users(fx)
+
+    async def call():
+        await storage.reset_daily_limits(next(users))
+    return call
+
+
+@benchmark('users.reset_all_daily_limits', number=20)
+def reset_all_daily_limits(fx):
+    # Все уже сброшены сегодня: замеряется проверка по индексу limits_day
+    storage = UserStorage(fx.db_path)
+
+    async def call():
+        await storage.reset_all_daily_limits()
+    return call
+
+
+@benchmark('users.get_user_ids_after', number=200)
+def get_user_ids_after(fx):
+    storage = UserStorage(fx.db_path)
+    offsets = itertools.cycle(range(0, fx.users, fx.users // 50 or 1))
+
+    async def call():
+        await storage.get_user_ids_after(next(offsets), 500)
+    return call
+
+
+@benchmark('users.iter_users', number=1)
+def iter_users(fx):
+    storage = UserStorage(fx.db_path)
+
+    async def call():
+        async for _ in storage.iter_users():
+            pass
+    return call
+
+
+@benchmark('users.get_usage_by_tariff', number=5)
+def get_usage_by_tariff(fx):
+    storage = UserStorage(fx.db_path)
+
+    async def call():
+        await storage.get_usage_by_tariff()
+    return call
@@ -0,0 +1,26 @@
+# Бенчмарки чистого Python, который выполняется на каждом ответе
+
+from app.generate import deduplicate_by_domain, format_search_results
+from app.utils import smart_split
+from benchmarks.registry import benchmark
+
+
+@benchmark('utils.smart_split.short', number=20000)
+def smart_split_short(fx):
+    # Типичный ответ помещается в одно сообщение
+    return lambda: smart_split(fx.short_answer)
+
+
+@benchmark('utils.smart_split.long', number=2000)
+def smart_split_long(fx):
+    return lambda: smart_split(fx.long_answer)
+
+
+@benchmark('search.deduplicate_by_domain', number=5000)
+def deduplicate(fx):
+    return lambda: deduplicate_by_domain(fx.search_results)
+
+
+@benchmark('search.format_search_results', number=5000)
+def format_results(fx):
+    return lambda: format_search_results(fx.search_results)
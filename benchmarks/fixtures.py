@@ -0,0 +1,125 @@
+# Генераторы реалистичных данных для бенчмарков
+#
+# Фиксированный seed: при одинаковых параметрах данные совпадают между запусками,
+# поэтому результаты разных коммитов можно сравнивать
+
+import random
+from typing import Dict, List
+
+from app.prompts import build_main_prompt
+
+WORDS = (
+    'привет как дела что это значит объясни пожалуйста подробнее почему '
+    'функция класс запрос ответ база данных сервер клиент ошибка пример '
+    'python код список словарь строка число время дата погода новости '
+    'конечно вот например можно нужно если тогда сначала потом итог'
+).split()
+
+
+def make_text(rng: random.Random, length: int) -> str:
+    """Кириллический текст примерно из length символов с абзацами и списками"""
+    parts = []
+    size = 0
+    while size < length:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 16)))
+        sentence = sentence.capitalize() + rng.choice(['.', '.', '!', '?', ':'])
+        if rng.random() < 0.15:
+            sentence = '\n\n' + sentence
+        elif rng.random() < 0.1:
+            sentence = '\n- ' + sentence
+        parts.append(sentence)
+        size += len(sentence) + 1
+    return ' '.join(parts)[:length]
+
+
+def make_history(rng: random.Random, messages: int = 20, answer_length: int = 2500) -> List[Dict]:
+    """История темы: системный промпт + чередующиеся вопросы и длинные ответы"""
+    history = [{"role": "system", "content": build_main_prompt()}]
+    for i in range(messages):
+        if i % 2 == 0:
+            history.append({"role": "user", "content": make_text(rng, rng.randint(20, 200))})
+        else:
+            history.append({"role": "assistant", "content": make_text(rng, answer_length)})
+    return history
+
+
+DOMAINS = [
+    'ru.wikipedia.org', 'habr.com', 'stackoverflow.com', 'docs.python.org', 'github.com',
+    'vc.ru', 'rbc.ru', 'lenta.ru', 'ria.ru', 'tass.ru', 'pogoda.mail.ru', 'gismeteo.ru',
+]
+
+
+def make_search_results(rng: random.Random, count: int = 24) -> List[Dict]:
+    """
+    Сырые результаты DDGS (3 запроса по 8 результатов):
+    несколько результатов с одного домена, после дедупликации остается 12
+    """
+    results = []
+    for i in range(count):
+        domain = rng.choice(DOMAINS)
+        results.append({
+            "title": make_text(rng, rng.randint(40, 90)),
+            "href": f"https://{domain}/articles/{rng.randint(1000, 999999)}?utm_source=ddg&page={i}",
+            "body": make_text(rng, rng.randint(150, 300)),
+        })
+    return results
+
+
+def make_users_db(path: str, users: int, today: int):
+    """
+    БД с users пользователями (распределение тарифов как в проде: в основном free)
+
+    Заполняется напрямую через sqlite3 одной транзакцией - в разы быстрее,
+    чем через UserStorage
+    """
+    import sqlite3
+
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.executemany("""
+        INSERT INTO users
+        (user_id, username, tariff_plan, requests_today, total_requests, tokens_today,
+         limits_updated_at, created_at, limits_day)
+        VALUES (?, ?, ?, ?, ?, ?, '2026-01-01T00:00:00', '2026-01-01T00:00:00', ?)
+    """, (
+        (
+            user_id,
+            f"user{user_id}",
+            rng.choices(['free', 'pro', 'ultra'], weights=[90, 8, 2])[0],
+            rng.randint(0, 15),
+            rng.randint(0, 2000),
+            rng.randint(0, 9000),
+            today,
+        )
+        for user_id in range(1, users + 1)
+    ))
+    conn.commit()
+    conn.close()
+
+
+def make_history_db(path: str, rows: int, users: int, now: int):
+    """
+    БД с rows темами, распределенными по users пользователям
+
+    Сжатые истории берутся из небольшого пула: на размер строк и индексов
+    это почти не влияет, а генерация миллиона строк занимает секунды
+    """
+    import sqlite3
+
+    from app.database.history_codec import encode_history
+
+    rng = random.Random(42)
+    pool = [encode_history(make_history(rng, rng.randint(2, 20), rng.randint(300, 2500))) for _ in range(100)]
+
+    def generate():
+        for i in range(rows):
+            user_id = i % users + 1
+            yield (user_id, user_id, i // users, rng.choice(pool), now - rng.randint(0, 400 * 86400))
+
+    conn = sqlite3.connect(path)
+    conn.executemany("""
+        INSERT INTO database (user_id, chat_id, thread_id, messages, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, generate())
+    conn.commit()
+    conn.close()
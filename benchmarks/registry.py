@@ -0,0 +1,72 @@
+# Реестр бенчмарков
+#
+# Бенчмарк - функция, которая получает фикстуры и возвращает замеряемый
+# вызов без аргументов (обычная функция или корутинная):
+#
+#     @benchmark('utils.smart_split', number=2000)
+#     def smart_split_long(fx):
+#         return lambda: smart_split(fx.answer)
+
+import asyncio
+import statistics
+import time
+from typing import Callable, Dict, List
+
+# Сколько раз повторяется серия из number вызовов
+REPEAT = 5
+
+
+class Benchmark:
+    def __init__(self, name: str, setup: Callable, number: int):
+        self.name = name
+        self.setup = setup
+        self.number = number
+
+    def run(self, fx) -> Dict:
+        """
+        Замеряет REPEAT серий по number вызовов
+
+        Returns:
+            dict: {"median_us": ..., "min_us": ..., "number": ...} - время одного вызова
+        """
+        func = self.setup(fx)
+        if asyncio.iscoroutinefunction(func):
+            rounds = asyncio.run(self._run_async(func))
+        else:
+            rounds = self._run_sync(func)
+
+        per_call = [seconds / self.number * 1e6 for seconds in rounds]
+        return {
+            "median_us": round(statistics.median(per_call), 2),
+            "min_us": round(min(per_call), 2),
+            "number": self.number,
+        }
+
+    def _run_sync(self, func) -> List[float]:
+        rounds = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            for _ in range(self.number):
+                func()
+            rounds.append(time.perf_counter() - started)
+        return rounds
+
+    async def _run_async(self, func) -> List[float]:
+        rounds = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            for _ in range(self.number):
+                await func()
+            rounds.append(time.perf_counter() - started)
+        return rounds
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, number: int = 1000):
+    """Регистрирует бенчмарк под именем name (number - вызовов в серии)"""
+    def decorator(setup: Callable) -> Callable:
+        BENCHMARKS[name] = Benchmark(name, setup, number)
+        return setup
+    return decorator
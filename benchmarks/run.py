@@ -0,0 +1,176 @@
+# Запуск бенчмарков и сравнение с сохраненным базовым замером
+#
+# python3 -m benchmarks.run                                  # все бенчмарки
+# python3 -m benchmarks.run -k users.                         # только с "users." в имени
+# python3 -m benchmarks.run --quick                           # маленькая БД, для быстрой проверки
+# python3 -m benchmarks.run --save benchmarks/results/main.json
+# python3 -m benchmarks.run --compare benchmarks/results/main.json
+#
+# Полный размер - 100 тыс. пользователей и 1 млн тем. БД генерируется один раз
+# и кэшируется в --data-dir, замеры идут на ее копии.
+# С --compare код выхода 1, если что-то замедлилось больше чем на --threshold
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import cached_property
+
+from app import serialization
+from app.database.base import init_schemas
+from app.database.chat_storage import ChatStorage
+from app.database.user_storage import UserStorage, today
+from benchmarks import bench_utils, bench_storage  # noqa: F401 (регистрация бенчмарков)
+from benchmarks.fixtures import make_history_db, make_search_results, make_text, make_users_db
+from benchmarks.registry import BENCHMARKS
+
+
+class Fixtures:
+    """Данные для бенчмарков, создаются при первом обращении"""
+
+    def __init__(self, users: int, rows: int, data_dir: str):
+        self.users = users
+        self.rows = rows
+        self.data_dir = data_dir
+
+    @cached_property
+    def short_answer(self) -> str:
+        return make_text(random.Random(1), 1500)
+
+    @cached_property
+    def long_answer(self) -> str:
+        # Длинный ответ на 4-5 сообщений Telegram
+        return make_text(random.Random(2), 16000)
+
+    @cached_property
+    def search_results(self) -> list:
+        return make_search_results(random.Random(3))
+
+    @cached_property
+    def db_path(self) -> str:
+        """Рабочая копия заполненной БД (пользователи + истории)"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        cached = os.path.join(self.data_dir, f'bench-{self.users}u-{self.rows}r.db')
+
+        if not os.path.exists(cached):
+            print(f'⏳ Генерирую БД: {self.users} пользователей, {self.rows} тем...', file=sys.stderr)
+            started = time.perf_counter()
+            building = cached + '.tmp'
+            if os.path.exists(building):
+                os.remove(building)
+            # Как в проде: WAL и incremental auto_vacuum
+            asyncio.run(ChatStorage(building).enable_wal())
+            asyncio.run(init_schemas(ChatStorage(building), UserStorage(building)))
+            make_users_db(building, self.users, today())
+            make_history_db(building, self.rows, self.users, int(time.time()))
+            os.replace(building, cached)
+            print(f'✅ БД готова за {time.perf_counter() - started:.0f}с', file=sys.stderr)
+
+        work = os.path.join(self.data_dir, 'bench-work.db')
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(work + suffix):
+                os.remove(work + suffix)
+        shutil.copyfile(cached, work)
+        return work
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Печатает изменение медианы относительно базового замера
+
+    Returns:
+        bool: True, если есть замедление больше threshold
+    """
+    base = baseline['results']
+    print(f"\nСравнение с {baseline['meta']['commit']} ({baseline['meta']['date']}):")
+
+    regressed = False
+    for name, result in results.items():
+        if name not in base:
+            print(f"  {name:<36} новый")
+            continue
+
+        change = result['median_us'] / base[name]['median_us'] - 1
+        mark = ''
+        if change > threshold:
+            mark = '  ❌ замедление'
+            regressed = True
+        elif change < -threshold:
+            mark = '  ✅ ускорение'
+        print(f"  {name:<36}{base[name]['median_us']:>14.1f} -> {result['median_us']:>12.1f} мкс {change:+7.1%}{mark}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки утилит, форматирования поиска и хранилищ')
+    parser.add_argument('-k', dest='pattern', default='', help='запускать бенчмарки, в имени которых есть подстрока')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='тем в истории')
+    parser.add_argument('--quick', action='store_true', help='10 тыс. пользователей и 50 тыс. тем')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'minion-bench'))
+    parser.add_argument('--save', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с сохраненным JSON')
+    parser.add_argument('--threshold', type=float, default=0.15, help='допустимое замедление (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.users, args.rows = 10_000, 50_000
+
+    fx = Fixtures(args.users, args.rows, args.data_dir)
+    results = {}
+
+    print(f"{'бенчмарк':<36}{'медиана':>14}{'минимум':>14}")
+    for name, bench in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        results[name] = bench.run(fx)
+        print(f"{name:<36}{results[name]['median_us']:>10.1f} мкс{results[name]['min_us']:>10.1f} мкс")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "json_backend": serialization.BACKEND,
+            "users": args.users,
+            "rows": args.rows,
+        },
+        "results": results,
+    }
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline['meta']['users'], baseline['meta']['rows']) != (args.users, args.rows):
+            print("⚠️ Базовый замер сделан на БД другого размера, сравнение неточное", file=sys.stderr)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Микробенчмарк сериализации историй
+#
+# python3 -m benchmarks.serialization
+# python3 -m benchmarks.serialization --answer-length 8000 --number 200
+#
+# Сравнивает установленные JSON-бэкенды (json, orjson, msgspec) на историях
+# из 20 сообщений с длинными ответами: голый JSON и полный путь
+# encode_history/decode_history со сжатием. Отдельно меряет, насколько
+# сохранение большой истории задерживает event loop с выносом в поток и без
+
+import argparse
+import asyncio
+import random
+import time
+import timeit
+
+from app import serialization
+from app.database import history_codec
+from benchmarks.fixtures import make_history
+
+
+def bench(func, number: int) -> float:
+    """Лучшее из 5 повторов, микросекунд на вызов"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def bench_backends(history, number: int):
+    print(f"{'бэкенд':<10}{'dumps':>10}{'loads':>10}{'encode':>10}{'decode':>10}  мкс")
+
+    for name, (dumps, loads) in serialization.BACKENDS.items():
+        raw = dumps(history)
+        # encode_history/decode_history с этим бэкендом
+        history_codec.dumps, history_codec.loads = dumps, loads
+        blob = history_codec.encode_history(history)
+
+        print(
+            f"{name:<10}"
+            f"{bench(lambda: dumps(history), number):>10.1f}"
+            f"{bench(lambda: loads(raw), number):>10.1f}"
+            f"{bench(lambda: history_codec.encode_history(history), number):>10.1f}"
+            f"{bench(lambda: history_codec.decode_history(blob), number):>10.1f}"
+        )
+
+    history_codec.dumps, history_codec.loads = serialization.dumps, serialization.loads
+    print(f"JSON {len(raw)} байт, в БД {len(blob)} байт, по умолчанию: {serialization.BACKEND}")
+
+
+async def max_loop_lag(history, offload: bool, rounds: int = 20) -> float:
+    """Максимальная задержка тиков event loop (мс), пока кодируются истории"""
+    lag = 0.0
+    stop = False
+
+    async def ticker():
+        nonlocal lag
+        while not stop:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, (time.perf_counter() - started) * 1000 - 1)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    for _ in range(rounds):
+        if offload:
+            await asyncio.to_thread(history_codec.encode_history, history)
+        else:
+            history_codec.encode_history(history)
+        await asyncio.sleep(0)
+    stop = True
+    await task
+    return lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение JSON-бэкендов на историях чатов')
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--answer-length', type=int, default=2500)
+    parser.add_argument('--number', type=int, default=500, help='вызовов на замер')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    history = make_history(rng, args.messages, args.answer_length)
+    bench_backends(history, args.number)
+
+    big = make_history(rng, args.messages, 40000)
+    size = history_codec.estimate_size(big)
+    print(f"\nЗадержка event loop при сохранении истории ~{size // 1024} КБ:")
+    print(f"  в event loop: {asyncio.run(max_loop_lag(big, offload=False)):.1f} мс")
+    print(f"  в потоке:     {asyncio.run(max_loop_lag(big, offload=True)):.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
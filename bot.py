@@ -4,31 +4,54 @@
 
 import asyncio
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+from typing import Optional
 
+# Первым делом: отсюда отсчитывается время старта
+from app.startup import startup_profile
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import BotCommand, BotCommandScopeDefault
 
 from config import TG_TOKEN
 
-from app.handlers import router
-
-from app.database.base import DB_PATH
+from app.handlers import router, Gen
+from app.generate import warm_up as warm_up_llm
+from app.inflight import InFlight, save_interrupted
+from app.logging_setup import setup_logging
+from app.middlewares import SendRateLimitMiddleware, TokenBucket, setup_middlewares
+from app.profiling import Profiler
+from app.traffic import TrafficRecorder, create_recorder
+from app.admin import admin_router
+from app.broadcast import Broadcaster
+from app.maintenance import daily_reset_loop, recompress_histories, retention_loop
+
+from app.database.base import DB_PATH, init_schemas
 from app.database.chat_storage import ChatStorage
+from app.database.sharded_chat_storage import ShardedChatStorage, create_chat_storage
 from app.database.user_storage import UserStorage
+from app.database.fsm_storage import SQLiteFSMStorage
+from app.database.maintenance_storage import MaintenanceStorage
+from app.database.broadcast_storage import BroadcastStorage
+from app.database.retrieval_storage import RetrievalStorage
+from app.database.document_storage import DocumentStorage
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        RotatingFileHandler('bot.log', maxBytes=5000000, backupCount=3, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+startup_profile.mark('imports')
+
+# Адрес Bot API (для локальных тестов можно указать фейковый сервер,
+# например http://127.0.0.1:8081 из tools/fake_telegram.py)
+TG_API_SERVER = os.getenv('TG_API_SERVER')
+
+# Сколько секунд живет состояние ожидания, если генерация зависла и не сняла его
+WAIT_STATE_TTL = 300
+# Сколько секунд ждать ответа Telegram при прогреве
+WARM_UP_TIMEOUT = 10
 
 logger = logging.getLogger(__name__)
 
+
 async def set_commands(bot: Bot):
     commands = [
         BotCommand(command='start', description='Начать'),
@@ -37,23 +60,165 @@ async def set_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands, BotCommandScopeDefault())
 
-async def main():
-    bot = Bot(token=TG_TOKEN)
+def create_bot() -> Bot:
+    if TG_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TG_API_SERVER))
+    else:
+        session = AiohttpSession()
+    # Все отправки процесса (ответы и рассылка) - под одним ограничителем скорости
+    session.middleware(SendRateLimitMiddleware())
+    return Bot(token=TG_TOKEN, session=session)
+
+async def init_storages():
+    """
+    Создает таблицы и включает WAL
+    Вызывается один раз при старте (в вебхук-режиме - только в главном процессе)
+    """
+    storages = [
+        UserStorage(DB_PATH),
+        SQLiteFSMStorage(DB_PATH),
+        MaintenanceStorage(DB_PATH),
+        BroadcastStorage(DB_PATH),
+        RetrievalStorage(DB_PATH),
+        DocumentStorage(DB_PATH),
+    ]
+    await storages[0].enable_wal()
+
+    storage = create_chat_storage(DB_PATH)
+    if isinstance(storage, ShardedChatStorage):
+        # История в отдельных файлах-шардах, у каждого свои WAL и таблица
+        await storage.init_db()
+    else:
+        storages.insert(0, storage)
+
+    # Все остальные таблицы в одном файле - создаем их одной транзакцией
+    await init_schemas(*storages)
+    logger.info("✅ База данных инициализирована")
+
+async def warm_up(bot: Bot):
+    """
+    Прогревает соединения с Telegram, LLM и поиском до приема апдейтов,
+    чтобы первые пользователи не ждали импорта модулей и TLS-рукопожатий
+
+    Ошибки прогрева не мешают запуску, только пишутся в лог
+    """
+    async def warm_telegram():
+        try:
+            # bot.me() еще и кэширует информацию о боте
+            await asyncio.wait_for(bot.me(), WARM_UP_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ Прогрев (Telegram) не удался: {e!r}")
+
+    await asyncio.gather(warm_telegram(), warm_up_llm())
+
+async def on_startup(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    retrieval: RetrievalStorage,
+    documents: DocumentStorage,
+    broadcaster: Broadcaster,
+    profiler: Profiler
+):
+    profiler.start()
+    await dispatcher.fsm.storage.load()
+    await documents.load_threads()
+    dispatcher["background_tasks"] = [
+        asyncio.create_task(dispatcher.fsm.storage.run_cleanup()),
+        asyncio.create_task(user_storage.run_usage_flusher()),
+    ]
+
+    # Задачи обслуживания БД нужны в одном экземпляре на всю БД
+    if dispatcher["run_maintenance"]:
+        maintenance = MaintenanceStorage(DB_PATH)
+        dispatcher["background_tasks"].append(
+            asyncio.create_task(daily_reset_loop(user_storage, maintenance))
+        )
+        dispatcher["background_tasks"].append(
+            asyncio.create_task(recompress_histories(storage, maintenance))
+        )
+        dispatcher["background_tasks"].append(
+            asyncio.create_task(retention_loop(storage, user_storage, maintenance, retrieval, documents))
+        )
+        await broadcaster.resume_unfinished(bot)
+
+async def on_shutdown(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    storage: ChatStorage,
+    user_storage: UserStorage,
+    retrieval: RetrievalStorage,
+    broadcaster: Broadcaster,
+    inflight: InFlight,
+    profiler: Profiler,
+    traffic: Optional[TrafficRecorder]
+):
+    # Новые апдейты уже не принимаются: даем начатым ответам доработать,
+    # не успевшие сохраняем с кнопкой "Продолжить" (см. app/inflight.py)
+    for generation in await inflight.drain():
+        try:
+            await save_interrupted(bot, generation, storage, user_storage, retrieval)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить прерванный ответ пользователя {generation.user_id}: {e}", exc_info=True)
+
+    profiler.stop()
+    # Прерванные рассылки остаются в статусе running и продолжатся после перезапуска
+    for task in [*dispatcher.get("background_tasks", []), *broadcaster.tasks.values()]:
+        task.cancel()
+
+    # Накопленный в памяти расход пользователей
+    await user_storage.flush_usage()
+    if traffic is not None:
+        traffic.close()
+
+def create_dispatcher(run_maintenance: bool = True, throttle: Optional[TokenBucket] = None) -> Dispatcher:
+    """
+    Args:
+        run_maintenance: запускать ли фоновые задачи обслуживания БД
+                         (в вебхук-режиме - только в одном воркере)
+        throttle: ограничитель флуда (по умолчанию FLOOD_RATE/FLOOD_BURST,
+                  tools/replay.py ускоряет его вместе с трафиком)
+    """
+    fsm_storage = SQLiteFSMStorage(DB_PATH, state_ttl={Gen.wait.state: WAIT_STATE_TTL})
+
+    dp = Dispatcher(storage=fsm_storage)
+    # Один файл или шарды по CHAT_SHARDS (см. app/database/sharded_chat_storage.py)
+    dp["storage"] = create_chat_storage(DB_PATH)
+    dp["user_storage"] = UserStorage(DB_PATH)
+    dp["broadcast_storage"] = BroadcastStorage(DB_PATH)
+    dp["retrieval"] = RetrievalStorage(DB_PATH)
+    dp["documents"] = DocumentStorage(DB_PATH)
+    dp["broadcaster"] = Broadcaster(dp["user_storage"], dp["broadcast_storage"])
+    dp["run_maintenance"] = run_maintenance
+    # Монитор блокировок и профилировщик (PROFILING=1, см. app/profiling.py)
+    dp["profiler"] = Profiler()
+    # Идущие генерации, которые нужно дождаться при остановке
+    dp["inflight"] = InFlight()
+    # Запись трассы трафика (TRAFFIC_TRACE, см. app/traffic.py)
+    dp["traffic"] = create_recorder()
+
+    # Флуд отсекается до FSM и загрузки пользователя, у сообщений и кнопок один лимит
+    setup_middlewares(dp, dp["user_storage"], throttle, dp["traffic"])
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    # Админский роутер раньше основного: там обработчик всех сообщений
+    dp.include_router(admin_router)
+    dp.include_router(router)
+    return dp
 
-    storage = ChatStorage(DB_PATH)
-    await storage.init_db()
-    logger.info("✅ База данных истории чатов инициализирована")
-    
-    user_storage = UserStorage(DB_PATH)
-    await user_storage.init_db()
-    logger.info("✅ База данных пользователей инициализирована")
+async def main():
+    bot = create_bot()
 
-    dp = Dispatcher()
-    dp["storage"] = storage
-    dp["user_storage"] = user_storage
+    await init_storages()
+    startup_profile.mark('schema')
+    dp = create_dispatcher()
 
-    dp.include_router(router)
-    await set_commands(bot)
+    await asyncio.gather(set_commands(bot), warm_up(bot))
+    startup_profile.mark('warm-up')
+    startup_profile.report()
 
     logger.info('Бот запущен.')
 
@@ -63,7 +228,8 @@ async def main():
         await bot.session.close()
 
 if __name__ == '__main__':
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        logger.info("Exit")
\ No newline at end of file
+        logger.info("Exit")
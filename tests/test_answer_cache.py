@@ -0,0 +1,17 @@
+from app.answer_cache import AnswerCache
+
+
+def test_same_words_in_other_order_do_not_share_key():
+    cache = AnswerCache()
+    pairs = [
+        ("is python faster than java", "is java faster than python"),
+        ("кто сильнее лев или тигр", "кто сильнее тигр или лев"),
+        ("переведи dog на русский", "переведи русский на dog"),
+    ]
+    for first, second in pairs:
+        assert cache.key(first) != cache.key(second)
+
+    cache.set("is python faster than java", "Да")
+    assert cache.get("is java faster than python") is None
+    # Регистр и пунктуация ключ не меняют
+    assert cache.get("Is Python faster than Java?") == "Да"
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from app.database import history_codec
+from app.database.history_codec import FORMAT_ZLIB, FORMAT_ZSTD, decode_history, encode_history
+from app.prompts import build_main_prompt, MAIN_PROMPT_TEMPLATE
+
+HISTORY = [
+    {"role": "system", "content": build_main_prompt("01.02.2025 10:00")},
+    {"role": "user", "content": "Привет! Что такое GIL?"},
+    {"role": "assistant", "content": "GIL - глобальная блокировка интерпретатора 🐍"},
+]
+
+
+def test_legacy_json_text():
+    assert decode_history(json.dumps(HISTORY, ensure_ascii=False)) == HISTORY
+
+
+def test_zlib_round_trip(monkeypatch):
+    monkeypatch.setattr(history_codec, 'zstandard', None)
+    blob = encode_history(HISTORY)
+    assert blob[0] == FORMAT_ZLIB
+    assert decode_history(blob) == HISTORY
+
+
+def test_zstd_round_trip():
+    pytest.importorskip('zstandard')
+    blob = encode_history(HISTORY)
+    assert blob[0] == FORMAT_ZSTD
+    assert decode_history(blob) == HISTORY
+
+
+def test_system_prompt_stored_as_reference(monkeypatch):
+    monkeypatch.setattr(history_codec, 'zstandard', None)
+    packed = history_codec._pack_prompt(HISTORY[0])
+    assert packed == {"role": "system", "prompt": "main", "date": "01.02.2025 10:00"}
+    # Промпт не из шаблона хранится как есть
+    custom = {"role": "system", "content": "Ты - переводчик"}
+    assert history_codec._pack_prompt(custom) is custom
+
+    blob = encode_history(HISTORY)
+    assert len(blob) < len(MAIN_PROMPT_TEMPLATE.encode())
+    assert decode_history(blob)[0] == HISTORY[0]
+    assert decode_history(encode_history([custom])) == [custom]
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+# app.generate читает токены из config.py, которого нет в репозитории
+pytest.importorskip('config')
+
+from app.generate import save_turn
+from app.inflight import InFlight, save_interrupted
+
+
+class FakeStorage:
+    def __init__(self):
+        self.histories = []
+
+    async def load_history(self, user_id, chat_id, thread_id):
+        return list(self.histories[-1]) if self.histories else []
+
+    async def save_history(self, user_id, chat_id, thread_id, history):
+        self.histories.append(list(history))
+
+
+class FakeUserStorage:
+    def __init__(self):
+        self.usage = []
+
+    async def update_usage(self, user_id, requests_delta=1, tokens_delta=0):
+        self.usage.append((user_id, requests_delta, tokens_delta))
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+
+def test_cancel_between_history_save_and_usage_update():
+    async def run():
+        storage, user_storage, bot = FakeStorage(), FakeUserStorage(), FakeBot()
+        inflight = InFlight()
+        saved = asyncio.Event()
+
+        async def generate_reply():
+            with inflight.track(7, 7, None, 'Вопрос') as generation:
+                generation.partial = 'Ответ'
+                history = [
+                    {"role": "user", "content": 'Вопрос'},
+                    {"role": "assistant", "content": 'Ответ'},
+                ]
+                # Как ai_generate: история сохраняется в задаче стрима
+                await asyncio.create_task(save_turn(storage, 7, 7, None, history))
+                saved.set()
+                # Здесь остановка застает обработчик до update_usage
+                await asyncio.sleep(60)
+                generation.completed = True
+                await user_storage.update_usage(7, 1, len(generation.partial))
+
+        asyncio.create_task(generate_reply())
+        await saved.wait()
+        interrupted = await inflight.drain(grace=0)
+        for generation in interrupted:
+            await save_interrupted(bot, generation, storage, user_storage)
+        return interrupted, storage, user_storage, bot
+
+    interrupted, storage, user_storage, bot = asyncio.run(run())
+
+    assert len(interrupted) == 1 and interrupted[0].saved
+    # Ход записан один раз, расход учтен один раз
+    assert len(storage.histories) == 1
+    assert user_storage.usage == [(7, 1, len('Ответ'))]
+    assert bot.sent == []
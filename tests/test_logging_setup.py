@@ -0,0 +1,32 @@
+import atexit
+import json
+import logging
+
+from app.logging_setup import setup_logging
+
+
+def test_exception_goes_to_exc_field(tmp_path):
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    log_file = tmp_path / 'bot.log'
+
+    listener = setup_logging(str(log_file))
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logging.getLogger('app.test').error('Ошибка при генерации', exc_info=True)
+    finally:
+        # setup_logging останавливает его при выходе, здесь - сразу, чтобы дописал файл
+        atexit.unregister(listener.stop)
+        listener.stop()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+
+    entry = json.loads(log_file.read_text(encoding='utf-8').splitlines()[-1])
+    assert entry["msg"] == 'Ошибка при генерации'
+    assert 'Traceback' in entry["exc"]
+    assert 'ZeroDivisionError' in entry["exc"]
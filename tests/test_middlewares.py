@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, Update
+
+from app.database.fsm_storage import SQLiteFSMStorage
+from app.database.user_storage import UserStorage
+from app.middlewares import TokenBucket, setup_middlewares
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "text": "Привет",
+        }
+    })
+
+
+def count_calls(obj, name: str, calls: dict):
+    method = getattr(obj, name)
+
+    async def wrapper(*args, **kwargs):
+        calls[name] = calls.get(name, 0) + 1
+        return await method(*args, **kwargs)
+
+    setattr(obj, name, wrapper)
+
+
+def test_flood_is_dropped_before_fsm_and_user_storage(tmp_path):
+    async def run():
+        db_path = str(tmp_path / 'database.db')
+        fsm_storage = SQLiteFSMStorage(db_path)
+        user_storage = UserStorage(db_path)
+        await fsm_storage.init_db()
+        await user_storage.init_db()
+
+        calls: dict = {}
+        count_calls(fsm_storage, 'get_state', calls)
+        count_calls(user_storage, 'get_user', calls)
+
+        router = Router()
+        handled = []
+
+        @router.message()
+        async def handler(message: Message, state: FSMContext, user_data):
+            handled.append(message.message_id)
+
+        dp = Dispatcher(storage=fsm_storage)
+        # Пачка из двух сообщений, дальше токены почти не восполняются
+        setup_middlewares(dp, user_storage, TokenBucket(rate=0.001, burst=2))
+        dp.include_router(router)
+
+        bot = Bot(token='42:TEST')
+        try:
+            for update_id in range(1, 11):
+                await dp.feed_update(bot, message_update(update_id, user_id=7))
+        finally:
+            await bot.session.close()
+        return handled, calls
+
+    handled, calls = asyncio.run(run())
+
+    assert handled == [1, 2]
+    # Отброшенные 8 апдейтов не дошли ни до FSM, ни до загрузки пользователя
+    assert calls == {'get_state': 2, 'get_user': 2}
@@ -0,0 +1,57 @@
+import asyncio
+import sys
+
+from app.database.chat_storage import ChatStorage
+from app.database.sharded_chat_storage import ShardedChatStorage
+from app.prompts import build_main_prompt
+from tools import reshard
+
+# Группы с отрицательным chat_id, темы форума и личные чаты (thread_id 0)
+KEYS = [
+    (user_id, chat_id, thread_id)
+    for user_id in range(1, 13)
+    for chat_id, thread_id in ((user_id, 0), (-1001234567890, user_id), (-1001234567890, user_id + 100))
+]
+
+
+def history(key) -> list:
+    return [
+        {"role": "system", "content": build_main_prompt("01.02.2025 10:00")},
+        {"role": "user", "content": f"Вопрос {key}"},
+        {"role": "assistant", "content": f"Ответ {key} " * (key[0] * 50)},
+    ]
+
+
+async def run_reshard(monkeypatch, db_path: str, source: int, target: int):
+    monkeypatch.setattr(sys, 'argv', [
+        'reshard', '--db', db_path, '--from', str(source), '--to', str(target), '--batch', '7'
+    ])
+    await reshard.main()
+
+
+def open_storage(db_path: str, shards: int):
+    return ChatStorage(db_path) if shards == 1 else ShardedChatStorage(db_path, shards)
+
+
+def test_reshard_keeps_every_history(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'database.db')
+
+    async def run():
+        source = ShardedChatStorage(db_path, 2)
+        await source.init_db()
+        for user_id, chat_id, thread_id in KEYS:
+            await source.save_history(user_id, chat_id, thread_id or None, history((user_id, chat_id, thread_id)))
+
+        results = {}
+        for source_shards, target_shards in ((2, 3), (3, 1)):
+            await run_reshard(monkeypatch, db_path, source_shards, target_shards)
+            storage = open_storage(db_path, target_shards)
+            results[target_shards] = (
+                {key: await storage.load_history(*key) for key in KEYS},
+                await storage.count_threads(),
+            )
+        return results
+
+    for loaded, threads in asyncio.run(run()).values():
+        assert loaded == {key: history(key) for key in KEYS}
+        assert threads == len(KEYS)
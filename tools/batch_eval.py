@@ -0,0 +1,322 @@
+# Пакетный прогон промптов через настоящий пайплайн (route_query + ai_generate) без Telegram
+
+# python3 -m tools.batch_eval prompts.jsonl --out results.jsonl
+# python3 -m tools.batch_eval prompts.jsonl --out results.jsonl --concurrency 16 --retries 8
+#
+# Входной JSONL, одна переписка на строку:
+#   {"id": "q1", "prompt": "Что такое GIL?"}
+#   {"id": "q2", "turns": ["Привет", "Какая сегодня погода в Москве?"]}   # ходы по очереди
+#   {"id": "q3", "messages": [{"role": "user", "content": "..."},
+#                             {"role": "assistant", "content": "..."},
+#                             {"role": "user", "content": "..."}]}    # контекст + последний вопрос
+#
+# Результаты дописываются в --out по одной строке на переписку сразу после ее
+# завершения: ответы, решения роутера, использование поиска, токены и время этапов.
+# Файл результатов - он же контрольная точка: при повторном запуске уже записанные
+# переписки пропускаются (кроме исчерпавших повторы при 429 и таймаутах),
+# так что прерванный прогон продолжается с места остановки.
+#
+# История хранится в памяти (MemoryChatStorage), рабочая БД не нужна.
+# Кэши ответов и роутера выключены, чтобы каждое изменение промпта или роутера
+# было видно на каждом вопросе (--use-caches включает их обратно).
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set, Tuple
+
+import openai
+
+from app import generate
+from app.answer_cache import AnswerCache
+from app.prompts import build_main_prompt
+from app.router_cache import RouterCache
+from app.serialization import DECODE_ERRORS, dumps, loads
+from app.traffic import trace_var
+
+# Ошибки API, после которых ход повторяется
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# Роутер не пробрасывает ошибки, а молча отвечает "поиск не нужен"
+# (см. route_query) - такие ходы тоже повторяем
+RETRYABLE_ROUTER_ERRORS = {error.__name__ for error in RETRYABLE_ERRORS}
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Решение роутера для текущего хода (route_query оборачивается в install_router_probe)
+current_decision: ContextVar[Optional[Dict]] = ContextVar('batch_decision', default=None)
+
+
+class MemoryChatStorage:
+    """Заменитель ChatStorage в памяти: load_history и save_history, больше пайплайну не нужно"""
+
+    def __init__(self):
+        self.histories: Dict[Tuple[int, int, int], List[Dict]] = {}
+
+    async def load_history(self, user_id: int, chat_id: int, thread_id: int) -> List[Dict]:
+        return list(self.histories.get((user_id, chat_id, thread_id or 0), []))
+
+    async def save_history(self, user_id: int, chat_id: int, thread_id: int, messages: List[Dict]):
+        self.histories[(user_id, chat_id, thread_id or 0)] = list(messages)
+
+
+class RetryableTurn(Exception):
+    """Ход нужно повторить (ошибка роутера, проглоченная route_query)"""
+
+
+class Throttle:
+    """
+    Общая пауза всех воркеров после 429: пока один ждет Retry-After,
+    остальные не добивают лимит новыми запросами
+    """
+
+    def __init__(self):
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def wait(self):
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+def install_router_probe():
+    """Запоминает решение роутера в current_decision, не меняя его"""
+    route_query = generate.route_query
+
+    async def probe(history: List[Dict]) -> Dict:
+        decision = await route_query(history)
+        current_decision.set(dict(decision))
+        return decision
+
+    generate.route_query = probe
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Retry-After из ответа API, иначе экспоненциальная пауза со случайной добавкой"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            return min(float(response.headers.get('retry-after')), BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(1, 1.5)
+
+
+def parse_conversation(item: Dict) -> Tuple[List[Dict], List[str]]:
+    """
+    Returns:
+        tuple: (контекст до первого вопроса, вопросы, которые нужно задать по очереди)
+    """
+    if 'messages' in item:
+        messages = [msg for msg in item['messages'] if msg.get('role') in ('user', 'assistant')]
+        if not messages or messages[-1]['role'] != 'user':
+            raise ValueError('messages должен заканчиваться сообщением user')
+        return messages[:-1], [messages[-1]['content']]
+    if 'turns' in item:
+        return [], list(item['turns'])
+    if 'prompt' in item:
+        return [], [item['prompt']]
+    raise ValueError('нужно поле prompt, turns или messages')
+
+
+async def run_turn(storage: MemoryChatStorage, key: Tuple[int, int, int], text: str) -> Dict:
+    """Один вопрос через ai_generate; метрики этапов собираются через app.traffic.note"""
+    record: Dict = {}
+    trace_var.set(record)
+    current_decision.set(None)
+
+    started = time.perf_counter()
+    answer = ''
+    resources: List[Dict] = []
+    async for chunk, links in generate.ai_generate(text, storage, *key):
+        answer += chunk
+        resources = links or resources
+    total_ms = round((time.perf_counter() - started) * 1000)
+
+    if record.get('router_error') in RETRYABLE_ROUTER_ERRORS:
+        raise RetryableTurn(record['router_error'])
+
+    decision = current_decision.get()
+    return {
+        "text": text,
+        "answer": answer,
+        "router": decision,
+        "router_cached": bool(record.get('router_cached')),
+        "router_error": record.get('router_error'),
+        "answer_cached": bool(record.get('answer_cached')),
+        "search": bool(record.get('search')),
+        "queries": (decision or {}).get('queries', []) if record.get('search') else [],
+        "sources": [link['url'] for link in resources],
+        "tokens": record.get('tokens'),
+        "answer_len": len(answer),
+        "timings": {
+            "router_ms": record.get('router_ms'),
+            "search_ms": record.get('search_ms'),
+            "llm_first_ms": record.get('llm_first_ms'),
+            "llm_ms": record.get('llm_ms'),
+            "total_ms": total_ms,
+        },
+    }
+
+
+async def run_conversation(
+    item: Dict,
+    index: int,
+    throttle: Throttle,
+    retries: int
+) -> Dict:
+    storage = MemoryChatStorage()
+    # Каждая переписка - своя тема, ключ нужен только хранилищу в памяти
+    key = (index, index, 0)
+    result: Dict = {"id": item['id'], "turns": []}
+
+    try:
+        context, questions = parse_conversation(item)
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+
+    if context:
+        await storage.save_history(*key, [{"role": "system", "content": build_main_prompt()}, *context])
+
+    for text in questions:
+        snapshot = await storage.load_history(*key)
+        for attempt in range(retries + 1):
+            await throttle.wait()
+            try:
+                turn = await run_turn(storage, key, text)
+                turn["attempts"] = attempt + 1
+                result["turns"].append(turn)
+                break
+            except (*RETRYABLE_ERRORS, RetryableTurn) as e:
+                # Ход мог успеть записать историю - откатываем перед повтором
+                await storage.save_history(*key, snapshot)
+                if attempt == retries:
+                    result["error"] = f'{type(e).__name__}: {e}'
+                    result["retryable"] = True
+                    return result
+                delay = retry_delay(e, attempt)
+                if isinstance(e, openai.RateLimitError):
+                    throttle.pause(delay)
+                print(f'\n⏳ {item["id"]}: {type(e).__name__}, повтор через {delay:.1f}с', file=sys.stderr)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                result["error"] = f'{type(e).__name__}: {e}'
+                return result
+
+    return result
+
+
+def read_done(path: str) -> Set[str]:
+    """
+    ID переписок, которые не нужно прогонять заново: все, кроме
+    исчерпавших повторы (429, таймауты) - их доделает следующий запуск
+    """
+    retryable: Dict[str, bool] = {}
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                result = loads(line)
+            except DECODE_ERRORS:
+                # Оборванная последняя строка прерванного запуска
+                continue
+            # Учитывается последняя запись переписки
+            retryable[str(result['id'])] = bool(result.get('retryable'))
+    return {id_ for id_, again in retryable.items() if not again}
+
+
+def read_input(path: str) -> List[Dict]:
+    items = []
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = loads(line)
+            item.setdefault('id', number)
+            item['id'] = str(item['id'])
+            items.append(item)
+    return items
+
+
+def truncate_partial_line(path: str):
+    """Обрезает недописанную последнюю строку, чтобы новые результаты начинались с новой строки"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b'\n') + 1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Пакетный прогон промптов через роутер и генератор')
+    parser.add_argument('input', help='JSONL с переписками')
+    parser.add_argument('--out', required=True, help='JSONL с результатами (он же контрольная точка)')
+    parser.add_argument('--concurrency', type=int, default=8, help='переписок одновременно')
+    parser.add_argument('--retries', type=int, default=5, help='повторов хода при 429/таймаутах')
+    parser.add_argument('--limit', type=int, default=None, help='взять первые N переписок')
+    parser.add_argument('--use-caches', action='store_true', help='не выключать кэши ответов и роутера')
+    args = parser.parse_args()
+
+    items = read_input(args.input)[:args.limit]
+    done = read_done(args.out)
+    pending = [(index, item) for index, item in enumerate(items) if item['id'] not in done]
+    print(f'▶️ Переписок: {len(items)}, уже готово: {len(items) - len(pending)}, осталось: {len(pending)}', file=sys.stderr)
+
+    if not args.use_caches:
+        generate.answer_cache = AnswerCache(maxsize=0)
+        generate.router_cache = RouterCache(maxsize=0)
+    install_router_probe()
+
+    truncate_partial_line(args.out)
+    out = open(args.out, 'ab')
+    throttle = Throttle()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    finished = 0
+    failed = 0
+    started = time.perf_counter()
+
+    async def worker(index: int, item: Dict):
+        nonlocal finished, failed
+        async with semaphore:
+            result = await run_conversation(item, index, throttle, args.retries)
+        # Строка пишется целиком и сразу сбрасывается на диск: это контрольная точка
+        out.write(dumps(result) + b'\n')
+        out.flush()
+        finished += 1
+        failed += bool(result.get('error'))
+        print(f'\r  {finished}/{len(pending)}, ошибок: {failed}', end='', file=sys.stderr)
+
+    try:
+        await asyncio.gather(*(worker(index, item) for index, item in pending))
+    finally:
+        out.close()
+        print(file=sys.stderr)
+
+    print(
+        f'✅ Готово {finished - failed} из {len(pending)} за {time.perf_counter() - started:.1f}с, '
+        f'ошибок: {failed} (исчерпавшие повторы доделает повторный запуск)',
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print('\n⏸ Прервано, повторный запуск продолжит с места остановки', file=sys.stderr)
@@ -0,0 +1,109 @@
+# Выгрузка переписок и статистики использования
+
+# python3 -m tools.export conversations --format jsonl --out conversations.jsonl
+# python3 -m tools.export users --format csv --out users.csv
+# python3 -m tools.export usage --format csv --out usage.csv
+#
+# БД открывается только на чтение и читается короткими запросами порциями,
+# поэтому выгрузку можно запускать рядом с работающим ботом (БД в режиме WAL),
+# а память не растет с размером database.db
+
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+
+from app.database.base import DB_PATH
+from app.database.chat_storage import ChatStorage
+from app.database.sharded_chat_storage import CHAT_SHARDS, create_chat_storage
+from app.database.user_storage import UserStorage
+
+
+async def export_conversations(storage: ChatStorage, out, fmt: str) -> int:
+    """Одна строка JSONL на тему или одна строка CSV на сообщение"""
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(['user_id', 'chat_id', 'thread_id', 'position', 'role', 'content'])
+
+    count = 0
+    async for user_id, chat_id, thread_id, messages in storage.iter_histories():
+        if writer:
+            for position, msg in enumerate(messages):
+                writer.writerow([user_id, chat_id, thread_id, position, msg.get('role'), msg.get('content')])
+        else:
+            out.write(json.dumps({
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "thread_id": thread_id,
+                "messages": messages,
+            }, ensure_ascii=False) + '\n')
+        count += 1
+
+    return count
+
+
+async def export_users(user_storage: UserStorage, out, fmt: str) -> int:
+    writer = None
+    count = 0
+
+    async for user in user_storage.iter_users():
+        if fmt == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=list(user.keys()))
+                writer.writeheader()
+            writer.writerow(user)
+        else:
+            out.write(json.dumps(user, ensure_ascii=False) + '\n')
+        count += 1
+
+    return count
+
+
+async def export_usage(user_storage: UserStorage, out, fmt: str) -> int:
+    """Сводка по тарифам (считается одним агрегирующим запросом в SQLite)"""
+    rows = await user_storage.get_usage_by_tariff()
+
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=['tariff_plan', 'users', 'requests_today', 'tokens_today', 'total_requests'])
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    return len(rows)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Выгрузка переписок и статистики в JSONL/CSV')
+    parser.add_argument('what', choices=['conversations', 'users', 'usage'])
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    parser.add_argument('--out', default='-', help='файл для записи (по умолчанию stdout)')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--shards', type=int, default=CHAT_SHARDS, help='на сколько шардов разложена история')
+    args = parser.parse_args()
+
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8', newline='')
+    started = time.perf_counter()
+
+    try:
+        if args.what == 'conversations':
+            count = await export_conversations(
+                create_chat_storage(args.db, args.shards, readonly=True), out, args.format
+            )
+        elif args.what == 'users':
+            count = await export_users(UserStorage(args.db, readonly=True), out, args.format)
+        else:
+            count = await export_usage(UserStorage(args.db, readonly=True), out, args.format)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f'✅ Выгружено записей: {count} за {time.perf_counter() - started:.1f}с', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
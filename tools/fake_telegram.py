@@ -0,0 +1,151 @@
+# Фейковый Telegram для локальной проверки вебхук-режима
+
+# python3 -m tools.fake_telegram serve --port 8081
+#     фейковый Bot API: отвечает "ok" на любой метод и считает вызовы
+#
+# python3 -m tools.fake_telegram send --url http://127.0.0.1:8080/webhook --chats 50 --messages 5
+#     отправляет синтетические апдейты на вебхук бота
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Minion", "username": "minion_test_bot"}
+
+SAMPLE_TEXTS = ['/start', '/settings', 'Привет! Как дела?', 'Что нового в мире?']
+
+
+# ============================================================================
+# ФЕЙКОВЫЙ BOT API
+# ============================================================================
+
+def fake_message(payload: dict) -> dict:
+    """Собирает минимальный объект Message, который примет aiogram"""
+    chat_id = int(payload.get('chat_id', 0))
+    return {
+        "message_id": random.randint(1, 2**31),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        "from": BOT_USER,
+        "text": payload.get('text', ''),
+    }
+
+
+async def handle_method(request: web.Request) -> web.Response:
+    method = request.match_info['method']
+    if request.content_type == 'application/json':
+        payload = await request.json()
+    else:
+        payload = dict(await request.post())
+
+    request.app['calls'][method] += 1
+
+    if method.lower() == 'getme':
+        result = BOT_USER
+    elif method.lower().startswith('send') and method.lower() not in ('sendmessagedraft', 'sendchataction'):
+        result = fake_message(payload)
+    else:
+        result = True
+
+    return web.json_response({"ok": True, "result": result})
+
+
+async def print_stats(app: web.Application):
+    while True:
+        await asyncio.sleep(5)
+        if app['calls']:
+            print('📊 Вызовы Bot API:', dict(app['calls']))
+
+
+async def serve(args):
+    app = web.Application()
+    app['calls'] = Counter()
+    app.router.add_post('/bot{token}/{method}', handle_method)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f'🤖 Фейковый Bot API слушает http://{args.host}:{args.port}')
+
+    try:
+        await print_stats(app)
+    finally:
+        await runner.cleanup()
+
+
+# ============================================================================
+# ОТПРАВИТЕЛЬ АПДЕЙТОВ
+# ============================================================================
+
+def fake_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}", "username": f"user{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        }
+    }
+
+
+async def send(args):
+    texts = [args.text] if args.text else SAMPLE_TEXTS
+    update_ids = itertools.count(1)
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send_chat(session: ClientSession, chat_id: int):
+        # Сообщения одного чата идут строго по очереди, как в Telegram
+        for _ in range(args.messages):
+            update = fake_update(next(update_ids), chat_id, random.choice(texts))
+            async with semaphore:
+                async with session.post(args.url, data=json.dumps(update), headers=headers) as resp:
+                    statuses[resp.status] += 1
+
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(send_chat(session, 10_000 + i) for i in range(args.chats)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    print(f'📨 Отправлено {total} апдейтов за {elapsed:.2f}с ({total / elapsed:.0f}/с), статусы: {dict(statuses)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Фейковый Telegram для локальных тестов')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub.add_parser('serve', help='фейковый Bot API')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8081)
+
+    send_parser = sub.add_parser('send', help='отправить апдейты на вебхук')
+    send_parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    send_parser.add_argument('--secret', default=None)
+    send_parser.add_argument('--chats', type=int, default=10)
+    send_parser.add_argument('--messages', type=int, default=3)
+    send_parser.add_argument('--concurrency', type=int, default=50)
+    send_parser.add_argument('--text', default=None, help='текст всех сообщений (по умолчанию - случайный из набора)')
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args) if args.command == 'serve' else send(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
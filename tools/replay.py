@@ -0,0 +1,297 @@
+# Воспроизведение записанного трафика (TRAFFIC_TRACE, см. app/traffic.py)
+
+# python3 -m tools.replay trace.jsonl                  # в реальном времени
+# python3 -m tools.replay trace.jsonl --speed 20       # в 20 раз быстрее
+# python3 -m tools.replay trace.jsonl --speed 100 --limit 5000 --record replayed.jsonl
+#
+# Апдейты подаются в настоящий диспетчер (bot.create_dispatcher: middleware
+# и app.handlers.router) с записанными интервалами, деленными на --speed.
+# Telegram - фейковый Bot API из tools/fake_telegram.py, LLM и поиск - заглушки,
+# которые отвечают за записанное время (тоже деленное на --speed) ответом
+# записанной длины. Ограничитель флуда ускоряется вместе с трафиком.
+# БД временная, рабочая database.db не трогается.
+#
+# Тексты в трассе не хранятся, вместо них - случайные слова той же длины.
+# Документы и нажатия кнопок пропускаются: их содержимое не записывается.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+
+from app import generate, traffic
+from app.middlewares import FLOOD_BURST, FLOOD_RATE, TokenBucket
+from app.serialization import loads
+from bot import create_dispatcher, init_storages
+from tools import fake_telegram
+
+# Типы апдейтов, которые можно воспроизвести
+REPLAYABLE = ('text', 'command')
+
+WORDS = [
+    'как', 'что', 'почему', 'сделать', 'нужно', 'бот', 'код', 'ошибка', 'python',
+    'сервер', 'данные', 'вопрос', 'пример', 'можно', 'лучше', 'работает', 'файл',
+    'запрос', 'ответ', 'новости', 'погода', 'курс', 'сегодня', 'объясни', 'помоги',
+]
+# Размер чанка фейкового стриминга LLM (символы)
+STREAM_CHUNK_CHARS = 20
+FAKE_SEARCH_RESULTS = "Источник: example.com\nЗаголовок: Пример\nОписание: Результат поиска для воспроизведения"
+
+# Запись трассы, которую сейчас воспроизводит задача апдейта
+current_record: ContextVar[Dict] = ContextVar('replay_record', default={})
+
+
+def synthetic_text(length: int, rng: random.Random) -> str:
+    """Случайные слова длиной ровно length символов"""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)[:max(length, 1)]
+
+
+def fake_chunk(content: Optional[str], usage=None) -> SimpleNamespace:
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=usage)
+
+
+class FakeCompletions:
+    """Заглушка chat.completions: роутер и генератор отвечают как в записи"""
+
+    def __init__(self, speed: float, rng: random.Random):
+        self.speed = speed
+        self.rng = rng
+
+    def delay(self, ms: float) -> float:
+        return ms / 1000 / self.speed
+
+    async def create(self, messages: List[Dict], stream: bool = False, **kwargs):
+        record = current_record.get()
+        if stream:
+            return self.stream(record)
+
+        await asyncio.sleep(self.delay(record.get('router_ms', 0)))
+        decision = {
+            "search_needed": bool(record.get('search')),
+            "queries": [synthetic_text(30, self.rng) for _ in range(record.get('queries', 1))],
+        }
+        message = SimpleNamespace(content=json.dumps(decision, ensure_ascii=False))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def stream(self, record: Dict):
+        first = self.delay(record.get('llm_first_ms', 0))
+        rest = max(self.delay(record.get('llm_ms', 0)) - first, 0)
+        answer = synthetic_text(record.get('answer_len', 200), self.rng)
+        chunks = [answer[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(answer), STREAM_CHUNK_CHARS)]
+
+        await asyncio.sleep(first)
+        for chunk in chunks:
+            yield fake_chunk(chunk)
+            await asyncio.sleep(rest / len(chunks))
+        yield fake_chunk(None, SimpleNamespace(total_tokens=record.get('tokens', 0)))
+
+
+def install_fake_backends(speed: float, rng: random.Random):
+    """Подменяет клиент LLM и веб-поиск в app.generate"""
+    async def fake_search(queries: List[str]):
+        await asyncio.sleep(current_record.get().get('search_ms', 0) / 1000 / speed)
+        return FAKE_SEARCH_RESULTS, [{"url": "https://example.com", "title": "example.com"}]
+
+    generate._client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(speed, rng)))
+    generate.search_web = fake_search
+
+
+def load_trace(path: str, limit: Optional[int]) -> List[Dict]:
+    with open(path, 'rb') as f:
+        records = [loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['t'])
+    return records[:limit] if limit else records
+
+
+class Updates:
+    """Собирает апдейты из записей: пользователи трассы получают последовательные ID"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.users: Dict[str, int] = {}
+        self.update_ids = itertools.count(1)
+
+    def user_id(self, record: Dict) -> int:
+        return self.users.setdefault(record.get('u', '-'), 10_000 + len(self.users))
+
+    def build(self, record: Dict) -> Update:
+        user_id = self.user_id(record)
+        update_id = next(self.update_ids)
+        if record['k'] == 'command':
+            text = record.get('cmd', '/start')
+        else:
+            text = synthetic_text(record.get('len', 1), self.rng)
+
+        user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        chat = {"id": -user_id, "type": "supergroup"} if record.get('g') else {"id": user_id, "type": "private"}
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": chat,
+                "from": user,
+                "text": text,
+            }
+        })
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(title: str, values: List[float]):
+    print(
+        f'  {title:<28} n={len(values):<6} p50={percentile(values, 0.5):8.1f}  '
+        f'p95={percentile(values, 0.95):8.1f}  max={max(values, default=0):8.1f} мс'
+    )
+
+
+async def start_fake_telegram() -> tuple:
+    app = web.Application()
+    app['calls'] = Counter()
+    app.router.add_post('/bot{token}/{method}', fake_telegram.handle_method)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, app['calls'], f'http://{host}:{port}'
+
+
+async def replay(args):
+    records = load_trace(args.trace, args.limit)
+    if not records:
+        sys.exit('Трасса пуста')
+
+    rng = random.Random(args.seed)
+    runner, calls, api_url = await start_fake_telegram()
+
+    # Без --record воспроизведение не должно дописывать в рабочую трассу
+    traffic.TRAFFIC_TRACE = args.record
+    install_fake_backends(args.speed, rng)
+
+    await init_storages()
+    bot = Bot(token='123456:REPLAY', session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    dp = create_dispatcher(run_maintenance=False, throttle=TokenBucket(FLOOD_RATE * args.speed, FLOOD_BURST))
+    workflow_data = {"dispatcher": dp, "bots": (bot,), **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+
+    updates = Updates(rng)
+    replayable = [record for record in records if record['k'] in REPLAYABLE]
+    skipped = Counter(record['k'] for record in records if record['k'] not in REPLAYABLE)
+
+    # Пользователи трассы уже зарегистрированы, /start не обязателен
+    user_storage = dp["user_storage"]
+    for record in replayable:
+        user_id = updates.user_id(record)
+        await user_storage.create_user(user_id, f'replay{user_id}')
+        if args.tariff != 'free':
+            await user_storage.update_subscription(user_id, args.tariff)
+
+    durations = defaultdict(list)
+    expected = defaultdict(list)
+    lags: List[float] = []
+    tasks = set()
+
+    async def play(record: Dict, update: Update):
+        current_record.set(record)
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        durations[record['k']].append((time.perf_counter() - started) * 1000)
+        expected[record['k']].append(record.get('ms', 0) / args.speed)
+
+    span = (records[-1]['t'] - records[0]['t']) / args.speed
+    print(
+        f'▶️ {len(replayable)} апдейтов, {len(updates.users)} пользователей, '
+        f'{span:.0f}с при ускорении {args.speed:g}x (пропущено: {dict(skipped) or 0})',
+        file=sys.stderr
+    )
+
+    base = replayable[0]['t'] if replayable else 0
+    started = time.perf_counter()
+    for i, record in enumerate(replayable):
+        target = (record['t'] - base) / args.speed
+        delay = target - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, -delay) * 1000)
+
+        task = asyncio.create_task(play(record, updates.build(record)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if i % 100 == 0:
+            print(f'\r  {i}/{len(replayable)}', end='', file=sys.stderr)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+
+    try:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    print(f'✅ Воспроизведено за {elapsed:.1f}с (трасса при {args.speed:g}x: {span:.1f}с)')
+    print('Время обработки апдейта: воспроизведение / запись, деленная на ускорение')
+    for kind in sorted(durations):
+        report(f'{kind}', durations[kind])
+        report(f'{kind} (запись)', expected[kind])
+    report('опоздание подачи апдейта', lags)
+    print(f'Вызовы Bot API: {dict(calls)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика с фейковыми бэкендами')
+    parser.add_argument('trace', help='файл трассы (TRAFFIC_TRACE)')
+    parser.add_argument('--speed', type=float, default=1.0, help='ускорение, например 1-100')
+    parser.add_argument('--limit', type=int, default=None, help='воспроизвести первые N записей')
+    parser.add_argument('--tariff', default='ultra', help='тариф пользователей трассы (ultra - без лимитов)')
+    parser.add_argument('--seed', type=int, default=0, help='зерно случайных текстов')
+    parser.add_argument('--record', default=None, help='записать трассу воспроизведения в файл')
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        sys.exit('--speed должен быть больше нуля')
+    args.trace = os.path.abspath(args.trace)
+    if args.record:
+        args.record = os.path.abspath(args.record)
+
+    # Временная БД: database.db открывается относительно текущего каталога
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            asyncio.run(replay(args))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Перераскладка истории чатов по другому числу шардов (офлайн, бот остановлен)
+#
+# python3 -m tools.reshard --to 4                 # из текущего CHAT_SHARDS в 4 шарда
+# python3 -m tools.reshard --from 4 --to 8
+# python3 -m tools.reshard --from 4 --to 1        # обратно в database.db
+# python3 -m tools.reshard --from 1 --to 4 --drop-source
+#
+# Строки копируются как есть (сжатые истории не перекодируются) порциями,
+# каждая порция - одна транзакция в каждом целевом шарде. Новые шарды пишутся
+# в новые файлы (число шардов входит в имя), исходные не меняются до --drop-source,
+# поэтому прерванный запуск можно просто повторить.
+# После успешного запуска поставьте CHAT_SHARDS=<to> и запустите бота
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List
+
+import aiosqlite
+
+from app.database.base import DB_PATH
+from app.database.chat_storage import ChatStorage
+from app.database.sharded_chat_storage import CHAT_SHARDS, shard_index, shard_path
+
+
+def storage_paths(db_path: str, shards: int) -> List[str]:
+    """Файлы, в которых лежит история при данном числе шардов"""
+    if shards == 1:
+        return [db_path]
+    return [shard_path(db_path, shard, shards) for shard in range(shards)]
+
+
+async def count_rows(path: str) -> int:
+    async with aiosqlite.connect(path) as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM database")
+        return (await cursor.fetchone())[0]
+
+
+async def copy_shard(source: str, targets: List[str], batch_size: int) -> int:
+    """
+    Копирует строки одного исходного файла в целевые шарды
+
+    Returns:
+        int: сколько строк скопировано
+    """
+    copied = 0
+    last_key = (-2**63, -2**63, -2**63)
+
+    async with aiosqlite.connect(f"file:{source}?mode=ro", uri=True) as src:
+        while True:
+            cursor = await src.execute("""
+                SELECT user_id, chat_id, thread_id, messages, updated_at FROM database
+                WHERE (user_id, chat_id, thread_id) > (?, ?, ?)
+                ORDER BY user_id, chat_id, thread_id
+                LIMIT ?
+            """, (*last_key, batch_size))
+            rows = await cursor.fetchall()
+            if not rows:
+                break
+
+            by_target: Dict[int, list] = {}
+            for row in rows:
+                by_target.setdefault(shard_index(row[0], len(targets)), []).append(row)
+
+            for target, target_rows in by_target.items():
+                async with aiosqlite.connect(targets[target]) as dst:
+                    # Upsert, а не INSERT OR REPLACE: повторный запуск не должен
+                    # второй раз увеличить счетчики тем (см. ChatStorage._create_thread_counters)
+                    await dst.executemany("""
+                        INSERT INTO database
+                        (user_id, chat_id, thread_id, messages, updated_at)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (user_id, chat_id, thread_id) DO UPDATE SET
+                            messages = excluded.messages,
+                            updated_at = excluded.updated_at
+                    """, target_rows)
+                    await dst.commit()
+
+            copied += len(rows)
+            last_key = tuple(rows[-1][:3])
+            print(f'\r  {source}: {copied}', end='', file=sys.stderr)
+
+    print(file=sys.stderr)
+    return copied
+
+
+async def drop_source(db_path: str, sources: List[str]):
+    for path in sources:
+        if path == db_path:
+            # В основной БД остальные таблицы, удаляем только историю и ее счетчики
+            async with aiosqlite.connect(path) as conn:
+                for table in ('database', 'thread_counts', 'thread_total'):
+                    await conn.execute(f"DROP TABLE IF EXISTS {table}")
+                await conn.commit()
+            continue
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Перераскладка истории чатов по шардам')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--from', dest='source', type=int, default=CHAT_SHARDS, help='текущее число шардов')
+    parser.add_argument('--to', dest='target', type=int, required=True, help='новое число шардов')
+    parser.add_argument('--batch', type=int, default=1000, help='строк за транзакцию')
+    parser.add_argument('--drop-source', action='store_true', help='удалить исходные шарды после проверки')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        sys.exit('Число шардов не меняется')
+
+    sources = storage_paths(args.db, args.source)
+    targets = storage_paths(args.db, args.target)
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        sys.exit(f'Нет исходных файлов: {", ".join(missing)}')
+
+    print('⚠️ Бот должен быть остановлен: записи во время копирования потеряются', file=sys.stderr)
+    started = time.perf_counter()
+
+    for path in targets:
+        target = ChatStorage(path)
+        await target.enable_wal()
+        await target.init_db()
+
+    copied = 0
+    for path in sources:
+        copied += await copy_shard(path, targets, args.batch)
+
+    source_rows = sum([await count_rows(path) for path in sources])
+    target_rows = sum([await count_rows(path) for path in targets])
+    print(
+        f'✅ Скопировано {copied} тем из {args.source} в {args.target} шардов '
+        f'за {time.perf_counter() - started:.1f}с (было {source_rows}, стало {target_rows})',
+        file=sys.stderr
+    )
+    if target_rows != source_rows:
+        sys.exit(
+            '❌ Количество тем не совпадает (в целевых файлах остались темы от прошлой раскладки?), '
+            'исходные шарды не тронуты'
+        )
+
+    if args.drop_source:
+        await drop_source(args.db, sources)
+        print('🗑️ Исходные шарды удалены', file=sys.stderr)
+
+    print(f'Дальше: CHAT_SHARDS={args.target} и перезапуск бота', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
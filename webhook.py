@@ -0,0 +1,279 @@
+# Вебхук-режим с пулом процессов-воркеров
+
+# source .venv/bin/activate && WORKERS=4 python3 webhook.py
+#
+# Главный процесс принимает апдейты по HTTP и раскидывает их по воркерам.
+# Апдейты одного чата/темы всегда попадают в один и тот же воркер, поэтому
+# порядок сообщений и состояние пользователя (FSM) остаются корректными.
+# Все воркеры работают с одной SQLite БД в режиме WAL.
+#
+# Локальная проверка без Telegram:
+#   python3 -m tools.fake_telegram serve            # фейковый Bot API на :8081
+#   TG_API_SERVER=http://127.0.0.1:8081 python3 webhook.py
+#   python3 -m tools.fake_telegram send --chats 50 --messages 5
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+
+from aiohttp import web
+from aiogram.types import Update
+
+from bot import setup_logging, create_bot, create_dispatcher, init_storages, set_commands, warm_up
+from app.inflight import SHUTDOWN_GRACE
+from app.startup import startup_profile
+from app.serialization import loads, DECODE_ERRORS
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Публичный адрес (https://example.com). Если не задан - вебхук в Telegram не регистрируется
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+# Максимум апдейтов в очереди одного воркера, дальше отвечаем 503 и Telegram повторит позже
+WORKER_QUEUE_SIZE = 1000
+# Как часто главный процесс проверяет, живы ли воркеры (секунды)
+WORKER_CHECK_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# МАРШРУТИЗАЦИЯ АПДЕЙТОВ
+# ============================================================================
+
+def get_routing_key(update: dict) -> tuple[int, int]:
+    """
+    Определяет, к какому чату/теме относится апдейт
+
+    Args:
+        update: апдейт Telegram в виде словаря
+
+    Returns:
+        tuple: (chat_id, thread_id), для апдейтов без чата - (user_id, 0)
+    """
+    for field, event in update.items():
+        if not isinstance(event, dict):
+            continue
+
+        # У callback_query чат лежит во вложенном сообщении
+        message = event.get('message') if field == 'callback_query' else event
+        if isinstance(message, dict) and 'chat' in message:
+            return message['chat']['id'], message.get('message_thread_id') or 0
+
+        user = event.get('from')
+        if user:
+            return user['id'], 0
+
+    return update.get('update_id', 0), 0
+
+
+def pick_worker(key: tuple[int, int], workers: int) -> int:
+    """
+    Выбирает воркер для чата/темы
+
+    crc32 вместо hash(), чтобы распределение не зависело от процесса
+    """
+    return zlib.crc32(f"{key[0]}:{key[1]}".encode()) % workers
+
+
+# ============================================================================
+# ВОРКЕР
+# ============================================================================
+
+def worker_main(index: int, updates: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    # Остановкой воркеров управляет главный процесс (через None в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging(f'bot.worker{index}.log')
+    try:
+        asyncio.run(run_worker(index, updates))
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_worker(index: int, updates: multiprocessing.Queue):
+    """
+    Получает сырые апдейты из очереди и обрабатывает их своим диспетчером
+
+    Апдейты запускаются задачами в порядке поступления - так же,
+    как это делает dp.start_polling
+    """
+    bot = create_bot()
+    dp = create_dispatcher(run_maintenance=index == 0)
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    await warm_up(bot)
+    startup_profile.mark('warm-up')
+    startup_profile.report()
+
+    workflow_data = {"dispatcher": dp, "bots": (bot,), **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    logger.info(f'Воркер {index} запущен (pid {os.getpid()})')
+
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+
+            try:
+                update = Update.model_validate(loads(raw), context={"bot": bot})
+            except Exception as e:
+                logger.error(f'Воркер {index}: не удалось разобрать апдейт: {e}')
+                continue
+
+            task = asyncio.create_task(dp.feed_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        try:
+            # Начатые генерации дорабатывают до SHUTDOWN_GRACE,
+            # не успевшие сохраняются в on_shutdown
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+            # Остальным начатым апдейтам даем доработать
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await bot.session.close()
+            logger.info(f'Воркер {index} остановлен')
+
+
+# ============================================================================
+# ГЛАВНЫЙ ПРОЦЕСС
+# ============================================================================
+
+async def handle_update(request: web.Request) -> web.Response:
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return web.Response(status=401)
+
+    raw = await request.read()
+    try:
+        update = loads(raw)
+    except DECODE_ERRORS:
+        return web.Response(status=400)
+
+    queues = request.app['queues']
+    index = pick_worker(get_routing_key(update), len(queues))
+
+    try:
+        queues[index].put_nowait(raw)
+    except queue.Full:
+        # Telegram повторит доставку, порядок внутри чата не нарушится
+        logger.warning(f'Очередь воркера {index} переполнена')
+        return web.Response(status=503)
+
+    return web.Response()
+
+
+def start_worker(ctx, index: int, updates: multiprocessing.Queue) -> multiprocessing.Process:
+    process = ctx.Process(target=worker_main, args=(index, updates), name=f'worker-{index}', daemon=True)
+    process.start()
+    return process
+
+
+async def supervise_workers(ctx, queues: list, processes: list):
+    """
+    Перезапускает упавшие воркеры
+
+    Упавшему воркеру дается новая очередь: процесс почти всегда умирает внутри
+    updates.get() с захваченной блокировкой чтения, и новый воркер на старой
+    очереди завис бы навсегда. Апдейты, оставшиеся в старой очереди, теряются -
+    Telegram уже получил на них 200. Списки queues и processes меняются на месте,
+    handle_update сразу видит новую очередь
+    """
+    while True:
+        await asyncio.sleep(WORKER_CHECK_INTERVAL)
+        for index, process in enumerate(processes):
+            if process.is_alive():
+                continue
+
+            logger.error(f'Воркер {index} завершился с кодом {process.exitcode}, перезапускаем')
+            old = queues[index]
+            queues[index] = ctx.Queue(maxsize=WORKER_QUEUE_SIZE)
+            # Иначе главный процесс при выходе ждал бы, пока фоновый поток допишет в мертвую очередь
+            old.cancel_join_thread()
+            old.close()
+            processes[index] = start_worker(ctx, index, queues[index])
+
+
+async def stop_worker(updates: multiprocessing.Queue, process: multiprocessing.Process):
+    """Просит воркер остановиться (None в очереди) и ждет его завершения"""
+    try:
+        updates.put_nowait(None)
+    except queue.Full:
+        # Очередь полна: ждем места в потоке, не блокируя цикл событий.
+        # Не дождались - воркер будет остановлен через terminate
+        try:
+            await asyncio.to_thread(updates.put, None, True, SHUTDOWN_GRACE)
+        except queue.Full:
+            logger.warning(f'{process.name}: очередь переполнена, остановить штатно не удалось')
+
+    # Воркер ждет генерации до SHUTDOWN_GRACE и еще сохраняет прерванные
+    await asyncio.to_thread(process.join, SHUTDOWN_GRACE + 15)
+    if process.is_alive():
+        process.terminate()
+
+
+async def main():
+    await init_storages()
+    startup_profile.mark('schema')
+
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(WORKERS)]
+    processes = [start_worker(ctx, i, q) for i, q in enumerate(queues)]
+
+    bot = create_bot()
+    try:
+        await set_commands(bot)
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=create_dispatcher().resolve_used_update_types()
+            )
+            logger.info(f'Вебхук зарегистрирован: {WEBHOOK_URL}{WEBHOOK_PATH}')
+    finally:
+        await bot.session.close()
+
+    app = web.Application()
+    app['queues'] = queues
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    startup_profile.mark('server')
+    startup_profile.report()
+    logger.info(f'Бот запущен в вебхук-режиме на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, воркеров: {WORKERS}')
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor = asyncio.create_task(supervise_workers(ctx, queues, processes))
+    try:
+        await stop.wait()
+        logger.info('Останавливаем вебхук и воркеры..')
+    finally:
+        supervisor.cancel()
+        await runner.cleanup()
+        await asyncio.gather(*(stop_worker(q, process) for q, process in zip(queues, processes)))
+
+
+if __name__ == '__main__':
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Exit")